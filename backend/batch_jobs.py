@@ -0,0 +1,234 @@
+import ipaddress
+import socket
+import threading
+import time
+import urllib.parse
+import urllib.request
+import uuid
+
+MAX_ACTIVE_JOBS_PER_CLIENT = 2
+MAX_JOB_IMAGES = 500
+URL_FETCH_TIMEOUT = 20.0
+URL_MAX_BYTES = 25 * 1024 * 1024
+# A queued/running job whose driver has not recorded anything for this long is dead
+# (crashed, timed out, cancelled): it is marked failed and stops counting against its client
+JOB_STALE_S = 15 * 60
+# Per-client submission lock (modal.Dict key); expires in case its holder crashed
+CREATE_LOCK_TTL_S = 10.0
+
+
+class TooManyJobs(Exception):
+    pass
+
+
+def _discard(store, key):
+    """store.pop(key) that tolerates missing keys (modal.Dict.pop has no default)."""
+    try:
+        store.pop(key)
+    except KeyError:
+        pass
+
+
+def check_public_url(url):
+    """
+    Raises ValueError unless `url` is http(s) and every address its host resolves to is
+    public: job URLs come from clients, and must not reach loopback, private networks
+    or link-local metadata endpoints (169.254.169.254) from inside the server.
+    """
+    parsed = urllib.parse.urlsplit(url)
+    if parsed.scheme not in ("http", "https") or not parsed.hostname:
+        raise ValueError(f"Unsupported image URL: {url}")
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(parsed.hostname, parsed.port or 80, proto=socket.IPPROTO_TCP)}
+    except socket.gaierror as e:
+        raise ValueError(f"Cannot resolve {parsed.hostname}: {e}")
+    for address in addresses:
+        check_public_address(address, parsed.hostname)
+
+
+def check_public_address(address, host=None):
+    """Raises ValueError unless `address` (an IP string) is a public unicast address."""
+    ip = ipaddress.ip_address(address.split("%")[0])
+    if not ip.is_global or ip.is_multicast:
+        raise ValueError(f"Image URL host {host or address} resolves to a non-public address")
+
+
+class _PublicRedirectHandler(urllib.request.HTTPRedirectHandler):
+    """Re-checks every redirect target, so a public URL cannot bounce into the private network."""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        check_public_url(newurl)
+        return super().redirect_request(req, fp, code, msg, headers, newurl)
+
+
+_opener = urllib.request.build_opener(_PublicRedirectHandler)
+
+
+def fetch_url(url, max_bytes=URL_MAX_BYTES, timeout=URL_FETCH_TIMEOUT):
+    """Downloads one public image URL, refusing anything larger than max_bytes."""
+    check_public_url(url)
+    with _opener.open(url, timeout=timeout) as resp:
+        data = resp.read(max_bytes + 1)
+    if len(data) > max_bytes:
+        raise ValueError(f"Image exceeds the {max_bytes} byte limit")
+    return data
+
+
+class JobStore:
+    """
+    Bulk-analysis job bookkeeping on top of any dict-like store (a plain dict in
+    the FastAPI backend, a modal.Dict for the Modal brain).
+
+    Layout:
+        job:<id>            job meta (status, counts, options)
+        job:<id>:r:<seq>    the seq-th finished item {"index", "result" | "error"}
+        client:<client_id>  ids of the client's jobs
+        lock:<client_id>    held while a job is created (check + insert are one step)
+
+    Results are stored in completion order, so a poller passes back the `next`
+    cursor it got and only receives what finished since. There must be one writer
+    per job (the job's driver loop): meta updates are read-modify-write. The one
+    exception is a stale job (no update for stale_after seconds), which anyone may
+    mark failed.
+    """
+
+    def __init__(self, store=None, max_active_per_client=MAX_ACTIVE_JOBS_PER_CLIENT, stale_after=JOB_STALE_S):
+        self.store = {} if store is None else store
+        self.max_active_per_client = max_active_per_client
+        self.stale_after = stale_after
+        self._lock = threading.Lock()
+
+    def create(self, client_id, total, options=None):
+        with self._client_lock(client_id):
+            client_key = f"client:{client_id}"
+            jobs = [job_id for job_id in self.store.get(client_key, []) if self._is_active(job_id)]
+            if len(jobs) >= self.max_active_per_client:
+                raise TooManyJobs(f"Client already has {len(jobs)} running jobs (limit {self.max_active_per_client})")
+
+            job_id = uuid.uuid4().hex
+            now = time.time()
+            self.store[f"job:{job_id}"] = {
+                "job_id": job_id,
+                "client_id": client_id,
+                "status": "queued",
+                "total": total,
+                "done": 0,
+                "failed": 0,
+                "options": options or {},
+                "error": None,
+                "created": now,
+                "updated": now
+            }
+            self.store[client_key] = jobs + [job_id]
+            return job_id
+
+    def get(self, job_id):
+        return self.store.get(f"job:{job_id}")
+
+    def set_status(self, job_id, status, error=None):
+        meta = self.store[f"job:{job_id}"]
+        meta.update({"status": status, "error": error, "updated": time.time()})
+        self.store[f"job:{job_id}"] = meta
+
+    def record(self, job_id, index, result=None, error=None):
+        """Stores one finished item; returns the updated meta."""
+        meta = self.store[f"job:{job_id}"]
+        seq = meta["done"] + meta["failed"]
+        item = {"index": index, "error": error} if error else {"index": index, "result": result}
+        self.store[f"job:{job_id}:r:{seq}"] = item
+        meta["failed" if error else "done"] += 1
+        if meta["done"] + meta["failed"] >= meta["total"]:
+            meta["status"] = "completed"
+        elif meta["status"] == "queued":
+            meta["status"] = "running"
+        meta["updated"] = time.time()
+        self.store[f"job:{job_id}"] = meta
+        return meta
+
+    def status(self, job_id, since=0, limit=100):
+        """Progress plus up to `limit` results finished after cursor `since`."""
+        meta = self.get(job_id)
+        if meta is None:
+            return None
+        finished = meta["done"] + meta["failed"]
+        since = max(0, int(since))
+        end = min(finished, since + max(1, int(limit)))
+        results = [self.store.get(f"job:{job_id}:r:{seq}") for seq in range(since, end)]
+        return {
+            **{k: v for k, v in meta.items() if k != "options"},
+            "progress": round(finished / meta["total"], 4) if meta["total"] else 1.0,
+            "results": [r for r in results if r is not None],
+            "next": end
+        }
+
+    def prune(self, max_age_s):
+        """
+        Marks stale jobs failed, then drops finished jobs (meta + results) not updated
+        for max_age_s seconds.
+        """
+        cutoff = time.time() - max_age_s
+        for key in list(self.store.keys()):
+            if not key.startswith("job:") or key.count(":") != 1:
+                continue
+            meta = self.store.get(key)
+            if meta is None:
+                continue
+            if meta["status"] in ("queued", "running"):
+                self._fail_if_stale(meta)
+                continue
+            if meta["updated"] >= cutoff:
+                continue
+            for seq in range(meta["done"] + meta["failed"]):
+                _discard(self.store, f"{key}:r:{seq}")
+            _discard(self.store, key)
+
+    def _is_active(self, job_id):
+        meta = self.get(job_id)
+        return meta is not None and meta["status"] in ("queued", "running") and not self._fail_if_stale(meta)
+
+    def _fail_if_stale(self, meta):
+        """Marks an active job whose driver stopped reporting failed; returns True if it did."""
+        if not self.stale_after or time.time() - meta["updated"] < self.stale_after:
+            return False
+        print(f"⚠️ Job {meta['job_id']} has not reported for {self.stale_after:.0f}s, marking it failed")
+        self.set_status(meta["job_id"], "failed", error="Job stopped reporting progress")
+        return True
+
+    def _client_lock(self, client_id):
+        """
+        Serializes create() per client. A plain dict lives in one process, so a thread
+        lock is enough; a shared store (modal.Dict) gets an expiring lock key claimed
+        with put(skip_if_exists=True), which only one writer can win.
+        """
+        if isinstance(self.store, dict):
+            return self._lock
+        return _StoreLock(self.store, f"lock:{client_id}")
+
+
+class _StoreLock:
+    def __init__(self, store, key, ttl=CREATE_LOCK_TTL_S, wait=5.0):
+        self.store = store
+        self.key = key
+        self.ttl = ttl
+        self.wait = wait
+        self.token = uuid.uuid4().hex
+
+    def __enter__(self):
+        deadline = time.time() + self.wait
+        while True:
+            if self.store.put(self.key, {"token": self.token, "expires": time.time() + self.ttl}, skip_if_exists=True):
+                return self
+            held = self.store.get(self.key)
+            if held is not None and held["expires"] < time.time():
+                # The holder died without releasing: drop its lock and compete again
+                _discard(self.store, self.key)
+                continue
+            if time.time() > deadline:
+                raise TooManyJobs("Another job is being created for this client, try again")
+            time.sleep(0.05)
+
+    def __exit__(self, *exc):
+        held = self.store.get(self.key)
+        if held is not None and held["token"] == self.token:
+            _discard(self.store, self.key)
+        return False
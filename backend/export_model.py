@@ -0,0 +1,120 @@
+"""
+Exports backend/models/best.pt to CPU-optimized inference artifacts and checks
+their accuracy against the PyTorch model.
+
+    python export_model.py --format openvino --int8     # int8 PTQ, calibrated on valid/
+    python export_model.py --format onnx
+    python export_model.py --format openvino --check-only
+
+LacqrPredictor picks up whichever artifact exists at startup (see
+inference.resolve_main_weights). Writes models/export_report.json with the
+mask/box mAP of each artifact, the delta vs best.pt and CPU latency.
+"""
+import argparse
+import json
+import time
+from pathlib import Path
+
+from ultralytics import YOLO
+
+BACKEND_DIR = Path(__file__).resolve().parent
+MODELS_DIR = BACKEND_DIR / "models"
+PT_WEIGHTS = MODELS_DIR / "best.pt"
+DATA_YAML = BACKEND_DIR.parent / "lacqrtraining_dataset_v3" / "data.yaml"
+REPORT_PATH = MODELS_DIR / "export_report.json"
+
+# Largest acceptable mask mAP50-95 drop before an artifact is flagged
+MAX_MAP_DROP = 0.01
+
+
+def artifact_path(fmt, int8=False):
+    if fmt == "onnx":
+        return MODELS_DIR / "best.onnx"
+    return MODELS_DIR / ("best_int8_openvino_model" if int8 else "best_openvino_model")
+
+
+def export(fmt, int8=False, imgsz=640):
+    model = YOLO(str(PT_WEIGHTS))
+    print(f"📦 Exporting {PT_WEIGHTS.name} -> {fmt}{' (int8)' if int8 else ''}...")
+    kwargs = {"format": fmt, "imgsz": imgsz, "dynamic": True}
+    if int8:
+        if fmt != "openvino":
+            raise ValueError("int8 post-training quantization is only supported for the OpenVINO export")
+        # NNCF calibrates on the dataset's val split (lacqrtraining_dataset_v3/valid)
+        kwargs.update({"int8": True, "data": str(DATA_YAML)})
+    exported = model.export(**kwargs)
+    print(f"✅ Exported to {exported}")
+    return Path(exported)
+
+
+def evaluate(weights, imgsz=640):
+    """Validation metrics + CPU latency for one set of weights on lacqrtraining_dataset_v3/valid."""
+    model = YOLO(str(weights), task="segment")
+    started = time.perf_counter()
+    metrics = model.val(data=str(DATA_YAML), split="val", imgsz=imgsz, batch=1, device="cpu", plots=False, verbose=False)
+    return {
+        "weights": str(Path(weights).relative_to(BACKEND_DIR)),
+        "mask_map50_95": round(float(metrics.seg.map), 4),
+        "mask_map50": round(float(metrics.seg.map50), 4),
+        "box_map50_95": round(float(metrics.box.map), 4),
+        "inference_ms_per_image": round(float(metrics.speed["inference"]), 2),
+        "total_ms_per_image": round(sum(float(v) for v in metrics.speed.values()), 2),
+        "eval_seconds": round(time.perf_counter() - started, 1)
+    }
+
+
+def accuracy_check(artifact, imgsz=640):
+    reference = evaluate(PT_WEIGHTS, imgsz)
+    candidate = evaluate(artifact, imgsz)
+    delta = round(candidate["mask_map50_95"] - reference["mask_map50_95"], 4)
+    report = {
+        "reference": reference,
+        "candidate": candidate,
+        "mask_map50_95_delta": delta,
+        "speedup": round(reference["total_ms_per_image"] / candidate["total_ms_per_image"], 2) if candidate["total_ms_per_image"] else None,
+        "passed": delta >= -MAX_MAP_DROP
+    }
+    status = "✅ PASS" if report["passed"] else "❌ FAIL"
+    print(f"{status}: mask mAP50-95 {reference['mask_map50_95']} -> {candidate['mask_map50_95']} ({delta:+.4f}), "
+          f"{reference['total_ms_per_image']}ms -> {candidate['total_ms_per_image']}ms per image")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export best.pt for CPU inference")
+    parser.add_argument("--format", choices=["onnx", "openvino"], default="openvino")
+    parser.add_argument("--int8", action="store_true", help="int8 PTQ calibrated on the valid split (OpenVINO)")
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--check-only", action="store_true", help="Skip export, only re-run the accuracy check")
+    args = parser.parse_args()
+
+    if not PT_WEIGHTS.exists():
+        print(f"❌ Error: {PT_WEIGHTS} not found")
+        return
+
+    artifact = artifact_path(args.format, args.int8)
+    if not args.check_only:
+        artifact = export(args.format, args.int8, args.imgsz)
+    elif not artifact.exists():
+        print(f"❌ Error: {artifact} not found, export it first")
+        return
+
+    report = accuracy_check(artifact, args.imgsz)
+
+    reports = {}
+    if REPORT_PATH.exists():
+        with open(REPORT_PATH) as f:
+            reports = json.load(f)
+    reports[artifact.name] = report
+    with open(REPORT_PATH, "w") as f:
+        json.dump(reports, f, indent=2)
+    print(f"💾 Report written to {REPORT_PATH}")
+
+    if not report["passed"]:
+        # Keep the artifact for inspection but make sure nobody serves it by accident
+        print(f"⚠️ {artifact.name} lost more than {MAX_MAP_DROP} mask mAP; "
+              f"LacqrPredictor will skip it while export_report.json marks it as failed.")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,57 +1,222 @@
 from ultralytics import YOLO
+import numpy as np
+import cv2
+import json
 import os
+from mask_encoding import encode_masks
+from pricing_features import extract_features
+from model_pool import ModelPool
+
+MODELS_DIR = os.path.join(os.path.dirname(__file__), 'models')
+
+# Startup preference order for the main model. Exported CPU artifacts come from export_model.py.
+INFERENCE_BACKENDS = {
+    "openvino_int8": "best_int8_openvino_model",
+    "openvino": "best_openvino_model",
+    "onnx": "best.onnx",
+    "torch": "best.pt",
+}
+
+
+def export_report(artifact_name):
+    """Accuracy check recorded by export_model.py for an artifact ({} if never checked)."""
+    report_path = os.path.join(MODELS_DIR, 'export_report.json')
+    if not os.path.exists(report_path):
+        return {}
+    try:
+        with open(report_path) as f:
+            return json.load(f).get(artifact_name, {})
+    except (OSError, ValueError):
+        return {}
+
+
+def _export_passed(artifact_name):
+    """An artifact is servable unless its accuracy check failed."""
+    return export_report(artifact_name).get("passed", True)
+
+
+def resolve_main_weights(backend=None):
+    """
+    Picks the main model artifact. LACQR_INFERENCE_BACKEND selects one explicitly
+    (openvino_int8 / openvino / onnx / torch); "auto" (default) takes the first
+    existing artifact in INFERENCE_BACKENDS order that passed its accuracy check.
+    Returns (backend_name, path). An unusable explicit choice falls back to the trained
+    best.pt; the base YOLO11m-seg weights are only used when best.pt itself is missing.
+    """
+    backend = backend or os.environ.get("LACQR_INFERENCE_BACKEND", "auto")
+    if backend != "auto" and backend not in INFERENCE_BACKENDS:
+        raise ValueError(f"Unknown inference backend '{backend}', expected one of {['auto', *INFERENCE_BACKENDS]}")
+    candidates = INFERENCE_BACKENDS.items() if backend == "auto" else [(backend, INFERENCE_BACKENDS[backend])]
+    for name, artifact in candidates:
+        path = os.path.join(MODELS_DIR, artifact)
+        if os.path.exists(path) and (name == "torch" or _export_passed(artifact)):
+            return name, path
+
+    trained = os.path.join(MODELS_DIR, INFERENCE_BACKENDS["torch"])
+    if os.path.exists(trained):
+        print(f"⚠️ Backend '{backend}' has no usable artifact in {MODELS_DIR}, serving the trained best.pt")
+        return "torch", trained
+    return "torch", 'yolo11m-seg.pt'
+
 
 class LacqrPredictor:
     def __init__(self):
         # Load Main Model
-        # Check for custom trained model in backend/models/
-        custom_model_path = os.path.join(os.path.dirname(__file__), 'models', 'best.pt')
-        
-        if os.path.exists(custom_model_path):
-            print(f"✅ Loading Custom Trained Model: {custom_model_path}")
-            self.main_model = YOLO(custom_model_path)
+        # Prefer an exported CPU artifact in backend/models/, then the custom trained best.pt
+        self.backend, self.main_weights = resolve_main_weights()
+
+        if os.path.exists(self.main_weights):
+            print(f"✅ Loading Custom Trained Model ({self.backend}): {self.main_weights}")
+            report = export_report(os.path.basename(self.main_weights)) if self.backend != "torch" else {}
+            if report:
+                print(f"   Accuracy check vs best.pt: mask mAP50-95 {report['mask_map50_95_delta']:+.4f}, {report['speedup']}x faster")
+            elif self.backend != "torch":
+                print("   ⚠️ No accuracy check on record, run export_model.py --check-only")
         else:
             print("⚠️ Custom model not found. Loading Base YOLO11m-seg...")
-            self.main_model = YOLO('yolo11m-seg.pt') 
-            
-        self.retry_model = None # Lazy load strictly for retries to save resources
+        self.retry_weights = 'yolo11x-seg.pt'
+
+        # Model pool: main model pinned, the X-Large retry model loads lazily (or in the
+        # background when a scan looks likely to be retried) and is evicted under RAM pressure
+        self.pool = ModelPool(
+            # Exported graphs carry no task metadata guarantees, so state it explicitly
+            loader=lambda weights: YOLO(weights, task='segment'),
+            ram_budget_mb=float(os.environ.get("LACQR_MODEL_RAM_BUDGET_MB", 4096))
+        )
+        self.pool.register("main", self.main_weights, pinned=True)
+        self.pool.register("retry", self.retry_weights)
+        # LACQR_PRELOAD_MODELS="" defers even the main model to the first request (benchmarks, tests)
+        if "main" in os.environ.get("LACQR_PRELOAD_MODELS", "main").split(","):
+            self.pool.get("main")
+
+        # Scans below this mean confidence are likely to be retried -> pre-warm the retry model
+        self.retry_warm_confidence = float(os.environ.get("LACQR_RETRY_WARM_CONFIDENCE", 0.5))
+        if os.environ.get("LACQR_WARM_RETRY_ON_START", "0") == "1":
+            self.pool.warm_async("retry")
+
+    def config_fingerprint(self, is_retry=False):
+        """Identifies the model that would serve a request (used in result cache keys)."""
+        weights = self.retry_weights if is_retry else self.main_weights
+        mtime = os.path.getmtime(weights) if os.path.exists(weights) else None
+        return {
+            "weights": os.path.basename(weights),
+            "backend": "torch" if is_retry else self.backend,
+            "mtime": mtime
+        }
+
+    def get_model(self, is_retry=False):
+        """Context manager holding the model for one inference (it cannot be evicted meanwhile)."""
+        if is_retry:
+            print("Refining scan with X-Large Model...")
+            # The "Nuclear Option": resident if warmed, otherwise loaded (and warmed) now
+            return self.pool.acquire("retry")
+        return self.pool.acquire("main")
 
-    def predict(self, image_path, is_retry=False):
+    @staticmethod
+    def load_image(source):
+        """
+        Normalizes an input into something YOLO can consume without touching disk.
+        - bytes / bytearray / memoryview: decoded in memory (format sniffed from content, not filename)
+        - np.ndarray: assumed to be an already-decoded BGR image
+        - str / PathLike: passed through (YOLO reads the file)
+        """
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            image = cv2.imdecode(np.frombuffer(source, dtype=np.uint8), cv2.IMREAD_COLOR)
+            if image is None:
+                raise ValueError("Could not decode image data")
+            return image
+        if isinstance(source, np.ndarray):
+            if source.ndim == 2:
+                return cv2.cvtColor(source, cv2.COLOR_GRAY2BGR)
+            return source
+        return source
+
+    def predict(self, image, is_retry=False, **options):
         """
         Runs inference on the nail image.
+        `image` may be raw encoded bytes, a decoded BGR array or a file path.
         If is_retry is True, loads the heavier X-Large model for maximum accuracy.
+        `options` are forwarded to process_results (e.g. mask_format).
         """
-        if is_retry:
-            print("Refining scan with X-Large Model...")
-            if self.retry_model is None:
-                 # Load the "Nuclear Option" only when needed
-                 self.retry_model = YOLO('yolo11x-seg.pt')
-            model = self.retry_model
-        else:
-            model = self.main_model
+        return self.predict_batch([image], is_retry=is_retry, options=[options])[0]
+
+    def predict_batch(self, images, is_retry=False, traces=None, options=None):
+        """
+        Runs ONE batched forward pass over several images (used by the scheduler).
+        Returns one process_results() dict per input, in order.
+        `traces` (optional, one per image) receive the preprocess/inference/postprocess breakdown.
+        `options` (optional, one dict per image) are forwarded to process_results.
+        """
+        sources = [self.load_image(image) for image in images]
 
         # Run Inference
-        results = model(image_path)
+        with self.get_model(is_retry) as model:
+            results = model(sources, batch=len(sources), verbose=False)
         
         # Process results to extract specific nail data
-        return self.process_results(results)
+        outputs = []
+        for i, r in enumerate(results):
+            trace = traces[i] if traces else None
+            kwargs = (options[i] if options else None) or {}
+            if trace is None:
+                outputs.append(self.process_results([r], **kwargs))
+                continue
 
-    def process_results(self, results):
-        output_data = {
-            "masks": [], # For shape analysis
-            "boxes": [], # For location
-            "confidence": 0.0
-        }
+            # Ultralytics reports per-image milliseconds for each phase
+            for phase in ("preprocess", "inference", "postprocess"):
+                trace.add_span(f"yolo.{phase}", r.speed.get(phase))
+            with trace.span("serialize"):
+                outputs.append(self.process_results([r], **kwargs))
+            trace.set("image_size", [int(r.orig_shape[1]), int(r.orig_shape[0])])
+            trace.set("detections", len(r.boxes))
+            trace.set("batch_size", len(sources))
+            trace.set("model", os.path.basename(self.retry_weights if is_retry else self.main_weights))
+
+        if not is_retry and any(o["confidence"] < self.retry_warm_confidence for o in outputs):
+            # Low-confidence scan: the user will probably hit "retry", get the X-Large model ready
+            self.pool.warm_async("retry")
+        return outputs
+
+    def process_results(self, results, mask_format="polygon", mask_tolerance=1.0, output="full"):
+        """
+        Collects masks, boxes and confidence across ALL Results.
+        mask_format: "polygon" (full-precision floats, default), "compact"
+        (simplified + integer), "rle" or "binary" (see mask_encoding.encode_masks).
+        output: "full" (masks + boxes), "features" (only the per-nail pricing features,
+        see pricing_features.extract_features) or "both".
+        """
+        polygons = []
+        boxes = []
+        confidences = []
+        image_shape = None
         for r in results:
+            image_shape = image_shape or tuple(int(v) for v in r.orig_shape[:2])
             # Extract Masks (Polygons) -> Critical for separating "Coffin" vs "Ballerina"
             if r.masks:
-                # Convert to list of lists for JSON serialization
-                output_data["masks"] = [mask.tolist() for mask in r.masks.xy]
-            output_data["boxes"] = r.boxes.xyxy.tolist()
+                polygons.extend(r.masks.xy)
+            boxes.extend(r.boxes.xyxy.tolist())
+            confidences.extend(r.boxes.conf.tolist())
+
+        features = None
+        if output != "full":
+            # Computed from the full-precision polygons, before any mask encoding
+            features = extract_features(boxes, polygons if len(polygons) == len(boxes) else None, image_shape=image_shape)
+            if output == "features":
+                return {
+                    "features": features,
+                    "confidence": float(np.mean(confidences)) if confidences else 0.0
+                }
+
+        output_data = {
+            "masks": encode_masks(polygons, mask_format, mask_tolerance, image_shape), # For shape analysis
+            "boxes": boxes, # For location
             # Handle confidence score safely
-            if r.boxes.conf.numel() > 0:
-                output_data["confidence"] = float(r.boxes.conf.mean())
-            else:
-                output_data["confidence"] = 0.0
-            
+            "confidence": float(np.mean(confidences)) if confidences else 0.0
+        }
+        if mask_format != "polygon":
+            output_data["mask_format"] = mask_format
+            # Compact modes round boxes to whole pixels as well
+            output_data["boxes"] = np.rint(np.asarray(boxes, dtype=np.float32)).astype(int).tolist() if boxes else []
+        if features is not None:
+            output_data["features"] = features
         return output_data
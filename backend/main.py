@@ -1,9 +1,17 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
 from inference import LacqrPredictor
-import shutil
+from result_cache import ResultCache, make_cache_key
+from scheduler import InferenceScheduler
+from tracing import Trace, MetricsRegistry
+from mask_encoding import MASK_FORMATS
+from pricing_features import OUTPUT_MODES
+from batch_jobs import JobStore, TooManyJobs, MAX_JOB_IMAGES, URL_MAX_BYTES, fetch_url
+from typing import List, Optional
+import asyncio
 import os
-import uuid
 
 app = FastAPI()
 
@@ -25,40 +33,202 @@ app.add_middleware(
 # Initialize Predictor
 predictor = LacqrPredictor()
 
-# Create temp directory for uploads
-UPLOAD_DIR = "temp_uploads"
-os.makedirs(UPLOAD_DIR, exist_ok=True)
+# Content-addressed result cache (memory LRU + optional disk tier)
+result_cache = ResultCache(
+    max_bytes=int(os.environ.get("LACQR_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+    disk_dir=os.environ.get("LACQR_CACHE_DIR") or None
+)
+
+# Micro-batching scheduler: groups concurrent uploads into one batched YOLO call
+scheduler = InferenceScheduler(
+    predictor.predict_batch,
+    max_batch_size=int(os.environ.get("LACQR_MAX_BATCH_SIZE", 8)),
+    max_wait_ms=float(os.environ.get("LACQR_MAX_WAIT_MS", 10))
+)
+
+# Aggregated per-stage latency histograms (served from /metrics)
+metrics = MetricsRegistry()
+
+# Bulk portfolio jobs: progress + partial results, polled via /jobs/{job_id}
+jobs = JobStore(max_active_per_client=int(os.environ.get("LACQR_MAX_JOBS_PER_CLIENT", 2)))
+# Images of one job in flight at once: enough to keep the scheduler's batches full while
+# the next images are downloaded and decoded
+BATCH_CONCURRENCY = int(os.environ.get("LACQR_BATCH_CONCURRENCY", 2 * scheduler.max_batch_size))
+JOB_TTL_S = float(os.environ.get("LACQR_JOB_TTL_S", 3600))
+_job_tasks = set()
+
+@app.on_event("startup")
+async def start_scheduler():
+    await scheduler.start()
+
+@app.on_event("shutdown")
+async def stop_scheduler():
+    await scheduler.stop()
 
 @app.get("/")
 def read_root():
     return {"status": "Lacqr AI Backend is running"}
 
+@app.get("/metrics")
+def read_metrics(format: str = "json"):
+    if format == "prometheus":
+        return PlainTextResponse(metrics.prometheus())
+    return {
+        "latency": metrics.snapshot(),
+        "scheduler": scheduler.stats(),
+        "cache": result_cache.stats(),
+        "models": predictor.pool.stats(),
+        "jobs": {"running": len(_job_tasks)}
+    }
+
 @app.post("/analyze")
-async def analyze_image(file: UploadFile = File(...), is_retry: bool = False):
-    try:
-        # Generate unique filename
-        file_extension = file.filename.split(".")[-1]
-        filename = f"{uuid.uuid4()}.{file_extension}"
-        file_path = os.path.join(UPLOAD_DIR, filename)
+async def analyze_image(
+    file: UploadFile = File(...),
+    is_retry: bool = False,
+    mask_format: str = "polygon",
+    mask_tolerance: float = 1.0,
+    output: str = "full"
+):
+    if mask_format not in MASK_FORMATS:
+        raise HTTPException(status_code=400, detail=f"mask_format must be one of {list(MASK_FORMATS)}")
+    if output not in OUTPUT_MODES:
+        raise HTTPException(status_code=400, detail=f"output must be one of {list(OUTPUT_MODES)}")
 
-        # Save uploaded file
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+    try:
+        trace = Trace("analyze")
+        trace.set("is_retry", is_retry)
 
-        # Run Inference
-        try:
-            result = predictor.predict(file_path, is_retry=is_retry)
-        finally:
-            # Clean up file after inference
-            if os.path.exists(file_path):
-                os.remove(file_path)
+        with trace.span("read_upload"):
+            contents = await file.read()
+        trace.set("upload_bytes", len(contents))
 
-        return result
+        return await _analyze_contents(contents, trace, is_retry, mask_format, mask_tolerance, output)
 
+    except ValueError as e:
+        print(f"Invalid image upload: {e}")
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         print(f"Error processing image: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+async def _analyze_contents(contents, trace, is_retry, mask_format, mask_tolerance, output="full"):
+    """Cache lookup -> decode -> scheduled inference for one image's bytes."""
+    with trace.span("cache_lookup"):
+        cache_key = make_cache_key(contents, {
+            **predictor.config_fingerprint(is_retry),
+            "mask_format": mask_format,
+            "mask_tolerance": mask_tolerance if mask_format != "polygon" else None,
+            "output": output
+        })
+        cached = result_cache.get(cache_key)
+    if cached is not None:
+        metrics.observe_trace(trace, prefix="cache_hit.")
+        cached["meta"] = {"cache": {"hit": True, **result_cache.stats()}, "trace": trace.to_dict()}
+        return cached
+
+    # Decode straight from the upload buffer (off the event loop, nothing touches disk).
+    # Decoding per request keeps one corrupt upload from failing a whole batch.
+    with trace.span("decode"):
+        image = await run_in_threadpool(predictor.load_image, contents)
+
+    # Run Inference
+    with trace.span("scheduled_inference"):
+        result = await scheduler.submit(
+            image, is_retry=is_retry, trace=trace, mask_format=mask_format, mask_tolerance=mask_tolerance, output=output
+        )
+
+    result_cache.put(cache_key, result)
+    metrics.observe_trace(trace)
+    result["meta"] = {"cache": {"hit": False, **result_cache.stats()}, "trace": trace.to_dict()}
+    return result
+
+@app.post("/analyze_batch")
+async def analyze_batch(
+    request: Request,
+    files: Optional[List[UploadFile]] = File(None),
+    image_urls: Optional[List[str]] = Form(None),
+    is_retry: bool = False,
+    mask_format: str = "polygon",
+    mask_tolerance: float = 1.0,
+    output: str = "full"
+):
+    """
+    Bulk analysis of uploads and/or image URLs. Returns {"job_id", "total"} immediately;
+    poll /jobs/{job_id}?since=<next> for progress and the results finished since.
+    """
+    if mask_format not in MASK_FORMATS:
+        raise HTTPException(status_code=400, detail=f"mask_format must be one of {list(MASK_FORMATS)}")
+    if output not in OUTPUT_MODES:
+        raise HTTPException(status_code=400, detail=f"output must be one of {list(OUTPUT_MODES)}")
+
+    sources = [url for url in image_urls or [] if url]
+    if len(sources) + len(files or []) > MAX_JOB_IMAGES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_JOB_IMAGES} images per job")
+    # Uploads are only readable during this request; URLs are fetched by the job itself.
+    # Every upload gets the same byte cap as a fetched URL.
+    for file in files or []:
+        contents = await file.read(URL_MAX_BYTES + 1)
+        if len(contents) > URL_MAX_BYTES:
+            raise HTTPException(status_code=413, detail=f"{file.filename} exceeds the {URL_MAX_BYTES} byte limit")
+        sources.append(contents)
+    if not sources:
+        raise HTTPException(status_code=400, detail="Provide files and/or image_urls")
+
+    jobs.prune(JOB_TTL_S)
+    # The per-client job limit is keyed on the connection's address, never on anything the
+    # caller sends (a fresh client_id per request would lift the limit)
+    client = request.client.host if request.client else "anonymous"
+    try:
+        job_id = jobs.create(client, len(sources), {"is_retry": is_retry, "mask_format": mask_format, "output": output})
+    except TooManyJobs as e:
+        raise HTTPException(status_code=429, detail=str(e))
+
+    task = asyncio.create_task(_run_batch_job(job_id, sources, is_retry, mask_format, mask_tolerance, output))
+    _job_tasks.add(task)
+    task.add_done_callback(_job_tasks.discard)
+    return {"job_id": job_id, "total": len(sources)}
+
+async def _run_batch_job(job_id, sources, is_retry, mask_format, mask_tolerance, output="full"):
+    """
+    Runs every image through the same path as /analyze. Up to BATCH_CONCURRENCY images
+    are in flight, so downloads/decodes overlap inference and the scheduler sees full
+    batches. Results are recorded as they finish.
+    """
+    jobs.set_status(job_id, "running")
+    semaphore = asyncio.Semaphore(max(1, BATCH_CONCURRENCY))
+
+    async def run_one(index, source):
+        async with semaphore:
+            trace = Trace("analyze_batch")
+            trace.set("is_retry", is_retry)
+            try:
+                if isinstance(source, str):
+                    with trace.span("download"):
+                        source = await run_in_threadpool(fetch_url, source)
+                trace.set("upload_bytes", len(source))
+                result = await _analyze_contents(source, trace, is_retry, mask_format, mask_tolerance, output)
+                jobs.record(job_id, index, result=result)
+            except Exception as e:
+                print(f"Batch job {job_id}: image {index} failed: {e}")
+                jobs.record(job_id, index, error=str(e))
+
+    try:
+        await asyncio.gather(*(run_one(index, source) for index, source in enumerate(sources)))
+    except asyncio.CancelledError:
+        # Server shutdown: free the client's slot instead of leaving the job "running"
+        jobs.set_status(job_id, "failed", error="Job cancelled")
+        raise
+    except Exception as e:
+        print(f"Batch job {job_id} failed: {e}")
+        jobs.set_status(job_id, "failed", error=str(e))
+
+@app.get("/jobs/{job_id}")
+def read_job(job_id: str, since: int = 0, limit: int = 100):
+    status = jobs.status(job_id, since=since, limit=limit)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Unknown job_id")
+    return status
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
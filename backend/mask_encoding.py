@@ -0,0 +1,93 @@
+import base64
+
+import cv2
+import numpy as np
+
+# "polygon" is the original full-precision float output; the rest are compact modes
+MASK_FORMATS = ("polygon", "compact", "rle", "binary")
+
+
+def simplify_polygon(points, tolerance):
+    """Douglas-Peucker simplification (closed contour), tolerance in pixels."""
+    points = np.asarray(points, dtype=np.float32).reshape(-1, 1, 2)
+    if tolerance <= 0 or len(points) < 4:
+        return points.reshape(-1, 2)
+    return cv2.approxPolyDP(points, float(tolerance), True).reshape(-1, 2)
+
+
+def quantize(points):
+    """Rounds coordinates to whole pixels."""
+    return np.rint(np.asarray(points, dtype=np.float32)).astype(np.int32).reshape(-1, 2)
+
+
+def rle_encode(polygon, image_shape):
+    """
+    Rasterizes one polygon inside its own bounding box (clipped to the image) and
+    run-length encodes that crop COCO-style: column-major, counts alternate
+    starting with background. The crop is placed back at `offset` ([x, y]) in an
+    image of `size` ([height, width]); `crop` is its [height, width]. Memory is
+    proportional to the instance, not to the photo.
+    """
+    height, width = image_shape
+    points = quantize(polygon)
+    x0, y0 = np.clip(points.min(axis=0), 0, [width, height]) if len(points) else (0, 0)
+    x1, y1 = np.clip(points.max(axis=0) + 1, 0, [width, height]) if len(points) else (0, 0)
+    crop_h, crop_w = int(max(0, y1 - y0)), int(max(0, x1 - x0))
+    encoded = {"size": [height, width], "offset": [int(x0), int(y0)], "crop": [crop_h, crop_w]}
+    if crop_h == 0 or crop_w == 0:
+        return {**encoded, "counts": []}
+
+    mask = np.zeros((crop_h, crop_w), dtype=np.uint8)
+    cv2.fillPoly(mask, [points - np.array([x0, y0], dtype=np.int32)], 1)
+
+    flat = mask.flatten(order="F")
+    # Positions where the value changes, plus both ends
+    changes = np.flatnonzero(np.diff(flat)) + 1
+    boundaries = np.concatenate([[0], changes, [flat.size]])
+    counts = np.diff(boundaries)
+    if flat[0] == 1:
+        # RLE must start with a background run
+        counts = np.concatenate([[0], counts])
+    return {**encoded, "counts": counts.tolist()}
+
+
+def pack_binary(polygons):
+    """
+    Packs integer polygons into one base64 little-endian typed array
+    (Int16Array when every coordinate fits, otherwise Int32Array) plus offsets:
+    polygon i is points[offsets[i]:offsets[i + 1]] of the flat [x0, y0, x1, y1, ...] array / 2.
+    """
+    if not polygons:
+        return {"dtype": "int16", "offsets": [0], "data": ""}
+    lengths = [len(p) for p in polygons]
+    flat = np.concatenate([quantize(p) for p in polygons]).reshape(-1)
+    dtype = np.int16 if flat.size == 0 or (flat.min() >= -32768 and flat.max() <= 32767) else np.int32
+    return {
+        "dtype": np.dtype(dtype).name,
+        "offsets": np.concatenate([[0], np.cumsum(lengths)]).tolist(),
+        "data": base64.b64encode(flat.astype(dtype).astype(np.dtype(dtype).newbyteorder("<")).tobytes()).decode("ascii")
+    }
+
+
+def encode_masks(polygons, mask_format="polygon", tolerance=1.0, image_shape=None):
+    """
+    Encodes a list of (N_i, 2) float polygons.
+    - polygon: nested float lists (legacy, unchanged)
+    - compact: simplified to `tolerance` px, integer coordinates
+    - rle:     simplified polygons rasterized + run-length encoded (needs image_shape)
+    - binary:  simplified integer polygons packed into a base64 typed array
+    """
+    if mask_format not in MASK_FORMATS:
+        raise ValueError(f"Unknown mask_format '{mask_format}', expected one of {MASK_FORMATS}")
+
+    if mask_format == "polygon":
+        return [np.asarray(p).tolist() for p in polygons]
+
+    simplified = [simplify_polygon(p, tolerance) for p in polygons]
+    if mask_format == "compact":
+        return [quantize(p).tolist() for p in simplified]
+    if mask_format == "rle":
+        if image_shape is None:
+            raise ValueError("mask_format 'rle' requires the image shape")
+        return [rle_encode(p, image_shape) for p in simplified]
+    return pack_binary(simplified)
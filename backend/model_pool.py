@@ -0,0 +1,187 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import numpy as np
+
+
+def _rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError):
+        return None
+
+
+def _estimate_mb(weights):
+    """Fallback footprint estimate when RSS is unavailable: weights on disk x1.5 for activations/buffers."""
+    try:
+        if os.path.isdir(weights):
+            size = sum(os.path.getsize(os.path.join(root, f)) for root, _, files in os.walk(weights) for f in files)
+        else:
+            size = os.path.getsize(weights)
+        return size * 1.5 / (1024 * 1024)
+    except OSError:
+        return 0.0
+
+
+class ModelPool:
+    """
+    Memory-budgeted pool of YOLO models for LacqrPredictor.
+
+    - Models load on demand and run one synthetic warm-up inference right after
+      loading, so the first real request does not pay for lazy init/autotuning.
+    - warm_async() loads + warms a model on a background thread.
+    - Unpinned models are evicted least-recently-used whenever the resident
+      total exceeds `ram_budget_mb`: after a load, and whenever acquire() releases
+      a model. Models in use, and warmed models not yet used, are never evicted.
+    - stats() exposes pool state for /metrics.
+    """
+
+    def __init__(self, loader, ram_budget_mb=4096, warmup_imgsz=640):
+        self.loader = loader # callable(weights) -> model
+        self.ram_budget_mb = ram_budget_mb
+        self.warmup_imgsz = warmup_imgsz
+        self._specs = {}
+        self._resident = OrderedDict() # name -> model, in LRU order
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self._warming = set()
+        self._warm_protected = set() # warmed in the background, kept until first use
+        self._in_use = {} # name -> active acquire() count
+        self._stats = {}
+        self.evictions = 0
+
+    def register(self, name, weights, pinned=False, model=None):
+        """Registers a model; pass `model` to adopt one that is already loaded."""
+        self._specs[name] = {"weights": weights, "pinned": pinned}
+        self._load_locks[name] = threading.Lock()
+        self._stats[name] = {"loads": 0, "hits": 0, "misses": 0, "footprint_mb": None, "load_seconds": None, "warmup_seconds": None, "last_used": None}
+        if model is not None:
+            with self._lock:
+                self._resident[name] = model
+            self._stats[name]["footprint_mb"] = round(_estimate_mb(weights), 1)
+
+    def is_resident(self, name):
+        return name in self._resident
+
+    def get(self, name):
+        with self._lock:
+            model = self._resident.get(name)
+            if model is not None:
+                self._warm_protected.discard(name)
+                self._resident.move_to_end(name)
+                self._stats[name]["hits"] += 1
+                self._stats[name]["last_used"] = time.time()
+                return model
+            self._stats[name]["misses"] += 1
+
+        model = self._load(name)
+        self._stats[name]["last_used"] = time.time()
+        return model
+
+    @contextmanager
+    def acquire(self, name):
+        """get() for the duration of an inference; on release the pool is trimmed back to budget."""
+        model = self.get(name)
+        with self._lock:
+            self._in_use[name] = self._in_use.get(name, 0) + 1
+        try:
+            yield model
+        finally:
+            with self._lock:
+                self._in_use[name] -= 1
+                if not self._in_use[name]:
+                    del self._in_use[name]
+                self._evict_to_budget()
+
+    def warm_async(self, name):
+        """Loads and warms `name` in the background (no-op if resident or already warming)."""
+        with self._lock:
+            if name in self._resident or name in self._warming:
+                return False
+            self._warming.add(name)
+
+        def run():
+            try:
+                self._load(name)
+                with self._lock:
+                    if name in self._resident:
+                        self._warm_protected.add(name)
+            except Exception as e:
+                print(f"⚠️ Background warm-up of {name} failed: {e}")
+            finally:
+                with self._lock:
+                    self._warming.discard(name)
+
+        threading.Thread(target=run, name=f"lacqr-warm-{name}", daemon=True).start()
+        return True
+
+    def stats(self):
+        with self._lock:
+            resident = list(self._resident)
+            warming = sorted(self._warming)
+        return {
+            "ram_budget_mb": self.ram_budget_mb,
+            "resident_mb": round(sum(self._stats[n]["footprint_mb"] or 0 for n in resident), 1),
+            "resident": resident, # LRU order, most recently used last
+            "warming": warming,
+            "evictions": self.evictions,
+            "models": {
+                name: {"weights": os.path.basename(spec["weights"]), "pinned": spec["pinned"], **self._stats[name]}
+                for name, spec in self._specs.items()
+            }
+        }
+
+    # --- internals ---
+    def _load(self, name):
+        with self._load_locks[name]:
+            with self._lock:
+                if name in self._resident:
+                    return self._resident[name]
+
+            weights = self._specs[name]["weights"]
+            print(f"📦 Loading {name} model: {weights}")
+            rss_before = _rss_mb()
+            started = time.perf_counter()
+            model = self.loader(weights)
+            loaded = time.perf_counter()
+            self._warm_up(model)
+            warmed = time.perf_counter()
+            rss_after = _rss_mb()
+
+            footprint = rss_after - rss_before if rss_before and rss_after and rss_after > rss_before else _estimate_mb(weights)
+            self._stats[name].update({
+                "loads": self._stats[name]["loads"] + 1,
+                "footprint_mb": round(footprint, 1),
+                "load_seconds": round(loaded - started, 3),
+                "warmup_seconds": round(warmed - loaded, 3)
+            })
+
+            with self._lock:
+                self._resident[name] = model
+                self._evict_to_budget(keep=name)
+            print(f"✅ {name} ready in {warmed - started:.1f}s (~{footprint:.0f} MB)")
+            return model
+
+    def _warm_up(self, model):
+        # One synthetic inference triggers lazy init (fusing, backend compilation) up front
+        dummy = np.zeros((self.warmup_imgsz, self.warmup_imgsz, 3), dtype=np.uint8)
+        model(dummy, imgsz=self.warmup_imgsz, verbose=False)
+
+    def _evict_to_budget(self, keep=None):
+        # Caller holds self._lock
+        def resident_mb():
+            return sum(self._stats[n]["footprint_mb"] or 0 for n in self._resident)
+
+        for name in list(self._resident):
+            if resident_mb() <= self.ram_budget_mb:
+                break
+            if name == keep or self._specs[name]["pinned"] or name in self._in_use or name in self._warm_protected:
+                continue
+            print(f"♻️ Evicting {name} model to stay under {self.ram_budget_mb} MB")
+            del self._resident[name]
+            self._warm_protected.discard(name)
+            self.evictions += 1
@@ -0,0 +1,180 @@
+import math
+
+import cv2
+import numpy as np
+
+# "full" is the original response; "features" returns only the pricing features below
+OUTPUT_MODES = ("full", "features", "both")
+
+# Pricing rules from PROJECT_CONTEXT.md: (exclusive upper bound, tier), last tier open-ended
+LENGTH_TIERS = ((1.1, "Short"), (1.5, "Medium"), (2.0, "Long"), (math.inf, "XL"))
+BLING_TIERS = ((5.0, "Minimal"), (20.0, "Moderate"), (math.inf, "Heavy"))
+# Detector classes that are whole-nail finishes rather than applied embellishments
+FINISH_LABELS = ("french tip", "chrome")
+# Embellishments counted separately; any other non-finish class only adds coverage
+GEM_LABELS = ("gem", "pearl")
+CHARM_LABELS = ("charm", "chain", "3d art")
+# Coverage is measured on a raster of at most this many pixels on the long side
+COVERAGE_RASTER_SIDE = 512
+
+
+def tier_labels(values, tiers):
+    """Vectorized tier lookup: each value gets the first tier whose upper bound is above it."""
+    bounds = np.array([bound for bound, _ in tiers[:-1]])
+    names = np.array([name for _, name in tiers])
+    return names[np.searchsorted(bounds, np.asarray(values, dtype=np.float64), side="right")].tolist()
+
+
+def box_polygons(boxes):
+    """(N, 4) xyxy boxes -> (N, 4, 2) rectangle polygons."""
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    x1, y1, x2, y2 = boxes.T
+    return np.stack([np.stack([x1, y1], 1), np.stack([x2, y1], 1), np.stack([x2, y2], 1), np.stack([x1, y2], 1)], axis=1)
+
+
+def polygon_geometry(polygons):
+    """
+    Area and oriented extents of every polygon in one pass: all vertices are
+    concatenated and per-polygon sums use np.add.reduceat.
+      - area: shoelace formula
+      - length / width: extents along / across the principal axis of the vertices,
+        so the ratio does not depend on how the hand is rotated in the photo
+    Returns (area, length, width, aspect_ratio) arrays; every polygon needs >= 3 points.
+    """
+    lengths = np.array([len(p) for p in polygons])
+    points = np.concatenate([np.asarray(p, dtype=np.float64).reshape(-1, 2) for p in polygons])
+    starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    owner = np.repeat(np.arange(len(lengths)), lengths)
+
+    # Shoelace: each vertex pairs with the next one, wrapping within its own polygon
+    following = np.arange(len(points)) + 1
+    following[starts + lengths - 1] = starts
+    cross = points[:, 0] * points[following, 1] - points[following, 0] * points[:, 1]
+    area = np.abs(np.add.reduceat(cross, starts)) / 2.0
+
+    centered = points - (np.add.reduceat(points, starts) / lengths[:, None])[owner]
+    cxx = np.add.reduceat(centered[:, 0] ** 2, starts)
+    cyy = np.add.reduceat(centered[:, 1] ** 2, starts)
+    cxy = np.add.reduceat(centered[:, 0] * centered[:, 1], starts)
+    theta = 0.5 * np.arctan2(2.0 * cxy, cxx - cyy)
+    cos, sin = np.cos(theta)[owner], np.sin(theta)[owner]
+    along = centered[:, 0] * cos + centered[:, 1] * sin
+    across = centered[:, 1] * cos - centered[:, 0] * sin
+    extent_a = np.maximum.reduceat(along, starts) - np.minimum.reduceat(along, starts)
+    extent_b = np.maximum.reduceat(across, starts) - np.minimum.reduceat(across, starts)
+
+    length = np.maximum(extent_a, extent_b)
+    width = np.minimum(extent_a, extent_b)
+    return area, length, width, length / np.maximum(width, 1e-6)
+
+
+def bling_coverage(plate_polygons, bling_boxes, image_shape, raster_side=COVERAGE_RASTER_SIDE):
+    """
+    Percent of each plate covered by the union of the bling boxes (overlapping
+    gems are not double counted), plus the plate index (-1 = none) each box centre
+    falls on. Plates are rasterized into one label image; the boxes are painted
+    with a 2D difference array, so every box lands in one cumulative sum.
+    """
+    height, width = image_shape
+    scale = min(1.0, raster_side / max(height, width, 1))
+    h, w = max(1, math.ceil(height * scale)), max(1, math.ceil(width * scale))
+
+    labels = np.zeros((h, w), dtype=np.int32) # 0 = background, i + 1 = plate i
+    for i, polygon in enumerate(plate_polygons):
+        cv2.fillPoly(labels, [np.rint(np.asarray(polygon, dtype=np.float64) * scale).astype(np.int32).reshape(-1, 1, 2)], i + 1)
+
+    boxes = np.asarray(bling_boxes, dtype=np.float64).reshape(-1, 4) * scale
+    x1 = np.clip(np.floor(boxes[:, 0]), 0, w).astype(int)
+    y1 = np.clip(np.floor(boxes[:, 1]), 0, h).astype(int)
+    x2 = np.clip(np.ceil(boxes[:, 2]), 0, w).astype(int)
+    y2 = np.clip(np.ceil(boxes[:, 3]), 0, h).astype(int)
+    diff = np.zeros((h + 1, w + 1), dtype=np.int32)
+    np.add.at(diff, (y1, x1), 1)
+    np.add.at(diff, (y1, x2), -1)
+    np.add.at(diff, (y2, x1), -1)
+    np.add.at(diff, (y2, x2), 1)
+    covered = diff.cumsum(axis=0).cumsum(axis=1)[:h, :w] > 0
+
+    count = len(plate_polygons) + 1
+    plate_px = np.bincount(labels.ravel(), minlength=count)[1:]
+    bling_px = np.bincount(labels[covered], minlength=count)[1:]
+
+    cx = np.clip(((x1 + x2) // 2), 0, w - 1)
+    cy = np.clip(((y1 + y2) // 2), 0, h - 1)
+    owner = labels[cy, cx] - 1
+    return 100.0 * bling_px / np.maximum(plate_px, 1), owner, plate_px, bling_px
+
+
+def embellishment_labels(classes):
+    """Detector classes that count towards bling coverage: everything except the finishes."""
+    return tuple(c for c in classes if c not in FINISH_LABELS)
+
+
+def extract_features(boxes, polygons=None, objects=None, image_shape=None, classes=None):
+    """
+    Compact pricing features for every nail plate.
+    boxes:       (N, 4) plate boxes (xyxy, image pixels)
+    polygons:    optional plate masks (one polygon per box); boxes are used where missing
+    objects:     optional micro detections [{"box", "label"}, ...]; without them no bling fields
+    image_shape: (height, width); inferred from the geometry when omitted
+    classes:     class list the micro detector was configured with; when omitted every
+                 non-finish label in objects counts as bling
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    if not len(boxes):
+        return {"plates": [], "summary": {"plates": 0, "aspect_ratio": None, "length_tier": None}}
+
+    rectangles = box_polygons(boxes)
+    if polygons is None or len(polygons) != len(boxes):
+        polygons = [None] * len(boxes)
+    shapes = [p if p is not None and len(p) >= 3 else rect for p, rect in zip(polygons, rectangles)]
+    area, length, width, aspect = polygon_geometry(shapes)
+    length_tiers = tier_labels(aspect, LENGTH_TIERS)
+
+    plates = [
+        {
+            "box": [round(float(v), 1) for v in box],
+            "aspect_ratio": round(float(a), 3),
+            "length_tier": tier,
+            "area_px": round(float(ar), 1),
+            "length_px": round(float(l), 1),
+            "width_px": round(float(wd), 1)
+        }
+        for box, a, tier, ar, l, wd in zip(boxes, aspect, length_tiers, area, length, width)
+    ]
+    median_aspect = float(np.median(aspect))
+    summary = {
+        "plates": len(plates),
+        "aspect_ratio": round(median_aspect, 3),
+        "length_tier": tier_labels([median_aspect], LENGTH_TIERS)[0]
+    }
+
+    if objects is not None:
+        if classes is None:
+            classes = {o.get("label") for o in objects}
+        bling_labels = embellishment_labels(classes)
+        bling = [o for o in objects if o.get("label") in bling_labels]
+        if image_shape is None:
+            extents = np.concatenate([boxes.reshape(-1, 2)] + [np.asarray(s, dtype=np.float64).reshape(-1, 2) for s in shapes])
+            image_shape = (int(np.ceil(extents[:, 1].max())) + 1, int(np.ceil(extents[:, 0].max())) + 1)
+        coverage, owner, plate_px, bling_px = bling_coverage(shapes, [o["box"] for o in bling], image_shape)
+        is_gem = np.array([o["label"] in GEM_LABELS for o in bling], dtype=bool)
+        is_charm = np.array([o["label"] in CHARM_LABELS for o in bling], dtype=bool)
+        gems = np.bincount(owner[(owner >= 0) & is_gem], minlength=len(plates))
+        charms = np.bincount(owner[(owner >= 0) & is_charm], minlength=len(plates))
+        bling_tiers = tier_labels(coverage, BLING_TIERS)
+        for plate, pct, tier, g, c in zip(plates, coverage, bling_tiers, gems, charms):
+            plate.update({
+                "coverage_pct": round(float(pct), 2),
+                "bling_tier": tier if pct > 0 else "None",
+                "gems": int(g),
+                "charms": int(c)
+            })
+        total_pct = 100.0 * float(bling_px.sum()) / max(float(plate_px.sum()), 1.0)
+        summary.update({
+            "coverage_pct": round(total_pct, 2),
+            "bling_tier": tier_labels([total_pct], BLING_TIERS)[0] if total_pct > 0 else "None",
+            "gems": int(gems.sum()),
+            "charms": int(charms.sum())
+        })
+    return {"plates": plates, "summary": summary}
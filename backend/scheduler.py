@@ -0,0 +1,146 @@
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class InferenceScheduler:
+    """
+    Dynamic micro-batcher between the FastAPI endpoint and LacqrPredictor.
+
+    Requests are queued; a single worker pulls the first waiting request, keeps
+    collecting for up to `max_wait_ms` (or until `max_batch_size` is reached) and
+    runs the whole group as ONE batched YOLO call in a worker thread, so the event
+    loop keeps accepting uploads while the model is busy. Each caller awaits its
+    own future and receives only its own result.
+    """
+
+    def __init__(self, predict_batch, max_batch_size=8, max_wait_ms=10):
+        self.predict_batch = predict_batch # callable(sources, is_retry[, traces, options]) -> list of results
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, max_wait_ms / 1000.0)
+
+        # One thread: the models are not thread-safe, batching provides the parallelism
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="lacqr-inference")
+        self._queue = None
+        self._worker = None
+
+        self._metrics = {
+            "requests": 0,
+            "batches": 0,
+            "errors": 0,
+            "max_batch_size_seen": 0,
+            "batch_size_counts": {},
+            "queue_wait_ms_total": 0.0,
+            "inference_ms_total": 0.0
+        }
+
+    async def start(self):
+        if self._worker is None:
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        self._executor.shutdown(wait=False)
+
+    async def submit(self, source, is_retry=False, trace=None, **options):
+        """
+        Queues one image and waits for its result. `trace` records queue wait + inference spans;
+        `options` are per-request postprocessing settings forwarded to predict_batch.
+        """
+        if self._worker is None:
+            await self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((source, is_retry, future, time.perf_counter(), trace, options))
+        return await future
+
+    def stats(self):
+        m = self._metrics
+        return {
+            "queue_depth": self._queue.qsize() if self._queue else 0,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "requests": m["requests"],
+            "batches": m["batches"],
+            "errors": m["errors"],
+            "avg_batch_size": m["requests"] / m["batches"] if m["batches"] else 0.0,
+            "max_batch_size_seen": m["max_batch_size_seen"],
+            "batch_size_counts": dict(m["batch_size_counts"]),
+            "avg_queue_wait_ms": m["queue_wait_ms_total"] / m["requests"] if m["requests"] else 0.0,
+            "avg_batch_inference_ms": m["inference_ms_total"] / m["batches"] if m["batches"] else 0.0
+        }
+
+    # --- internals ---
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                # Window closed: still sweep up anything that is already waiting
+                if self._queue.empty():
+                    break
+                batch.append(self._queue.get_nowait())
+                continue
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+
+            # Normal scans and retries use different models, so they run as separate calls
+            groups = {}
+            for item in batch:
+                groups.setdefault(item[1], []).append(item)
+
+            for is_retry, items in groups.items():
+                # Skip callers that already went away (client disconnected)
+                items = [item for item in items if not item[2].done()]
+                if not items:
+                    continue
+                started = time.perf_counter()
+                traces = [item[4] for item in items]
+                for item in items:
+                    if item[4] is not None:
+                        item[4].add_span("queue_wait", (started - item[3]) * 1000.0)
+                kwargs = {}
+                if any(trace is not None for trace in traces):
+                    kwargs["traces"] = traces
+                if any(item[5] for item in items):
+                    kwargs["options"] = [item[5] for item in items]
+                try:
+                    call = functools.partial(self.predict_batch, [item[0] for item in items], is_retry, **kwargs)
+                    results = await loop.run_in_executor(self._executor, call)
+                    for item, result in zip(items, results):
+                        if not item[2].done():
+                            item[2].set_result(result)
+                except Exception as e:
+                    self._metrics["errors"] += 1
+                    for item in items:
+                        if not item[2].done():
+                            item[2].set_exception(e)
+                self._record(items, started)
+
+    def _record(self, items, started):
+        now = time.perf_counter()
+        m = self._metrics
+        size = len(items)
+        m["requests"] += size
+        m["batches"] += 1
+        m["max_batch_size_seen"] = max(m["max_batch_size_seen"], size)
+        m["batch_size_counts"][size] = m["batch_size_counts"].get(size, 0) + 1
+        m["queue_wait_ms_total"] += sum((started - item[3]) * 1000.0 for item in items)
+        m["inference_ms_total"] += (now - started) * 1000.0
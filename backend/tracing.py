@@ -0,0 +1,149 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds in milliseconds (last bucket is +Inf)
+LATENCY_BUCKETS_MS = [5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000, math.inf]
+
+
+def cuda_reset_peak():
+    try:
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.reset_peak_memory_stats()
+    except Exception:
+        pass
+
+
+def cuda_peak_mb():
+    try:
+        import torch
+        if torch.cuda.is_available():
+            return round(torch.cuda.max_memory_allocated() / (1024 * 1024), 1)
+    except Exception:
+        pass
+    return None
+
+
+class Trace:
+    """
+    Per-request trace: wall time per span plus free-form attributes
+    (image size, detection counts, ...). Thread-safe, so concurrently running
+    stages can record into the same trace. Trace(enabled=False) is a no-op.
+    """
+
+    def __init__(self, name="request", enabled=True):
+        self.name = name
+        self.enabled = enabled
+        self.spans = {}
+        self.attrs = {}
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name):
+        if not self.enabled:
+            yield
+            return
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_span(name, (time.perf_counter() - started) * 1000.0)
+
+    def add_span(self, name, ms):
+        """Records an externally measured duration (e.g. Ultralytics' per-image speed)."""
+        if not self.enabled or ms is None:
+            return
+        with self._lock:
+            self.spans[name] = round(self.spans.get(name, 0.0) + float(ms), 3)
+
+    def set(self, key, value):
+        if self.enabled:
+            with self._lock:
+                self.attrs[key] = value
+
+    def total_ms(self):
+        return round((time.perf_counter() - self._started) * 1000.0, 3)
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "total_ms": self.total_ms(),
+                "spans_ms": dict(self.spans),
+                **self.attrs
+            }
+
+
+class MetricsRegistry:
+    """Aggregated latency histograms (one per span name) across all traced requests."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS_MS):
+        self.buckets = list(buckets)
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name, value_ms):
+        with self._lock:
+            hist = self._histograms.get(name)
+            if hist is None:
+                hist = {"count": 0, "sum": 0.0, "counts": [0] * len(self.buckets)}
+                self._histograms[name] = hist
+            hist["count"] += 1
+            hist["sum"] += value_ms
+            for i, bound in enumerate(self.buckets):
+                if value_ms <= bound:
+                    hist["counts"][i] += 1
+                    break
+
+    def observe_trace(self, trace, prefix=""):
+        if not trace.enabled:
+            return
+        self.observe(f"{prefix}total", trace.total_ms())
+        for name, ms in list(trace.spans.items()):
+            self.observe(f"{prefix}{name}", ms)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                name: {
+                    "count": hist["count"],
+                    "mean_ms": round(hist["sum"] / hist["count"], 3) if hist["count"] else 0.0,
+                    "p50_ms": self._quantile(hist, 0.50),
+                    "p95_ms": self._quantile(hist, 0.95),
+                    "p99_ms": self._quantile(hist, 0.99),
+                    "buckets": {self._label(b): c for b, c in zip(self.buckets, hist["counts"])}
+                }
+                for name, hist in self._histograms.items()
+            }
+
+    def prometheus(self, metric="lacqr_latency_ms"):
+        """Prometheus text exposition (cumulative buckets, one label per span)."""
+        lines = [f"# TYPE {metric} histogram"]
+        with self._lock:
+            for name, hist in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, hist["counts"]):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{span="{name}",le="{self._label(bound)}"}} {cumulative}')
+                lines.append(f'{metric}_sum{{span="{name}"}} {hist["sum"]:.3f}')
+                lines.append(f'{metric}_count{{span="{name}"}} {hist["count"]}')
+        return "\n".join(lines) + "\n"
+
+    # --- internals ---
+    def _quantile(self, hist, q):
+        """Bucket upper bound containing the q-th observation (the usual histogram estimate)."""
+        if not hist["count"]:
+            return None
+        target = q * hist["count"]
+        cumulative = 0
+        for bound, count in zip(self.buckets, hist["counts"]):
+            cumulative += count
+            if cumulative >= target:
+                return None if math.isinf(bound) else bound
+        return None
+
+    @staticmethod
+    def _label(bound):
+        return "+Inf" if math.isinf(bound) else str(bound)
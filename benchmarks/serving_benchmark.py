@@ -0,0 +1,303 @@
+"""
+Serving load-test / benchmark harness.
+
+Replays images from lacqrtraining_dataset_v3 (test + valid by default) against
+  - backend: the FastAPI app in backend/main.py, in-process over ASGI
+  - brain:   LacqrBrain's pipeline (lacqr_modal/main.py), in-process, images
+             served from a local HTTP server so the download path is exercised
+and reports throughput, p50/p95/p99 latency, per-stage timing (from meta.trace)
+and peak RSS as JSON, so two runs can be diffed with --compare.
+
+Examples:
+    python benchmarks/serving_benchmark.py backend --requests 200 --concurrency 16
+    python benchmarks/serving_benchmark.py brain --stub-models --requests 50 --concurrency 4
+    python benchmarks/serving_benchmark.py brain --stub-models --output new.json --compare old.json
+"""
+import argparse
+import asyncio
+import functools
+import http.server
+import json
+import os
+import platform
+import resource
+import sys
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+DATASET_DIR = REPO_ROOT / "lacqrtraining_dataset_v3"
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".webp"}
+
+
+def find_images(splits):
+    images = []
+    for split in splits:
+        split_dir = DATASET_DIR / split / "images"
+        if split_dir.exists():
+            images.extend(sorted(p for p in split_dir.iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS))
+    return images
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(q / 100.0 * (len(ordered) - 1)))))
+    return round(ordered[index], 3)
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if platform.system() == "Darwin" else 1024), 1)
+
+
+def summarize(latencies_ms, traces, errors, wall_seconds, args):
+    stage_samples = {}
+    for trace in traces:
+        for name, ms in trace.get("spans_ms", {}).items():
+            stage_samples.setdefault(name, []).append(ms)
+
+    return {
+        "target": args.target,
+        "config": {
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "warmup": args.warmup,
+            "splits": args.splits,
+            "stub_models": args.stub_models
+        },
+        "environment": {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count()},
+        "completed": len(latencies_ms),
+        "errors": errors,
+        "wall_seconds": round(wall_seconds, 3),
+        "throughput_rps": round(len(latencies_ms) / wall_seconds, 3) if wall_seconds else 0.0,
+        "latency_ms": {
+            "mean": round(sum(latencies_ms) / len(latencies_ms), 3) if latencies_ms else None,
+            "p50": percentile(latencies_ms, 50),
+            "p95": percentile(latencies_ms, 95),
+            "p99": percentile(latencies_ms, 99),
+            "max": round(max(latencies_ms), 3) if latencies_ms else None
+        },
+        "stages_ms": {
+            name: {
+                "count": len(samples),
+                "mean": round(sum(samples) / len(samples), 3),
+                "p50": percentile(samples, 50),
+                "p95": percentile(samples, 95)
+            }
+            for name, samples in sorted(stage_samples.items())
+        },
+        "peak_rss_mb": peak_rss_mb()
+    }
+
+
+# --- BACKEND (FastAPI, in-process) ---
+async def run_backend(images, args):
+    import httpx
+
+    sys.path.insert(0, str(REPO_ROOT / "backend"))
+    if args.stub_models:
+        # Stubs replace the models after import: the predictor must not load real weights first
+        os.environ.setdefault("LACQR_PRELOAD_MODELS", "")
+    import main as backend_main
+
+    if args.stub_models:
+        from stub_models import StubYOLO
+        pool = backend_main.predictor.pool
+        pool.register("main", "stub-main", pinned=True, model=StubYOLO(["nail"], latency_ms=args.stub_yolo_ms))
+        pool.register("retry", "stub-retry", model=StubYOLO(["nail"], latency_ms=args.stub_yolo_ms * 3))
+    if not args.with_cache:
+        # Every request must reach the model, otherwise repeated images measure the cache
+        backend_main.result_cache.max_bytes = 0
+
+    payloads = [(path.name, path.read_bytes()) for path in images]
+    transport = httpx.ASGITransport(app=backend_main.app)
+    semaphore = asyncio.Semaphore(args.concurrency)
+    latencies, traces, errors = [], [], []
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        async def one(index, record):
+            name, data = payloads[index % len(payloads)]
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post("/analyze", files={"file": (name, data, "image/jpeg")})
+                elapsed = (time.perf_counter() - started) * 1000.0
+            if not record:
+                return
+            if response.status_code != 200:
+                errors.append(f"{name}: HTTP {response.status_code}")
+                return
+            latencies.append(elapsed)
+            traces.append(response.json().get("meta", {}).get("trace", {}))
+
+        await asyncio.gather(*(one(i, False) for i in range(args.warmup)))
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i, True) for i in range(args.requests)))
+        wall = time.perf_counter() - started
+
+    summary = summarize(latencies, traces, errors, wall, args)
+    summary["scheduler"] = backend_main.scheduler.stats()
+    return summary
+
+
+# --- BRAIN (Modal pipeline, in-process) ---
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def serve_dataset():
+    """Serves the dataset directory over HTTP on a free local port."""
+    handler = functools.partial(_QuietHandler, directory=str(DATASET_DIR))
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _unwrap(member):
+    """Modal decorators wrap methods; the raw function lives on .raw_f (or .f in older releases)."""
+    return getattr(member, "raw_f", None) or getattr(member, "f", None) or member
+
+
+def build_brain(args):
+    # Nothing preloads: stubs (or real models, lazily) are registered after load_models
+    os.environ.setdefault("LACQR_PRELOAD_MODELS", "")
+    sys.path.insert(0, str(REPO_ROOT / "backend"))
+    sys.path.insert(0, str(REPO_ROOT / "lacqr_modal"))
+    import main as brain_main
+
+    brain_cls = brain_main.LacqrBrain
+    user_cls = getattr(brain_cls, "_user_cls", None)
+    if user_cls is None and hasattr(brain_cls, "_get_user_cls"):
+        user_cls = brain_cls._get_user_cls()
+    user_cls = user_cls or brain_cls
+
+    brain = user_cls()
+    _unwrap(user_cls.__dict__["load_models"])(brain)
+    if not args.with_cache:
+        brain.result_cache = None
+        brain.loading_errors.pop("result_cache", None)
+
+    if args.stub_models:
+        from stub_models import install_brain_stubs
+        install_brain_stubs(
+            brain,
+            florence_ms=args.stub_florence_ms,
+            dinov2_ms=args.stub_dinov2_ms,
+            yolo_ms=args.stub_yolo_ms,
+            micro_ms=args.stub_micro_ms
+        )
+    return brain
+
+
+def run_brain(images, args):
+    brain = build_brain(args)
+    server = serve_dataset()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    urls = [f"{base_url}/{urllib.parse.quote(str(p.relative_to(DATASET_DIR)))}" for p in images]
+
+    def one(index):
+        started = time.perf_counter()
+        result = None
+        for event in brain.run_pipeline(urls[index % len(urls)], pipeline_profile=args.pipeline_profile):
+            if event["stage"] in ("final", "error"):
+                result = event
+        elapsed = (time.perf_counter() - started) * 1000.0
+        return elapsed, result
+
+    latencies, traces, errors = [], [], []
+    try:
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(one, range(args.warmup)))
+            started = time.perf_counter()
+            for elapsed, event in pool.map(one, range(args.requests)):
+                if event is None or event["stage"] == "error":
+                    errors.append(event.get("error") if event else "no final event")
+                    continue
+                latencies.append(elapsed)
+                traces.append(event["result"].get("meta", {}).get("trace", {}))
+            wall = time.perf_counter() - started
+    finally:
+        server.shutdown()
+
+    summary = summarize(latencies, traces, errors, wall, args)
+    summary["models"] = brain.models.report()
+    return summary
+
+
+# --- COMPARISON ---
+def compare(current, baseline_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+
+    def delta(new, old):
+        if new is None or old in (None, 0):
+            return None
+        return round((new - old) / old * 100.0, 1)
+
+    rows = [("throughput_rps", current["throughput_rps"], baseline.get("throughput_rps"))]
+    for q in ("p50", "p95", "p99"):
+        rows.append((f"latency_{q}_ms", current["latency_ms"][q], baseline.get("latency_ms", {}).get(q)))
+    rows.append(("peak_rss_mb", current["peak_rss_mb"], baseline.get("peak_rss_mb")))
+    for name, stats in current["stages_ms"].items():
+        rows.append((f"stage {name} mean_ms", stats["mean"], baseline.get("stages_ms", {}).get(name, {}).get("mean")))
+
+    print(f"\n{'metric':<40}{'baseline':>12}{'current':>12}{'delta %':>10}")
+    for name, new, old in rows:
+        change = delta(new, old)
+        print(f"{name:<40}{str(old):>12}{str(new):>12}{(f'{change:+.1f}' if change is not None else '-'):>10}")
+    return {name: {"baseline": old, "current": new, "delta_pct": delta(new, old)} for name, new, old in rows}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Lacqr serving benchmark")
+    parser.add_argument("target", choices=["backend", "brain"])
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--splits", nargs="+", default=["test", "valid"])
+    parser.add_argument("--stub-models", action="store_true", help="CPU-only stand-ins instead of real weights")
+    parser.add_argument("--with-cache", action="store_true", help="Keep the result cache on (measures hit path)")
+    parser.add_argument("--stub-yolo-ms", type=float, default=40.0)
+    parser.add_argument("--stub-micro-ms", type=float, default=30.0)
+    parser.add_argument("--stub-florence-ms", type=float, default=400.0)
+    parser.add_argument("--stub-dinov2-ms", type=float, default=30.0)
+    parser.add_argument("--pipeline-profile", help="Brain pipeline profile (full, fast_quote, exhaustive)")
+    parser.add_argument("--output", help="Write machine-readable results (JSON) here")
+    parser.add_argument("--compare", help="Baseline JSON from an earlier run to diff against")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+    images = find_images(args.splits)
+    if not images:
+        print(f"❌ No images found under {DATASET_DIR} for splits {args.splits}")
+        return 1
+    print(f"🏁 {args.target}: {args.requests} requests @ concurrency {args.concurrency} over {len(images)} images")
+
+    if args.target == "backend":
+        summary = asyncio.run(run_backend(images, args))
+    else:
+        summary = run_brain(images, args)
+
+    if args.compare:
+        summary["comparison"] = compare(summary, args.compare)
+
+    print(json.dumps({k: summary[k] for k in ("throughput_rps", "latency_ms", "errors", "peak_rss_mb")}, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(summary, f, indent=2)
+        print(f"💾 Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
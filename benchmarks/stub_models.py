@@ -0,0 +1,187 @@
+"""
+CPU-only stand-ins for the pipeline models, used by serving_benchmark.py.
+
+The stubs mimic just enough of the Ultralytics Results API (boxes, masks,
+speed, orig_shape, names) for LacqrPredictor.process_results and the brain's
+stage code to run unchanged, and sleep for a configurable time to stand in for
+GPU kernels (time.sleep releases the GIL, just like CUDA work does). Outputs
+are deterministic per image so two benchmark runs see identical workloads.
+"""
+import time
+import zlib
+
+import numpy as np
+
+
+class StubTensor:
+    """Minimal torch.Tensor look-alike over a NumPy array."""
+
+    def __init__(self, array):
+        self.array = np.asarray(array)
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.array
+
+    def tolist(self):
+        return self.array.tolist()
+
+    def numel(self):
+        return int(self.array.size)
+
+    def mean(self):
+        return StubTensor(self.array.mean())
+
+    def __getitem__(self, item):
+        return StubTensor(self.array[item])
+
+    def __len__(self):
+        return len(self.array)
+
+    def __float__(self):
+        return float(self.array)
+
+    def __int__(self):
+        return int(self.array)
+
+
+class StubBox:
+    def __init__(self, xyxy, conf, cls):
+        self.xyxy = StubTensor(np.asarray([xyxy], dtype=np.float32))
+        self.conf = StubTensor(np.asarray([conf], dtype=np.float32))
+        self.cls = StubTensor(np.asarray([cls], dtype=np.float32))
+
+
+class StubBoxes:
+    def __init__(self, xyxy, conf, cls):
+        self.xyxy = StubTensor(np.asarray(xyxy, dtype=np.float32).reshape(-1, 4))
+        self.conf = StubTensor(np.asarray(conf, dtype=np.float32))
+        self.cls = StubTensor(np.asarray(cls, dtype=np.float32))
+
+    def __len__(self):
+        return len(self.conf.array)
+
+    def __iter__(self):
+        for xyxy, conf, cls in zip(self.xyxy.array, self.conf.array, self.cls.array):
+            yield StubBox(xyxy, conf, cls)
+
+
+class StubMasks:
+    def __init__(self, polygons):
+        self.xy = polygons
+
+    def __bool__(self):
+        return bool(self.xy)
+
+
+class StubResult:
+    def __init__(self, boxes, masks, orig_shape, speed):
+        self.boxes = boxes
+        self.masks = masks
+        self.orig_shape = orig_shape
+        self.speed = speed
+
+
+def _image_shape(source):
+    if hasattr(source, "shape"):
+        return source.shape[:2]
+    if hasattr(source, "size"):
+        width, height = source.size
+        return height, width
+    return 640, 640
+
+
+def _seed(source):
+    if hasattr(source, "shape"):
+        # Decoded array: sample a sparse grid of pixels
+        return zlib.crc32(np.ascontiguousarray(source[::16, ::16]).tobytes())
+    if hasattr(source, "resize"):
+        # PIL image (e.g. a nail-plate crop)
+        return zlib.crc32(source.resize((16, 16)).tobytes())
+    return zlib.crc32(str(source).encode())
+
+
+class StubYOLO:
+    """
+    Fake (segmentation) YOLO. Each image yields 3-7 boxes with polygon masks.
+    `latency_ms` is charged per forward pass plus `per_image_ms` per batch item,
+    so batching behaves like it does on a GPU.
+    """
+
+    def __init__(self, names, latency_ms=40.0, per_image_ms=5.0, with_masks=True):
+        self.names = dict(enumerate(names)) if isinstance(names, (list, tuple)) else names
+        self.latency_ms = latency_ms
+        self.per_image_ms = per_image_ms
+        self.with_masks = with_masks
+        self.ckpt_path = "stub"
+
+    def set_classes(self, classes):
+        self.names = dict(enumerate(classes))
+
+    def __call__(self, source, **kwargs):
+        sources = source if isinstance(source, list) else [source]
+        time.sleep((self.latency_ms + self.per_image_ms * len(sources)) / 1000.0)
+        per_image = (self.latency_ms / len(sources)) + self.per_image_ms
+        return [self._predict_one(s, per_image) for s in sources]
+
+    def _predict_one(self, source, per_image_ms):
+        height, width = _image_shape(source)
+        rng = np.random.default_rng(_seed(source))
+        count = int(rng.integers(3, 8))
+
+        x1 = rng.uniform(0, width * 0.8, count)
+        y1 = rng.uniform(0, height * 0.8, count)
+        x2 = np.minimum(x1 + rng.uniform(width * 0.05, width * 0.2, count), width)
+        y2 = np.minimum(y1 + rng.uniform(height * 0.08, height * 0.3, count), height)
+        xyxy = np.stack([x1, y1, x2, y2], axis=1)
+        conf = rng.uniform(0.3, 0.95, count)
+        cls = rng.integers(0, len(self.names), count)
+
+        polygons = []
+        if self.with_masks:
+            angles = np.linspace(0, 2 * np.pi, 48, endpoint=False)
+            for bx1, by1, bx2, by2 in xyxy:
+                cx, cy = (bx1 + bx2) / 2, (by1 + by2) / 2
+                rx, ry = (bx2 - bx1) / 2, (by2 - by1) / 2
+                polygons.append(np.stack([cx + rx * np.cos(angles), cy + ry * np.sin(angles)], axis=1).astype(np.float32))
+
+        speed = {"preprocess": per_image_ms * 0.1, "inference": per_image_ms * 0.8, "postprocess": per_image_ms * 0.1}
+        return StubResult(StubBoxes(xyxy, conf, cls), StubMasks(polygons), (height, width), speed)
+
+
+def install_brain_stubs(brain, florence_ms=400.0, dinov2_ms=30.0, yolo_ms=40.0, micro_ms=30.0, embedding_dim=384):
+    """
+    Swaps every model of an initialized LacqrBrain for a stub. YOLO and YOLO-World
+    go through the real stage code (plate parsing, batched crops, vectorized box
+    mapping); Florence-2 and DINOv2 are replaced at the method level since their
+    stage code is mostly model internals.
+    """
+    from main import YOLO_WORLD_CLASSES
+
+    brain.models.register("yolo", lambda: StubYOLO(["nail_plate"], latency_ms=yolo_ms, with_masks=False), source="stub")
+    brain.models.register("yolo_world", lambda: StubYOLO(YOLO_WORLD_CLASSES, latency_ms=micro_ms, with_masks=False), source="stub")
+    brain.models.register("florence", lambda: ("stub-florence", "stub-processor"), source="stub")
+    brain.models.register("dinov2", lambda: "stub-dinov2", source="stub")
+    brain.models.register("sam2", lambda: None, source="stub")
+    for name in ("critical", "yolo", "yolo_world", "florence", "dinov2", "sam2"):
+        brain.loading_errors.pop(name, None)
+
+    def run_florence_multi(image, tasks, profile=None, decode_overrides=None, trace=None, output_size=None, gpu_image=None):
+        tasks = [t[0] if isinstance(t, tuple) else t for t in tasks]
+        time.sleep(florence_ms / 1000.0)
+        if trace is not None:
+            trace.add_span("florence.decode", florence_ms)
+        return {task: f"stub output for {task}" for task in tasks}
+
+    def stage_dinov2(pil_image, trace=None, gpu_image=None):
+        time.sleep(dinov2_ms / 1000.0)
+        if trace is not None:
+            trace.add_span("dinov2.inference", dinov2_ms)
+        # Deterministic per-image unit vector so the design index sees real inserts
+        embedding = np.random.default_rng(_seed(pil_image)).standard_normal(embedding_dim).astype(np.float32)
+        return ["Smooth/Simple"], embedding / np.linalg.norm(embedding)
+
+    brain.run_florence_multi = run_florence_multi
+    brain.stage_dinov2 = stage_dinov2
@@ -0,0 +1,48 @@
+import os
+
+import numpy as np
+from PIL import Image
+
+# A photo whose 64 px grayscale thumbnail has less contrast and edge energy than this is a
+# plain solid colour (swatch, blank card): nothing for the detectors to find.
+PLAIN_IMAGE_STD = float(os.environ.get("LACQR_PLAIN_IMAGE_STD", "6.0"))
+PLAIN_IMAGE_GRADIENT = float(os.environ.get("LACQR_PLAIN_IMAGE_GRADIENT", "1.5"))
+# Mean absolute gradient (0-255 scale) of a plate's interior below which it is plain polish:
+# gems, charms, chrome and hand-painted art all push it well above this.
+PLATE_TEXTURE_MIN = float(os.environ.get("LACQR_PLATE_TEXTURE_MIN", "3.0"))
+PLATE_TEXTURE_SIZE = 32
+# Fraction trimmed from each side of a plate box so the nail/skin boundary is not counted as texture
+PLATE_INSET = 0.2
+
+
+def gradient_energy(gray):
+    """Mean absolute horizontal + vertical gradient over the last two axes of (..., H, W)."""
+    gx = np.abs(np.diff(gray, axis=-1)).mean(axis=(-2, -1))
+    gy = np.abs(np.diff(gray, axis=-2)).mean(axis=(-2, -1))
+    return (gx + gy) / 2.0
+
+
+def is_plain_image(pil_image, size=64):
+    """(plain, stats) for the whole photo, from a tiny grayscale thumbnail (~1 ms)."""
+    gray = np.asarray(pil_image.convert("L").resize((size, size), Image.BILINEAR), dtype=np.float32)
+    std = float(gray.std())
+    gradient = float(gradient_energy(gray))
+    return std < PLAIN_IMAGE_STD and gradient < PLAIN_IMAGE_GRADIENT, {"std": round(std, 2), "gradient": round(gradient, 2)}
+
+
+def plate_texture_scores(pil_image, plates, size=PLATE_TEXTURE_SIZE, inset=PLATE_INSET):
+    """Texture score per (x1, y1, x2, y2) plate: each interior is resized to size x size, then scored in one pass."""
+    if not plates:
+        return np.zeros(0, dtype=np.float32)
+    gray = pil_image.convert("L")
+    boxes = np.asarray(plates, dtype=np.float64)
+    dx = (boxes[:, 2] - boxes[:, 0]) * inset
+    dy = (boxes[:, 3] - boxes[:, 1]) * inset
+    inner = np.stack([boxes[:, 0] + dx, boxes[:, 1] + dy, boxes[:, 2] - dx, boxes[:, 3] - dy], axis=1).round().astype(int)
+    inner[:, 2] = np.maximum(inner[:, 2], inner[:, 0] + 1)
+    inner[:, 3] = np.maximum(inner[:, 3], inner[:, 1] + 1)
+    crops = np.stack([
+        np.asarray(gray.crop(tuple(box)).resize((size, size), Image.BILINEAR), dtype=np.float32)
+        for box in inner.tolist()
+    ])
+    return gradient_energy(crops)
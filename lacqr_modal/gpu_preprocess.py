@@ -0,0 +1,109 @@
+import numpy as np
+import torch
+import torch.nn.functional as F
+
+
+class GpuImage:
+    """
+    One decoded image, uploaded to the GPU once as a uint8 (3, H, W) RGB tensor.
+    Every model input is derived from it with tensor ops:
+      - letterbox / letterbox_batch: Ultralytics-style inputs (0-1 float, 114 padding)
+      - resize_normalize:            fixed-size inputs (Florence-2)
+      - resize_center_crop_normalize: torchvision Resize + CenterCrop + Normalize (DINOv2)
+    Crops are views into the shared tensor, never copies.
+    """
+
+    def __init__(self, tensor):
+        self.tensor = tensor
+
+    @classmethod
+    def from_pil(cls, pil_image, device):
+        array = np.asarray(pil_image) # HWC uint8, RGB
+        tensor = torch.from_numpy(array)
+        if tensor.device.type == "cpu" and torch.device(device).type == "cuda":
+            tensor = tensor.pin_memory()
+        tensor = tensor.to(device, non_blocking=True).permute(2, 0, 1)
+        if tensor.is_cuda:
+            # Stages run on their own CUDA streams; make the upload visible to all of them
+            torch.cuda.current_stream().synchronize()
+        return cls(tensor)
+
+    @property
+    def size(self):
+        """(width, height), like PIL."""
+        return self.tensor.shape[2], self.tensor.shape[1]
+
+    def crop(self, box):
+        """View of the (x1, y1, x2, y2) region, clipped to the image."""
+        width, height = self.size
+        x1, y1, x2, y2 = (int(v) for v in box)
+        x1, x2 = max(0, min(x1, width)), max(0, min(x2, width))
+        y1, y2 = max(0, min(y1, height)), max(0, min(y2, height))
+        return self.tensor[:, y1:y2, x1:x2]
+
+    @staticmethod
+    def _resize(src, size_hw, mode):
+        x = src[None].float()
+        shrinking = size_hw[0] < x.shape[2] or size_hw[1] < x.shape[3]
+        x = F.interpolate(x, size=size_hw, mode=mode, align_corners=False, antialias=shrinking)
+        return x.clamp_(0, 255) if mode == "bicubic" else x
+
+    def letterbox(self, size, box=None, pad_value=114):
+        """
+        (1, 3, size, size) 0-1 float input with the (cropped) image centred and padded,
+        plus the scale ratio and (pad_x, pad_y) to map boxes back:
+            original = (letterboxed - pad) / ratio
+        """
+        src = self.tensor if box is None else self.crop(box)
+        _, height, width = src.shape
+        ratio = min(size / height, size / width)
+        new_h, new_w = max(1, round(height * ratio)), max(1, round(width * ratio))
+        top, left = (size - new_h) // 2, (size - new_w) // 2
+
+        out = torch.full((1, 3, size, size), float(pad_value), device=src.device)
+        out[:, :, top:top + new_h, left:left + new_w] = self._resize(src, (new_h, new_w), "bilinear")
+        return out.div_(255.0), ratio, (left, top)
+
+    def letterbox_batch(self, boxes, size, pad_value=114):
+        """Letterboxes several crops into one (B, 3, size, size) batch; returns (batch, ratios (B,), pads (B, 2))."""
+        inputs, ratios, pads = [], [], []
+        for box in boxes:
+            x, ratio, pad = self.letterbox(size, box, pad_value)
+            inputs.append(x)
+            ratios.append(ratio)
+            pads.append(pad)
+        return torch.cat(inputs), np.asarray(ratios, dtype=np.float64), np.asarray(pads, dtype=np.float64)
+
+    def resize_normalize(self, size_hw, mean, std, mode="bicubic"):
+        """(1, 3, h, w) normalized input at a fixed size."""
+        x = self._resize(self.tensor, size_hw, mode).div_(255.0)
+        return self._normalize(x, mean, std)
+
+    def resize_center_crop_normalize(self, short_side, crop, mean, std, mode="bicubic"):
+        """torchvision Resize(short_side) -> CenterCrop(crop) -> ToTensor -> Normalize, on the GPU."""
+        _, height, width = self.tensor.shape
+        if height <= width:
+            size_hw = (short_side, int(short_side * width / height))
+        else:
+            size_hw = (int(short_side * height / width), short_side)
+        x = self._resize(self.tensor, size_hw, mode)
+        top = int(round((size_hw[0] - crop) / 2.0))
+        left = int(round((size_hw[1] - crop) / 2.0))
+        x = x[:, :, top:top + crop, left:left + crop].div_(255.0)
+        return self._normalize(x, mean, std)
+
+    @staticmethod
+    def _normalize(x, mean, std):
+        mean = torch.as_tensor(mean, dtype=x.dtype, device=x.device).view(1, -1, 1, 1)
+        std = torch.as_tensor(std, dtype=x.dtype, device=x.device).view(1, -1, 1, 1)
+        return (x - mean) / std
+
+
+def unletterbox(xyxy, ratio, pad):
+    """Maps (N, 4) boxes from letterboxed input coordinates back to the (cropped) source image."""
+    xyxy = np.asarray(xyxy, dtype=np.float64)
+    pad = np.asarray(pad, dtype=np.float64)
+    ratio = np.asarray(ratio, dtype=np.float64)
+    if pad.ndim == 1:
+        return (xyxy - np.tile(pad, 2)) / ratio
+    return (xyxy - np.tile(pad, (1, 2))) / ratio[:, None]
@@ -0,0 +1,145 @@
+import io
+import math
+import urllib.parse
+from collections import namedtuple
+
+import requests
+from PIL import Image
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_TIMEOUT = (3.05, 20.0) # (connect, read) seconds
+DEFAULT_MAX_BYTES = 25 * 1024 * 1024
+DEFAULT_MAX_PIXELS = 60_000_000
+
+DecodedImage = namedtuple("DecodedImage", ["image", "full", "original_size", "scale"])
+# image:         RGB working copy, long side <= the requested max_side (or larger, see min_short_side)
+# full:          full-resolution RGB copy (only when asked for), else None
+# original_size: (width, height) of the source
+# scale:         original / working size, multiply working coordinates by it to get original ones
+
+
+class ImageFetchError(ValueError):
+    pass
+
+
+def make_session(pool_size=16, retries=3, backoff=0.3):
+    """Pooled keep-alive session; retries connection errors and 429/5xx with backoff."""
+    retry = Retry(
+        total=retries,
+        connect=retries,
+        read=retries,
+        backoff_factor=backoff,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def _peer_address(resp):
+    """IP the response was actually read from (urllib3 keeps the connection while streaming), or None."""
+    try:
+        return resp.raw._connection.sock.getpeername()[0]
+    except (AttributeError, OSError, IndexError, TypeError):
+        return None
+
+
+def _open_checked(session, url, timeout, check_url, check_address, max_redirects):
+    """
+    session.get with redirects followed by hand, so check_url sees every hop and
+    check_address the address each response came from (DNS is not trusted twice).
+    """
+    for _ in range(max_redirects + 1):
+        if check_url is not None:
+            check_url(url)
+        resp = session.get(url, stream=True, timeout=timeout, allow_redirects=False)
+        try:
+            if check_address is not None:
+                address = _peer_address(resp)
+                if address is None:
+                    raise ImageFetchError(f"Could not verify the address {url} was fetched from")
+                check_address(address, urllib.parse.urlsplit(url).hostname)
+            if not resp.is_redirect:
+                return resp
+            url = urllib.parse.urljoin(url, resp.headers["Location"])
+        except BaseException:
+            resp.close()
+            raise
+        resp.close()
+    raise ImageFetchError(f"More than {max_redirects} redirects")
+
+
+def fetch_bytes(session, url, max_bytes=DEFAULT_MAX_BYTES, timeout=DEFAULT_TIMEOUT, chunk_size=256 * 1024,
+                check_url=None, check_address=None, max_redirects=5):
+    """
+    Downloads `url`, refusing anything larger than max_bytes (checked before and while reading).
+    check_url / check_address (raise to refuse) guard client-supplied URLs: they run on
+    every redirect hop and on the connected address.
+    """
+    with _open_checked(session, url, timeout, check_url, check_address, max_redirects) as resp:
+        resp.raise_for_status()
+        declared = resp.headers.get("Content-Length")
+        if declared and declared.isdigit() and int(declared) > max_bytes:
+            raise ImageFetchError(f"Image is {int(declared)} bytes, limit is {max_bytes}")
+        buffer = bytearray()
+        for chunk in resp.iter_content(chunk_size):
+            buffer.extend(chunk)
+            if len(buffer) > max_bytes:
+                raise ImageFetchError(f"Image exceeds the {max_bytes} byte limit")
+    return bytes(buffer)
+
+
+def decode_image(data, max_side=None, keep_full=False, max_pixels=DEFAULT_MAX_PIXELS, min_short_side=None):
+    """
+    Decodes straight to the resolution the pipeline needs.
+    JPEGs use draft mode (DCT-domain 1/2, 1/4, 1/8 scaling inside libjpeg), so a
+    12 MP photo is never fully decoded when only ~1.5k px are needed. With keep_full
+    the full-resolution image is decoded once and the working copy is resized from it.
+    min_short_side raises max_side far enough that the short side keeps at least that
+    many pixels (never upscaling), for models that resize by the short side.
+    """
+    im = Image.open(io.BytesIO(data))
+    width, height = im.size
+    if width * height > max_pixels:
+        raise ImageFetchError(f"Image is {width}x{height}, limit is {max_pixels} pixels")
+
+    long_side = max(width, height)
+    if min_short_side:
+        max_side = max(max_side or 0, math.ceil(min_short_side * long_side / max(1, min(width, height))))
+    needs_resize = max_side is not None and long_side > max_side
+
+    full = None
+    if keep_full or not needs_resize:
+        full = im.convert("RGB")
+        working = full
+    else:
+        ratio = max_side / long_side
+        # Draft keeps the image >= the requested size, then an exact resize finishes the job
+        im.draft("RGB", (math.ceil(width * ratio), math.ceil(height * ratio)))
+        working = im.convert("RGB")
+
+    if needs_resize and max(working.size) > max_side:
+        ratio = max_side / max(working.size)
+        target = (max(1, round(working.width * ratio)), max(1, round(working.height * ratio)))
+        working = working.resize(target, Image.BILINEAR, reducing_gap=2.0)
+
+    return DecodedImage(
+        image=working,
+        full=full if keep_full else None,
+        original_size=(width, height),
+        scale=width / working.width
+    )
+
+
+def scale_detections(detections, factor):
+    """Maps detection boxes from working to original coordinates (in place + returned)."""
+    if factor == 1:
+        return detections
+    for det in detections:
+        det["box"] = [v * factor for v in det["box"]]
+    return detections
@@ -1,12 +1,103 @@
 import modal
-import io
 import os
 import time
 import json
 import numpy as np
-from fastapi import Response
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
 
 # --- MODAL CONFIGURATION ---
+# Stage 1B: max nail-plate crops per YOLO-World forward pass (bounds GPU memory)
+MICRO_BATCH_SIZE = int(os.environ.get("LACQR_MICRO_BATCH_SIZE", "16"))
+MICRO_IMGSZ = 640
+# "plates": one crop per nail plate. "sliced": adaptive tiles around each plate for small-gem recall
+MICRO_MODE = os.environ.get("LACQR_MICRO_MODE", "plates")
+# Sliced mode merge: greedy NMM ("nmm") or NMS ("nms") over intersection-over-smaller-box
+SLICE_MERGE_MODE = os.environ.get("LACQR_SLICE_MERGE", "nmm")
+SLICE_MATCH_THRESHOLD = 0.5
+
+# Image ingestion: images are decoded straight to the largest size any stage needs.
+# Stage 1B crops plates out of the working image, so it needs more than the 640px models;
+# sliced mode additionally keeps a full-resolution copy for its tiles.
+# The YOLO stages letterbox the long side, so they cap it:
+STAGE_MAX_SIDE = {
+    "nail_plates": 640,
+    "micro": int(os.environ.get("LACQR_MICRO_MAX_SIDE", "1536")),
+}
+# DINOv2 resizes the short side to 256 (then center-crops 224) and Florence squashes to
+# 768x768, so these need a minimum short side; the long side follows the aspect ratio.
+STAGE_MIN_SHORT_SIDE = {
+    "florence": 768,
+    "dinov2": 256,
+}
+IMAGE_MAX_BYTES = int(os.environ.get("LACQR_IMAGE_MAX_BYTES", str(25 * 1024 * 1024)))
+IMAGE_FETCH_TIMEOUT = (3.05, float(os.environ.get("LACQR_IMAGE_READ_TIMEOUT", "20")))
+# On CUDA the decoded image is uploaded once and every model input is built from it on the GPU
+GPU_PREPROCESS = os.environ.get("LACQR_GPU_PREPROCESS", "1") == "1"
+
+# Precision / compilation profiles (CUDA only; CPU always runs fp32).
+# Per model: "fp32", "fp16" (half weights) or "autocast" (fp32 weights, fp16 kernels).
+# Each reduced-precision model is checked against fp32 when it loads and falls back to fp32
+# on a mismatch. A profile other than fp32 is only served once the precision_parity
+# entrypoint has recorded a passing report for it (see parity_passed).
+PRECISION_PROFILES = {
+    "fp32": {"yolo": "fp32", "yolo_world": "fp32", "florence": "fp32", "dinov2": "fp32", "compile": ()},
+    "fp16": {"yolo": "fp16", "yolo_world": "fp16", "florence": "fp16", "dinov2": "fp16", "compile": ()},
+    "autocast": {"yolo": "fp16", "yolo_world": "fp16", "florence": "autocast", "dinov2": "autocast", "compile": ()},
+    "fp16_compiled": {"yolo": "fp16", "yolo_world": "fp16", "florence": "fp16", "dinov2": "fp16", "compile": ("dinov2",)},
+}
+PRECISION_PROFILE = os.environ.get("LACQR_PRECISION_PROFILE", "fp32")
+
+# Florence-2 decoding budgets per profile. "default" applies to any task without its own entry.
+# "quality" reproduces the original beam search; "fast" decodes greedily with short budgets.
+FLORENCE_PROFILES = {
+    "quality": {
+        "default": {"num_beams": 3, "max_new_tokens": 1024},
+    },
+    "fast": {
+        "default": {"num_beams": 1, "do_sample": False, "max_new_tokens": 256},
+        "<MORE_DETAILED_CAPTION>": {"num_beams": 1, "do_sample": False, "max_new_tokens": 192},
+        "<OD>": {"num_beams": 1, "do_sample": False, "max_new_tokens": 512},
+    },
+}
+FLORENCE_DEFAULT_PROFILE = os.environ.get("LACQR_FLORENCE_PROFILE", "quality")
+
+# Cascaded execution profiles: which stages run, whether earlier results may short-circuit
+# later ones, and per-stage latency budgets (ms) after which the stage's fallback is used.
+# Cascade rules: a plain solid-colour photo stops after decoding; no nail plates means no
+# YOLO-World and no Florence-2 OD; micro-detection only runs on textured plates.
+PIPELINE_PROFILES = {
+    "full": {
+        "stages": ["nail_plates", "micro", "florence", "dinov2"],
+        "cascade": True,
+        "budgets_ms": {"nail_plates": 3000, "micro": 8000, "florence": 20000, "dinov2": 3000},
+    },
+    # Quick quotes price from plate shape + bling + texture: no Florence-2 at all
+    "fast_quote": {
+        "stages": ["nail_plates", "micro", "dinov2"],
+        "cascade": True,
+        "budgets_ms": {"nail_plates": 1000, "micro": 2500, "dinov2": 1000},
+    },
+    # Every stage on every image, no short-circuits or budgets (pre-cascade behaviour)
+    "exhaustive": {
+        "stages": ["nail_plates", "micro", "florence", "dinov2"],
+        "cascade": False,
+        "budgets_ms": {},
+    },
+}
+PIPELINE_DEFAULT_PROFILE = os.environ.get("LACQR_PIPELINE_PROFILE", "full")
+STAGE_MODEL_NAMES = {"nail_plates": "YOLOv11", "micro": "YOLO-World", "florence": "Florence-2", "dinov2": "DINOv2"}
+
+
+def florence_decode_config(task_prompt, profile=None, overrides=None):
+    """Resolves the generate() kwargs for a task: profile default < per-task entry < overrides."""
+    budgets = FLORENCE_PROFILES.get(profile or FLORENCE_DEFAULT_PROFILE, FLORENCE_PROFILES["quality"])
+    config = dict(budgets["default"])
+    config.update(budgets.get(task_prompt, {}))
+    if overrides:
+        config.update(overrides.get(task_prompt, {}))
+    return config
+
 app = modal.App("lacqr-brain")
 
 # Define the image with all necessary dependencies
@@ -30,12 +121,99 @@ image = (
         "einops", 
         "timm"
     )
+    .env({
+        # Hub downloads land on the persistent cache volume instead of the container disk
+        "HF_HOME": "/cache/models/hf",
+        "TORCH_HOME": "/cache/models/torch"
+    })
     .run_commands(
         "pip install git+https://github.com/facebookresearch/segment-anything-2.git"
     )
     .add_local_file("backend/models/best.pt", "/root/best.pt")
+    .add_local_file("backend/result_cache.py", "/root/result_cache.py")
+    .add_local_file("backend/tracing.py", "/root/tracing.py")
+    .add_local_file("lacqr_modal/stage_graph.py", "/root/stage_graph.py")
+    .add_local_file("lacqr_modal/model_registry.py", "/root/model_registry.py")
+    .add_local_file("lacqr_modal/slicing.py", "/root/slicing.py")
+    .add_local_file("lacqr_modal/image_fetch.py", "/root/image_fetch.py")
+    .add_local_file("lacqr_modal/vector_index.py", "/root/vector_index.py")
+    .add_local_file("lacqr_modal/gpu_preprocess.py", "/root/gpu_preprocess.py")
+    .add_local_file("lacqr_modal/precision.py", "/root/precision.py")
+    .add_local_file("backend/batch_jobs.py", "/root/batch_jobs.py")
+    .add_local_file("lacqr_modal/cascade.py", "/root/cascade.py")
+    .add_local_file("backend/pricing_features.py", "/root/pricing_features.py")
 )
 
+# Persistent volume for caches that should survive container restarts
+cache_volume = modal.Volume.from_name("lacqr-cache", create_if_missing=True)
+CACHE_DIR = "/cache"
+MODEL_CACHE_DIR = f"{CACHE_DIR}/models"
+PARITY_REPORT_DIR = f"{CACHE_DIR}/precision"
+
+
+def parity_report(profile):
+    """Parity report recorded by precision_parity for a profile ({} if never run)."""
+    try:
+        with open(f"{PARITY_REPORT_DIR}/{profile}.json") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def parity_passed(profile):
+    """
+    A reduced-precision profile is servable only if its recorded parity run passed
+    for the current pipeline and the same profile definition.
+    """
+    if profile == "fp32":
+        return True
+    report = parity_report(profile)
+    return (
+        bool(report.get("summary", {}).get("passed"))
+        and report.get("pipeline") == PIPELINE_VERSION
+        # Compared in JSON form: the stored definition has lists where the profile has tuples
+        and report.get("definition") == json.loads(json.dumps(PRECISION_PROFILES.get(profile)))
+    )
+
+# --- MODEL REGISTRY ---
+YOLO_WORLD_WEIGHTS = "yolov8s-world.pt"
+YOLO_WORLD_CLASSES = ["charm", "gem", "sticker", "dried flower", "pearl", "chain", "3d art", "french tip", "chrome"]
+SAM2_CHECKPOINT = "sam2_hiera_large.pt"
+FLORENCE_MODEL_ID = "microsoft/Florence-2-base"
+DINOV2_MODEL = "dinov2_vits14"
+# Loaded in parallel at container start; everything else (e.g. SAM 2) loads on first use
+PRELOAD_MODELS = [m for m in os.environ.get("LACQR_PRELOAD_MODELS", "yolo,yolo_world,florence,dinov2").split(",") if m]
+
+# Bump whenever pipeline output changes so stale cached results are never served
+PIPELINE_VERSION = "4"
+RESULT_CACHE_MAX_BYTES = 128 * 1024 * 1024
+
+# Similar-design search over DINOv2 embeddings: "local" (embedded IVF index on the cache
+# volume, no network round trip) or "milvus" (Zilliz collection)
+VECTOR_BACKEND = os.environ.get("LACQR_VECTOR_BACKEND", "local")
+VECTOR_INDEX_DIR = f"{CACHE_DIR}/vectors/{DINOV2_MODEL}"
+VECTOR_COLLECTION = "lacqr_designs"
+VECTOR_SEARCH_P99_MS = float(os.environ.get("LACQR_VECTOR_P99_MS", "10"))
+# The local index persists itself every N new designs (and on exit), merging with the copy on
+# the volume so containers add to each other's designs instead of overwriting them
+VECTOR_SAVE_EVERY = int(os.environ.get("LACQR_VECTOR_SAVE_EVERY", "64"))
+DINOV2_EMBED_DIMS = {"dinov2_vits14": 384, "dinov2_vitb14": 768, "dinov2_vitl14": 1024, "dinov2_vitg14": 1536}
+
+# Independent stages (YOLO chain, Florence-2, DINOv2) run concurrently; 1 = sequential
+STAGE_WORKERS = int(os.environ.get("LACQR_STAGE_WORKERS", "3"))
+
+# Bulk portfolio jobs: images are sent to LacqrBrain containers in chunks (one call per
+# chunk instead of one HTTP round trip per image); each container prefetches ahead of the GPU.
+# Job state and partial results live in a modal.Dict so any web container can answer polls.
+BATCH_CHUNK_SIZE = int(os.environ.get("LACQR_BATCH_CHUNK_SIZE", "8"))
+BATCH_PREFETCH = int(os.environ.get("LACQR_BATCH_PREFETCH", "4"))
+BATCH_JOB_TIMEOUT = 3 * 60 * 60
+# Finished jobs (and their results) are dropped from the dict after this long
+BATCH_JOB_TTL = float(os.environ.get("LACQR_JOB_TTL_S", "3600"))
+# Containers a bulk job can fan out to; 1 keeps the original single-GPU cost ceiling
+BRAIN_MAX_CONTAINERS = int(os.environ.get("LACQR_BRAIN_MAX_CONTAINERS", "1"))
+batch_jobs_dict = modal.Dict.from_name("lacqr-batch-jobs", create_if_missing=True)
+
 # Secrets for Zilliz
 zilliz_secret = modal.Secret.from_dict({
     "ZILLIZ_URI": os.environ.get("ZILLIZ_URI", "YOUR_ZILLIZ_URI"),
@@ -47,95 +225,91 @@ zilliz_secret = modal.Secret.from_dict({
     image=image,
     gpu="T4",  # Downgraded from L4 to T4 for cost savings
     secrets=[zilliz_secret],
-    concurrency_limit=1, # Limit concurrency to 1 to prevent cost spikes
+    volumes={CACHE_DIR: cache_volume},
+    concurrency_limit=BRAIN_MAX_CONTAINERS, # Defaults to 1 to prevent cost spikes
     timeout=600 
 )
 class LacqrBrain:
     loading_errors = {} # Class-level storage for errors
+    # LacqrBrain(precision="fp16") runs a separate container pool with that profile
+    precision: str = modal.parameter(default="")
+    # Set only by precision_parity: the profile under test has no passing report yet
+    parity_run: bool = modal.parameter(default=False)
 
     @modal.enter()
     def load_models(self):
-        self.yolo = None
-        self.yolo_world = None
-        self.sam2_predictor = None
-        self.florence_model = None
-        self.florence_processor = None
-        self.dinov2 = None
         self.loading_errors = {}
+        # Degraded-but-working states (e.g. a fallback model); unlike errors they do not disable caching
+        self.loading_warnings = {}
+        self.result_cache = None
+        self.vector_store = None
+        requested = self.precision if isinstance(self.precision, str) and self.precision else PRECISION_PROFILE
+        if requested not in PRECISION_PROFILES:
+            self.loading_errors["precision"] = f"Unknown precision profile '{requested}', using fp32"
+            requested = "fp32"
+        elif self.parity_run is not True and not parity_passed(requested):
+            # fp32 results are exact, so this is a warning: it must not disable the result cache
+            self.loading_warnings["precision"] = (
+                f"Precision profile '{requested}' has no passing parity report, using fp32 "
+                f"(run precision_parity --profile {requested})"
+            )
+            requested = "fp32"
+        self.precision_profile = requested
+        self.precision_state = {} # model -> {"mode", "compiled", "check"}
+        self.device = "cpu"
+        self.gpu_name = "cpu"
 
-        try:
-            print("🧠 Loading Models (Open-World Stack)...")
-            import torch
-            from ultralytics import YOLO
-            from sam2.build_sam import build_sam2
-            from sam2.sam2_image_predictor import SAM2ImagePredictor
-            from transformers import AutoProcessor, AutoModelForCausalLM
-            from pymilvus import connections
-            import requests # Import requests for downloading
+        from tracing import MetricsRegistry
+        self.metrics = MetricsRegistry()
 
-            self.device = "cuda" if torch.cuda.is_available() else "cpu"
-            print(f"🚀 Device: {self.device}")
+        from concurrent.futures import ThreadPoolExecutor
+        self.stage_executor = ThreadPoolExecutor(max_workers=max(1, STAGE_WORKERS), thread_name_prefix="lacqr-stage")
+        # One lock per stage model: the executor is shared between requests, and a stage
+        # abandoned on its budget keeps running, so two requests must never drive one model at once
+        import threading
+        self.model_locks = {stage: threading.Lock() for stage in STAGE_MODEL_NAMES}
+        # Separate pool so bulk-job downloads never queue behind model stages
+        self.prefetch_executor = ThreadPoolExecutor(max_workers=max(1, BATCH_PREFETCH), thread_name_prefix="lacqr-prefetch")
 
-            # 1. Load Custom YOLOv11
-            try:
-                model_path = "/root/best.pt"
-                if os.path.exists(model_path):
-                    print(f"✅ Loading Custom YOLOv11: {model_path}")
-                    self.yolo = YOLO(model_path)
-                else:
-                    print("⚠️ Custom model not found, using fallback.")
-                    self.yolo = YOLO("yolo11m-seg.pt")
-            except Exception as e:
-                print(f"❌ Failed to load Custom YOLO: {e}")
-                self.loading_errors["yolo"] = str(e)
-                self.yolo = YOLO("yolo11m-seg.pt")
+        from image_fetch import make_session
+        # Keep-alive pool shared by every request this container serves
+        self.http = make_session(pool_size=max(4, STAGE_WORKERS * 4))
 
-            # 2. Load YOLO-World
-            try:
-                print("🌍 Loading YOLO-World...")
-                self.yolo_world = YOLO("yolov8s-world.pt") 
-                self.yolo_world.set_classes(["charm", "gem", "sticker", "dried flower", "pearl", "chain", "3d art", "french tip", "chrome"])
-            except Exception as e:
-                print(f"❌ Failed to load YOLO-World: {e}")
-                self.loading_errors["yolo_world"] = str(e)
+        try:
+            from result_cache import ResultCache
+            self.result_cache = ResultCache(
+                max_bytes=RESULT_CACHE_MAX_BYTES,
+                disk_dir=os.path.join(CACHE_DIR, "results")
+            )
+        except Exception as e:
+            print(f"⚠️ Result cache disabled: {e}")
+            self.loading_errors["result_cache"] = str(e)
 
-            # 3. Load SAM 2
-            try:
-                sam2_checkpoint = "sam2_hiera_large.pt"
-                if not os.path.exists(sam2_checkpoint):
-                    print("Downloading SAM 2 Checkpoint...")
-                    # Use requests instead of os.system(wget) for reliability
-                    url = f"https://dl.fbaipublicfiles.com/segment_anything_2/072824/{sam2_checkpoint}"
-                    resp = requests.get(url)
-                    with open(sam2_checkpoint, 'wb') as f:
-                        f.write(resp.content)
-                        
-                self.sam2_predictor = SAM2ImagePredictor(build_sam2("sam2_hiera_l.yaml", sam2_checkpoint, device=self.device))
-            except Exception as e:
-                print(f"❌ Failed to load SAM 2: {e}")
-                self.loading_errors["sam2"] = str(e)
+        # Models load on first use (or in parallel below); weights live on the cache volume
+        from model_registry import ModelRegistry
+        self.models = ModelRegistry(after_load=lambda names: cache_volume.commit())
+        self.models.errors = self.loading_errors
+        self.models.register("yolo", self._load_yolo, source=os.path.basename(self._yolo_weights()))
+        self.models.register("yolo_world", self._load_yolo_world, source=YOLO_WORLD_WEIGHTS)
+        self.models.register("sam2", self._load_sam2, source=SAM2_CHECKPOINT)
+        self.models.register("florence", self._load_florence, source=FLORENCE_MODEL_ID)
+        self.models.register("dinov2", self._load_dinov2, source=DINOV2_MODEL)
 
-            # 3.5 Load Florence-2
-            try:
-                print("📜 Loading Florence-2 (The Scribe)...")
-                model_id = "microsoft/Florence-2-base"
-                self.florence_model = AutoModelForCausalLM.from_pretrained(model_id, trust_remote_code=True).to(self.device).eval()
-                self.florence_processor = AutoProcessor.from_pretrained(model_id, trust_remote_code=True)
-            except Exception as e:
-                print(f"❌ Failed to load Florence-2: {e}")
-                self.loading_errors["florence"] = str(e)
+        try:
+            print("🧠 Loading Models (Open-World Stack)...")
+            import torch
 
-            # 4. Load DINOv2
-            try:
-                print("🦖 Loading DINOv2...")
-                self.dinov2 = torch.hub.load('facebookresearch/dinov2', 'dinov2_vits14').to(self.device)
-                self.dinov2.eval()
-            except Exception as e:
-                print(f"❌ Failed to load DINOv2: {e}")
-                self.loading_errors["dinov2"] = str(e)
+            self.device = "cuda" if torch.cuda.is_available() else "cpu"
+            self.gpu_name = torch.cuda.get_device_name(0) if self.device == "cuda" else "cpu"
+            print(f"🚀 Device: {self.device} ({self.gpu_name})")
+            os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
+
+            print(f"🧠 Preloading in parallel: {PRELOAD_MODELS or 'nothing (lazy)'}")
+            self.models.load_many(PRELOAD_MODELS)
 
             # 5. Connect to Milvus
             try:
+                from pymilvus import connections
                 print("🔌 Connecting to Zilliz...")
                 connections.connect(
                     alias="default", 
@@ -146,7 +320,14 @@ class LacqrBrain:
                 print(f"❌ Failed to connect to Zilliz: {e}")
                 self.loading_errors["milvus"] = str(e)
 
-            print("✅ Open-World Stack Loaded!")
+            # 6. Design embedding index
+            try:
+                self.vector_store = self._make_vector_store()
+            except Exception as e:
+                print(f"❌ Vector index unavailable: {e}")
+                self.loading_errors["vector_index"] = str(e)
+
+            print(f"✅ Open-World Stack Ready: {json.dumps(self.models.report())}")
         
         except Exception as e:
             print(f"🔥 CRITICAL ERROR IN LOAD_MODELS: {e}")
@@ -154,111 +335,519 @@ class LacqrBrain:
             import traceback
             traceback.print_exc()
 
-    def run_florence(self, image, task_prompt, text_input=None):
-        if not self.florence_model or not self.florence_processor:
-            return "Florence-2 not loaded"
-        
+    # --- MODEL LOADERS (called lazily by the registry) ---
+    @staticmethod
+    def _yolo_weights():
+        model_path = "/root/best.pt"
+        if os.path.exists(model_path):
+            return model_path
+        return os.path.join(MODEL_CACHE_DIR, "yolo11m-seg.pt")
+
+    def _load_yolo(self):
+        # 1. Load Custom YOLOv11
+        from ultralytics import YOLO
+        model_path = self._yolo_weights()
+        try:
+            print(f"✅ Loading Custom YOLOv11: {model_path}")
+            return self._apply_precision("yolo", YOLO(model_path))
+        except Exception as e:
+            print(f"❌ Failed to load Custom YOLO: {e}, using fallback.")
+            self.loading_warnings["yolo"] = f"Custom weights failed ({e}), serving the fallback model"
+            return self._apply_precision("yolo", YOLO(os.path.join(MODEL_CACHE_DIR, "yolo11m-seg.pt")))
+
+    def _load_yolo_world(self):
+        # 2. Load YOLO-World
+        from ultralytics import YOLO
+        print("🌍 Loading YOLO-World...")
+        yolo_world = YOLO(os.path.join(MODEL_CACHE_DIR, YOLO_WORLD_WEIGHTS))
+        yolo_world.set_classes(YOLO_WORLD_CLASSES)
+        return self._apply_precision("yolo_world", yolo_world)
+
+    def _load_sam2(self):
+        # 3. Load SAM 2 (not used by process_pipeline, so never preloaded)
+        from sam2.build_sam import build_sam2
+        from sam2.sam2_image_predictor import SAM2ImagePredictor
+        from model_registry import download_to_cache
+        checkpoint = download_to_cache(
+            f"https://dl.fbaipublicfiles.com/segment_anything_2/072824/{SAM2_CHECKPOINT}",
+            os.path.join(MODEL_CACHE_DIR, SAM2_CHECKPOINT)
+        )
+        return SAM2ImagePredictor(build_sam2("sam2_hiera_l.yaml", checkpoint, device=self.device))
+
+    def _load_florence(self):
+        # 3.5 Load Florence-2 (HF_HOME points at the cache volume)
+        from transformers import AutoProcessor, AutoModelForCausalLM
+        print("📜 Loading Florence-2 (The Scribe)...")
+        model = AutoModelForCausalLM.from_pretrained(FLORENCE_MODEL_ID, trust_remote_code=True).to(self.device).eval()
+        processor = AutoProcessor.from_pretrained(FLORENCE_MODEL_ID, trust_remote_code=True)
+        return self._apply_precision("florence", model), processor
+
+    def _make_vector_store(self):
+        from vector_index import LocalIVFIndex, MilvusVectorStore, TimedVectorStore
+        dim = DINOV2_EMBED_DIMS[DINOV2_MODEL]
+        if VECTOR_BACKEND == "milvus":
+            store = MilvusVectorStore(VECTOR_COLLECTION, dim)
+        else:
+            store = LocalIVFIndex(
+                dim, path=VECTOR_INDEX_DIR, save_every=VECTOR_SAVE_EVERY,
+                before_save=self._reload_cache_volume, after_save=cache_volume.commit
+            ).load()
+        print(f"🗂️ Vector index: {json.dumps(store.stats())}")
+        return TimedVectorStore(store, self.metrics, p99_target_ms=VECTOR_SEARCH_P99_MS)
+
+    def _reload_cache_volume(self):
+        # Picks up index files other containers committed, so save() merges with them
         try:
-            if text_input is None:
-                prompt = task_prompt
+            cache_volume.reload()
+        except Exception as e:
+            print(f"⚠️ Could not reload the cache volume: {e}")
+
+    @modal.exit()
+    def shutdown(self):
+        # Persist designs indexed since the last autosave (local backend; commits the volume) /
+        # flush pending inserts (milvus)
+        if getattr(self, "vector_store", None) is not None:
+            try:
+                self.vector_store.save()
+            except Exception as e:
+                print(f"⚠️ Could not persist the vector index: {e}")
+
+    def _load_dinov2(self):
+        # 4. Load DINOv2 (TORCH_HOME points at the cache volume)
+        import torch
+        print("🦖 Loading DINOv2...")
+        dinov2 = torch.hub.load('facebookresearch/dinov2', DINOV2_MODEL).to(self.device)
+        dinov2.eval()
+        return self._apply_precision("dinov2", dinov2)
+
+    # --- PRECISION ---
+    def _precision_mode(self, name):
+        state = getattr(self, "precision_state", {}).get(name)
+        return state["mode"] if state else "fp32"
+
+    def _half(self, name):
+        """half= flag for Ultralytics calls."""
+        return self._precision_mode(name) == "fp16"
+
+    def _autocast(self, name):
+        import torch
+        from contextlib import nullcontext
+        if self._precision_mode(name) == "autocast":
+            return torch.autocast("cuda", dtype=torch.float16)
+        return nullcontext()
+
+    def _apply_precision(self, name, model):
+        """
+        Moves `model` to the profile's precision after a numerical check against fp32
+        on a fixed synthetic input; any mismatch (or error) keeps the model in fp32.
+        """
+        import torch
+        from precision import output_agreement, yolo_output_agreement
+
+        profile = PRECISION_PROFILES[getattr(self, "precision_profile", "fp32")]
+        mode = profile.get(name, "fp32") if getattr(self, "device", "cpu") == "cuda" else "fp32"
+        state = {"mode": "fp32", "requested": mode, "compiled": False, "check": None}
+        self.precision_state[name] = state
+        if mode == "fp32":
+            return model
+
+        generator = torch.Generator(device="cpu").manual_seed(0)
+        try:
+            with torch.inference_mode():
+                if name in ("yolo", "yolo_world"):
+                    # Ultralytics casts the network itself when called with half=True;
+                    # check a half copy of the raw nn.Module
+                    import copy
+                    net = model.model.to(self.device).float().eval()
+                    x = torch.rand(1, 3, 640, 640, generator=generator).to(self.device)
+                    reference = net(x)
+                    candidate = copy.deepcopy(net).half()(x.half())
+                elif name == "florence":
+                    x = torch.randn(1, 3, 768, 768, generator=generator).to(self.device)
+                    reference = model._encode_image(x)
+                    if mode == "fp16":
+                        model.half()
+                        candidate = model._encode_image(x.half())
+                    else:
+                        with torch.autocast("cuda", dtype=torch.float16):
+                            candidate = model._encode_image(x)
+                else:
+                    x = torch.randn(1, 3, 224, 224, generator=generator).to(self.device)
+                    reference = model(x)
+                    if mode == "fp16":
+                        model.half()
+                        candidate = model(x.half())
+                    else:
+                        with torch.autocast("cuda", dtype=torch.float16):
+                            candidate = model(x)
+            if name in ("yolo", "yolo_world"):
+                ok, details = yolo_output_agreement(reference, candidate, len(model.names))
             else:
-                prompt = task_prompt + text_input
-
-            inputs = self.florence_processor(text=prompt, images=image, return_tensors="pt").to(self.device)
-            generated_ids = self.florence_model.generate(
-                input_ids=inputs["input_ids"],
-                pixel_values=inputs["pixel_values"],
-                max_new_tokens=1024,
-                num_beams=3
-            )
-            generated_text = self.florence_processor.batch_decode(generated_ids, skip_special_tokens=False)[0]
-            parsed_answer = self.florence_processor.post_process_generation(generated_text, task=task_prompt, image_size=(image.width, image.height))
-            
-            # Extract actual content from dict
-            if isinstance(parsed_answer, dict):
-                return parsed_answer.get(task_prompt, parsed_answer)
-            return parsed_answer
-            
+                ok, details = output_agreement(reference, candidate)
         except Exception as e:
-            return f"Florence Error: {e}"
+            ok, details = False, {"reason": f"check failed: {e}"}
+
+        state["check"] = details
+        if not ok:
+            print(f"⚠️ {name}: {mode} disagrees with fp32 ({details}), keeping fp32")
+            if name in ("florence", "dinov2"):
+                model.float()
+            return model
+
+        state["mode"] = mode
+        print(f"⚡ {name}: {mode} ({details})")
+        if name in profile.get("compile", ()) and hasattr(torch, "compile"):
+            try:
+                # "default" (kernel fusion, no CUDA graphs): "reduce-overhead" would capture graphs
+                # on this loader thread's stream, but stages call the model from StageGraph worker
+                # threads on their own streams
+                compiled = torch.compile(model, mode="default")
+                with torch.inference_mode():
+                    # Compile now (fixed 224px input) instead of on the first request
+                    compiled(x.half() if mode == "fp16" else x)
+                state["compiled"] = True
+                return compiled
+            except Exception as e:
+                print(f"⚠️ torch.compile({name}) failed, staying eager: {e}")
+        return model
+
+    # Stages keep using plain attributes; each one resolves through the registry on first use
+    @property
+    def yolo(self):
+        return self.models.get("yolo")
+
+    @property
+    def yolo_world(self):
+        return self.models.get("yolo_world")
+
+    @property
+    def sam2_predictor(self):
+        return self.models.get("sam2")
+
+    @property
+    def florence_model(self):
+        florence = self.models.get("florence")
+        return florence[0] if florence else None
+
+    @property
+    def florence_processor(self):
+        florence = self.models.get("florence")
+        return florence[1] if florence else None
+
+    @property
+    def dinov2(self):
+        return self.models.get("dinov2")
 
     @modal.method()
-    def process_pipeline(self, image_url: str):
-        import requests
-        from PIL import Image
-        import numpy as np
-        import torch
-        
-        print(f"📸 Processing: {image_url}")
-        
+    def model_status(self):
+        """Load time, memory, error and precision per registered model."""
+        report = self.models.report()
+        for name, state in getattr(self, "precision_state", {}).items():
+            if name in report:
+                report[name]["precision"] = state
+        return report
+
+    @modal.method()
+    def metrics_snapshot(self, format: str = "json"):
+        """Aggregated per-stage latency histograms for this container."""
+        if format == "prometheus":
+            return self.metrics.prometheus()
+        return {
+            "latency": self.metrics.snapshot(),
+            "models": self.models.report(),
+            "vector_index": self.vector_store.stats() if self.vector_store is not None else None
+        }
+
+    @staticmethod
+    def _trace(trace):
+        if trace is not None:
+            return trace
+        from tracing import Trace
+        return Trace(enabled=False)
+
+    def run_florence(self, image, task_prompt, text_input=None, profile=None):
+        if not self.florence_model or not self.florence_processor:
+            return "Florence-2 not loaded"
+
+        return self.run_florence_multi(image, [(task_prompt, text_input)], profile=profile)[task_prompt]
+
+    def run_florence_multi(self, image, tasks, profile=None, decode_overrides=None, trace=None, output_size=None, gpu_image=None):
+        """
+        Runs several Florence-2 tasks on one image.
+        The vision encoder runs ONCE; its features are reused for every task prompt, and
+        tasks that share a decoding config are decoded together as one batch.
+        `tasks` is a list of task prompts or (task_prompt, text_input) tuples.
+        `output_size` (width, height) sets the coordinate space of region outputs
+        (defaults to the image's own size). With `gpu_image` (a GpuImage of the same
+        picture) pixel values are built on the GPU instead of by the CPU image processor.
+        Returns {task_prompt: parsed_answer}.
+        """
+        tasks = [t if isinstance(t, tuple) else (t, None) for t in tasks]
+        trace = self._trace(trace)
+        if not self.florence_model or not self.florence_processor:
+            return {task: "Florence-2 not loaded" for task, _ in tasks}
+
         try:
-            # Download Image
-            resp = requests.get(image_url, stream=True)
-            resp.raise_for_status()
-            pil_image = Image.open(resp.raw).convert("RGB")
-            width, height = pil_image.size
+            import torch
+
+            model = self.florence_model
+            processor = self.florence_processor
+            dtype = next(model.parameters()).dtype
+
+            with torch.inference_mode(), self._autocast("florence"):
+                # 1. Encode the image once
+                with trace.span("florence.preprocess"):
+                    if gpu_image is not None:
+                        ip = processor.image_processor
+                        size = getattr(ip, "size", None) or {"height": 768, "width": 768}
+                        pixel_values = gpu_image.resize_normalize(
+                            (size["height"], size["width"]), ip.image_mean, ip.image_std, mode="bicubic"
+                        )
+                    else:
+                        pixel_values = processor.image_processor(image, return_tensors="pt")["pixel_values"]
+                with trace.span("florence.encode"):
+                    image_features = model._encode_image(pixel_values.to(self.device, dtype))
+
+                # 2. Group tasks by decoding budget so each group is one generate() call
+                groups = {}
+                for task, text_input in tasks:
+                    config = florence_decode_config(task, profile, decode_overrides)
+                    key = tuple(sorted(config.items()))
+                    groups.setdefault(key, []).append((task, text_input))
+
+                parsed = {}
+                for key, group in groups.items():
+                    prompts = processor._construct_prompts([task + (text or "") for task, text in group])
+                    tokens = processor.tokenizer(prompts, return_tensors="pt", padding=True).to(self.device)
+
+                    # Merge the shared image features with each (padded) task prompt
+                    text_embeds = model.get_input_embeddings()(tokens["input_ids"])
+                    features = image_features.expand(len(group), -1, -1)
+                    inputs_embeds, _ = model._merge_input_ids_with_image_features(features, text_embeds)
+                    attention_mask = torch.cat([
+                        torch.ones(features.shape[:2], dtype=tokens["attention_mask"].dtype, device=self.device),
+                        tokens["attention_mask"]
+                    ], dim=1)
+
+                    with trace.span("florence.decode"):
+                        generated_ids = model.language_model.generate(
+                            input_ids=None,
+                            inputs_embeds=inputs_embeds,
+                            attention_mask=attention_mask,
+                            **dict(key)
+                        )
+                    trace.set("florence_generated_tokens", int(generated_ids.shape[-1]))
+
+                    with trace.span("florence.postprocess"):
+                        generated_texts = processor.batch_decode(generated_ids, skip_special_tokens=False)
+                        for (task, _), generated_text in zip(group, generated_texts):
+                            parsed_answer = processor.post_process_generation(generated_text, task=task, image_size=output_size or (image.width, image.height))
+                            # Extract actual content from dict
+                            if isinstance(parsed_answer, dict):
+                                parsed_answer = parsed_answer.get(task, parsed_answer)
+                            parsed[task] = parsed_answer
+
+            return parsed
+
         except Exception as e:
-            return {"error": f"Failed to download/process image: {e}"}
+            return {task: f"Florence Error: {e}" for task, _ in tasks}
 
-        detections = []
-        florence_captions = {}
-        material_tags = []
+    def run_micro_detection(self, pil_image, nail_plates, max_batch=MICRO_BATCH_SIZE, trace=None, gpu_image=None):
+        """
+        Batched Stage 1B.
+        Crops every nail plate, lets YOLO-World letterbox the crops into one tensor batch
+        (chunked by `max_batch` to keep GPU memory bounded) and maps all boxes back to
+        global image coordinates in a single vectorized step.
+        """
+        width, height = pil_image.size
+
+        # Clip plate boxes to the image (same int truncation as the per-crop loop used)
+        plates = np.asarray(nail_plates, dtype=np.float64).reshape(-1, 4).astype(int)
+        plates[:, [0, 2]] = np.clip(plates[:, [0, 2]], 0, width)
+        plates[:, [1, 3]] = np.clip(plates[:, [1, 3]], 0, height)
+        plates = plates[(plates[:, 2] > plates[:, 0]) & (plates[:, 3] > plates[:, 1])]
+        if len(plates) == 0:
+            return []
+
+        trace = self._trace(trace)
+        global_boxes, confs, classes = self._detect_in_regions(pil_image, plates, max_batch, trace, gpu_image)
+        return self._micro_objects(global_boxes, confs, classes)
+
+    def run_sliced_micro_detection(self, pil_image, nail_plates, max_batch=MICRO_BATCH_SIZE, trace=None, gpu_image=None):
+        """
+        Sliced (SAHI-style) Stage 1B for small-object recall.
+        Only the regions around the nail plates are tiled, with tile size and overlap
+        chosen per plate (see slicing.adaptive_tile_params). All tiles of all plates go
+        through YOLO-World as one batch and the overlapping predictions are merged with
+        a single class-aware greedy NMM over a precomputed overlap matrix.
+        """
+        from slicing import plate_tiles, merge_detections
+
+        trace = self._trace(trace)
+        # Tiles never exceed the model input, so small gems are only ever upscaled
+        tiles, _ = plate_tiles(nail_plates, pil_image.size, max_tile=MICRO_IMGSZ)
+        trace.set("micro_tiles", len(tiles))
+        if len(tiles) == 0:
+            return []
+
+        global_boxes, confs, classes = self._detect_in_regions(pil_image, tiles, max_batch, trace, gpu_image)
+        if len(global_boxes) == 0:
+            return []
+        with trace.span("yolo_world.merge"):
+            global_boxes, confs, classes = merge_detections(
+                global_boxes, confs, classes, threshold=SLICE_MATCH_THRESHOLD, metric="ios", mode=SLICE_MERGE_MODE
+            )
+        return self._micro_objects(global_boxes, confs, classes)
+
+    def _detect_in_regions(self, pil_image, regions, max_batch, trace, gpu_image=None):
+        """
+        Runs YOLO-World over crops of `regions` ((N, 4) int xyxy), `max_batch` crops per
+        forward pass, and returns (boxes, confs, classes) in global image coordinates.
+        With `gpu_image` the crops are views of the GPU tensor, letterboxed on the GPU.
+        """
+        from gpu_preprocess import unletterbox
+
+        if gpu_image is None:
+            with trace.span("yolo_world.crop"):
+                crops = [pil_image.crop(tuple(int(v) for v in box)) for box in regions]
+        max_batch = max(1, int(max_batch))
+
+        boxes, confs, classes, crop_index = [], [], [], []
+        for start in range(0, len(regions), max_batch):
+            if gpu_image is not None:
+                with trace.span("yolo_world.gpu_letterbox"):
+                    batch, ratios, pads = gpu_image.letterbox_batch(regions[start:start + max_batch], MICRO_IMGSZ)
+                w_results = self.yolo_world(batch, half=self._half("yolo_world"), verbose=False)
+            else:
+                # A list source is letterboxed and run as ONE forward pass by Ultralytics
+                w_results = self.yolo_world(crops[start:start + max_batch], imgsz=MICRO_IMGSZ, half=self._half("yolo_world"), verbose=False)
+            for offset, r in enumerate(w_results):
+                for phase in ("preprocess", "inference", "postprocess"):
+                    trace.add_span(f"yolo_world.{phase}", r.speed.get(phase))
+                if len(r.boxes) == 0:
+                    continue
+                xyxy = r.boxes.xyxy.cpu().numpy()
+                if gpu_image is not None:
+                    # Letterboxed input coordinates -> crop coordinates
+                    xyxy = unletterbox(xyxy, ratios[offset], pads[offset])
+                boxes.append(xyxy)
+                confs.append(r.boxes.conf.cpu().numpy())
+                classes.append(r.boxes.cls.cpu().numpy().astype(int))
+                crop_index.append(np.full(len(r.boxes), start + offset, dtype=int))
+
+        if not boxes:
+            return np.zeros((0, 4)), np.zeros(0), np.zeros(0, dtype=int)
 
-        # --- STAGE 1: THE MICROSCOPE (YOLO + SAHI) ---
-        # A. Detect Nail Plates (ROI) with Custom YOLO
+        # Local crop coordinates -> global image coordinates, all crops at once
+        crop_index = np.concatenate(crop_index)
+        global_boxes = np.concatenate(boxes) + np.asarray(regions)[crop_index][:, [0, 1, 0, 1]]
+        return global_boxes, np.concatenate(confs), np.concatenate(classes)
+
+    def _micro_objects(self, global_boxes, confs, classes):
+        names = self.yolo_world.names
+        return [
+            {
+                "box": box,
+                "conf": float(conf),
+                "label": names[int(cls)],
+                "cls": 999
+            }
+            for box, conf, cls in zip(global_boxes.tolist(), confs, classes)
+        ]
+
+    def cache_config(self, florence_profile=None, micro_mode=None, pipeline_profile=None):
+        """Model + stage configuration that goes into the result cache key."""
+        profile = florence_profile or FLORENCE_DEFAULT_PROFILE
+        pipeline_profile = pipeline_profile or PIPELINE_DEFAULT_PROFILE
+        return {
+            "pipeline": PIPELINE_VERSION,
+            "pipeline_profile": pipeline_profile,
+            "pipeline_config": PIPELINE_PROFILES.get(pipeline_profile),
+            "stage_max_side": STAGE_MAX_SIDE,
+            "stage_min_short_side": STAGE_MIN_SHORT_SIDE,
+            "yolo": self.models.source("yolo"),
+            # Results from the fallback model must never be served as custom-model results
+            "yolo_fallback": "yolo" in getattr(self, "loading_warnings", {}),
+            "yolo_world": self.models.source("yolo_world"),
+            "yolo_world_classes": YOLO_WORLD_CLASSES,
+            "micro_mode": micro_mode or MICRO_MODE,
+            "florence": self.models.source("florence"),
+            "florence_profile": profile,
+            "florence_budgets": FLORENCE_PROFILES.get(profile),
+            "dinov2": self.models.source("dinov2"),
+            "precision": {name: self._precision_mode(name) for name in ("yolo", "yolo_world", "florence", "dinov2")}
+        }
+
+    # --- PIPELINE STAGES ---
+    def stage_nail_plates(self, pil_image, trace=None, gpu_image=None):
+        """Stage 1A: nail plates (ROI) with the custom YOLO. Returns (plate_boxes, detections)."""
+        trace = self._trace(trace)
         nail_plates = []
+        detections = []
         if self.yolo:
             try:
-                results = self.yolo(pil_image, imgsz=640)
+                if gpu_image is not None:
+                    from gpu_preprocess import unletterbox
+                    with trace.span("yolo.gpu_letterbox"):
+                        yolo_input, ratio, pad = gpu_image.letterbox(640)
+                    results = self.yolo(yolo_input, half=self._half("yolo"), verbose=False)
+                else:
+                    results = self.yolo(pil_image, imgsz=640, half=self._half("yolo"))
                 for r in results:
-                    for box in r.boxes:
-                        cls_name = self.yolo.names[int(box.cls[0])]
+                    for phase in ("preprocess", "inference", "postprocess"):
+                        trace.add_span(f"yolo.{phase}", r.speed.get(phase))
+                    if len(r.boxes) == 0:
+                        continue
+                    xyxy = r.boxes.xyxy.cpu().numpy()
+                    if gpu_image is not None:
+                        xyxy = unletterbox(xyxy, ratio, pad)
+                    for box_xyxy, conf, cls in zip(xyxy.tolist(), r.boxes.conf.cpu().numpy(), r.boxes.cls.cpu().numpy()):
+                        cls_name = self.yolo.names[int(cls)]
                         if cls_name in ["nail_plate", "nail", "finger"]:
-                            nail_plates.append(box.xyxy[0].cpu().numpy().tolist())
+                            nail_plates.append(box_xyxy)
                             detections.append({
-                                "box": box.xyxy[0].cpu().numpy().tolist(),
-                                "conf": float(box.conf[0]),
+                                "box": box_xyxy,
+                                "conf": float(conf),
                                 "label": cls_name,
-                                "cls": int(box.cls[0])
+                                "cls": int(cls)
                             })
             except Exception as e:
                 print(f"❌ Stage 1A Failed: {e}")
+        trace.set("nail_plates", len(nail_plates))
+        return nail_plates, detections
 
-        # B. Micro-Detection with YOLO-World (Inside Nail Plates)
+    def stage_micro(self, pil_image, nail_plates, micro_mode=None, trace=None, gpu_image=None):
+        """Stage 1B: micro-detection with YOLO-World inside the nail plates ("plates" or "sliced")."""
+        trace = self._trace(trace)
+        micro_detections = []
         if self.yolo_world and nail_plates:
             try:
-                for i, plate_box in enumerate(nail_plates):
-                    x1, y1, x2, y2 = map(int, plate_box)
-                    x1, y1 = max(0, x1), max(0, y1)
-                    x2, y2 = min(width, x2), min(height, y2)
-                    
-                    nail_crop = pil_image.crop((x1, y1, x2, y2))
-                    w_results = self.yolo_world(nail_crop)
-                    for r in w_results:
-                        for box in r.boxes:
-                            bx1, by1, bx2, by2 = box.xyxy[0].cpu().numpy().tolist()
-                            global_box = [bx1 + x1, by1 + y1, bx2 + x1, by2 + y1]
-                            detections.append({
-                                "box": global_box,
-                                "conf": float(box.conf[0]),
-                                "label": self.yolo_world.names[int(box.cls[0])],
-                                "cls": 999
-                            })
+                if (micro_mode or MICRO_MODE) == "sliced":
+                    micro_detections = self.run_sliced_micro_detection(pil_image, nail_plates, trace=trace, gpu_image=gpu_image)
+                else:
+                    micro_detections = self.run_micro_detection(pil_image, nail_plates, trace=trace, gpu_image=gpu_image)
             except Exception as e:
                 print(f"❌ Stage 1B Failed: {e}")
+        trace.set("micro_detections", len(micro_detections))
+        return micro_detections
 
-        # --- STAGE 3.5: THE SCRIBE (Florence-2) ---
+    def stage_florence(self, pil_image, florence_profile=None, trace=None, output_size=None, gpu_image=None, with_od=True):
+        """Stage 3.5: dense caption + open-vocabulary OD with Florence-2 (OD boxes in `output_size` space)."""
+        florence_captions = {}
         if self.florence_model:
             try:
                 print("✍️ Generating Florence-2 Captions...")
-                # 1. Dense Captioning
-                dense_caption = self.run_florence(pil_image, "<MORE_DETAILED_CAPTION>")
+                # Dense Captioning + Object Detection share one image encoding
+                tasks = ["<MORE_DETAILED_CAPTION>", "<OD>"] if with_od else ["<MORE_DETAILED_CAPTION>"]
+                florence_results = self.run_florence_multi(
+                    pil_image, tasks, profile=florence_profile, trace=trace,
+                    output_size=output_size, gpu_image=gpu_image
+                )
+                dense_caption = florence_results["<MORE_DETAILED_CAPTION>"]
                 florence_captions["dense"] = dense_caption
-                
-                # 2. Object Detection
-                od_result = self.run_florence(pil_image, "<OD>")
-                florence_captions["od"] = od_result
-                
+                if with_od:
+                    florence_captions["od"] = florence_results["<OD>"]
+
                 print(f"📜 Florence Caption: {dense_caption}")
             except Exception as e:
                 print(f"❌ Florence Failed: {e}")
@@ -267,39 +856,417 @@ class LacqrBrain:
             florence_captions["error"] = "Model not loaded"
             if "florence" in self.loading_errors:
                 florence_captions["loading_error"] = self.loading_errors["florence"]
+        return florence_captions
 
-        # --- STAGE 3: THE PHYSICIST (DINOv2) ---
+    def stage_dinov2(self, pil_image, trace=None, gpu_image=None):
+        """Stage 3: texture/material tags from DINOv2 features. Returns (tags, unit embedding or None)."""
+        trace = self._trace(trace)
+        material_tags = []
+        embedding = None
         if self.dinov2:
             try:
+                import torch
                 import torchvision.transforms as T
-                transform = T.Compose([
-                    T.Resize(256, interpolation=T.InterpolationMode.BICUBIC),
-                    T.CenterCrop(224),
-                    T.ToTensor(),
-                    T.Normalize(mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225)),
-                ])
-                img_tensor = transform(pil_image).unsqueeze(0).to(self.device)
-                with torch.no_grad():
+                with trace.span("dinov2.preprocess"):
+                    if gpu_image is not None:
+                        img_tensor = gpu_image.resize_center_crop_normalize(
+                            256, 224, mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225)
+                        )
+                    else:
+                        transform = T.Compose([
+                            T.Resize(256, interpolation=T.InterpolationMode.BICUBIC),
+                            T.CenterCrop(224),
+                            T.ToTensor(),
+                            T.Normalize(mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225)),
+                        ])
+                        img_tensor = transform(pil_image).unsqueeze(0).to(self.device)
+                if self._precision_mode("dinov2") == "fp16":
+                    img_tensor = img_tensor.half()
+                with torch.inference_mode(), self._autocast("dinov2"), trace.span("dinov2.inference"):
                     features = self.dinov2(img_tensor)
                     variance = torch.var(features).item()
+                    embedding = torch.nn.functional.normalize(features.float(), dim=-1)[0].cpu().numpy()
                     if variance > 0.01:
                         material_tags.append("Complex/Textured")
                     else:
                         material_tags.append("Smooth/Simple")
             except Exception as e:
                 print(f"❌ DINOv2 Failed: {e}")
+        return material_tags, embedding
 
-        return {
-            "objects": detections,
+    def index_design(self, design_id, embedding, metadata):
+        """Queues one design embedding for the (batched) vector index."""
+        if self.vector_store is None or embedding is None:
+            return False
+        try:
+            self.vector_store.add([design_id], [embedding], [metadata])
+            return True
+        except Exception as e:
+            print(f"⚠️ Indexing design {design_id} failed: {e}")
+            return False
+
+    @modal.method()
+    def find_similar(self, image_url: str = None, design_id: str = None, k: int = 5):
+        """
+        Nearest past designs (cosine over DINOv2 embeddings) for an image or a known design_id.
+        Metadata carries whatever was recorded with the design (e.g. a price via annotate_design).
+        """
+        if self.vector_store is None:
+            return {"error": "Vector index unavailable", "loading_errors": self.loading_errors}
+        if design_id:
+            embedding = self.vector_store.get_vector(design_id)
+            if embedding is None:
+                return {"error": f"Unknown design_id {design_id}"}
+        elif image_url:
+            # Same ingest and preprocessing as the pipeline that indexed the designs, so query
+            # and stored embeddings come from identically sized inputs
+            _, decoded = self._ingest(image_url, MICRO_MODE, stages=PIPELINE_PROFILES[PIPELINE_DEFAULT_PROFILE]["stages"])
+            gpu_image = None
+            if GPU_PREPROCESS and getattr(self, "device", "cpu") == "cuda":
+                try:
+                    from gpu_preprocess import GpuImage
+                    gpu_image = GpuImage.from_pil(decoded.image, self.device)
+                except Exception as e:
+                    print(f"⚠️ GPU preprocessing unavailable, using CPU path: {e}")
+            with self.model_locks["dinov2"]:
+                _, embedding = self.stage_dinov2(decoded.image, gpu_image=gpu_image)
+            if embedding is None:
+                return {"error": "DINOv2 unavailable", "loading_errors": self.loading_errors}
+        else:
+            return {"error": "Provide image_url or design_id"}
+
+        started = time.perf_counter()
+        matches = self.vector_store.search([embedding], k=max(1, int(k)))[0]
+        return {"matches": matches, "search_ms": round((time.perf_counter() - started) * 1000.0, 3)}
+
+    @modal.method()
+    def annotate_design(self, design_id: str, metadata: dict):
+        """Attaches e.g. the quoted price to an indexed design, for similar-design lookups."""
+        if self.vector_store is None:
+            return False
+        return self.vector_store.update_metadata(design_id, metadata)
+
+    def _ingest(self, image_url, micro_mode, trace=None, stages=None):
+        """(image_bytes, DecodedImage) for one URL, decoded as large as the largest of `stages` needs."""
+        from image_fetch import fetch_bytes, decode_image
+        from batch_jobs import check_public_address, check_public_url
+        trace = self._trace(trace)
+        # Download Image (pooled session, timeouts, byte cap). URLs come from clients: every
+        # redirect hop and the connected address must be public (no metadata endpoint / VPC hosts)
+        with trace.span("download"):
+            image_bytes = fetch_bytes(
+                self.http, image_url, max_bytes=IMAGE_MAX_BYTES, timeout=IMAGE_FETCH_TIMEOUT,
+                check_url=check_public_url, check_address=check_public_address
+            )
+        # Decode only as large as the stages need; sliced micro-detection also gets full resolution
+        with trace.span("decode"):
+            stages = stages or (*STAGE_MAX_SIDE, *STAGE_MIN_SHORT_SIDE)
+            max_side = max([STAGE_MAX_SIDE[stage] for stage in stages if stage in STAGE_MAX_SIDE], default=0)
+            min_short_side = max([STAGE_MIN_SHORT_SIDE[stage] for stage in stages if stage in STAGE_MIN_SHORT_SIDE], default=0)
+            keep_full = micro_mode == "sliced" and "micro" in stages
+            decoded = decode_image(image_bytes, max_side=max_side or None, min_short_side=min_short_side, keep_full=keep_full)
+        return image_bytes, decoded
+
+    def _prefetch(self, image_url, micro_mode, stages=None):
+        """_ingest on a prefetch thread; also returns its spans so run_pipeline can attribute them."""
+        from tracing import Trace
+        trace = Trace("prefetch")
+        image_bytes, decoded = self._ingest(image_url, micro_mode, trace, stages)
+        return image_bytes, decoded, trace.to_dict()["spans_ms"]
+
+    def run_pipeline(self, image_url, florence_profile=None, micro_mode=None, prefetched=None, pipeline_profile=None, record=True):
+        """
+        Generator behind process_pipeline / process_pipeline_stream.
+        Yields one event per stage as soon as it finishes (completion order, since
+        independent stages run concurrently):
+            {"stage": "nail_plates" | "micro" | "florence" | "dinov2", ...partial data}
+        and finally {"stage": "final", "result": <full response>} (or {"stage": "error", ...}).
+        `prefetched` is a future of _prefetch(image_url, micro_mode, stages) (used by process_batch).
+        `pipeline_profile` picks the stages, cascade rules and budgets (PIPELINE_PROFILES).
+        With record=False (parity runs) the result cache and the design index are neither
+        read nor written.
+        """
+        from image_fetch import scale_detections
+        from tracing import Trace, cuda_reset_peak, cuda_peak_mb
+
+        print(f"📸 Processing: {image_url}")
+        trace = Trace("process_pipeline")
+        cuda_reset_peak()
+        micro_mode = micro_mode or MICRO_MODE
+        pipeline_profile = pipeline_profile or PIPELINE_DEFAULT_PROFILE
+        if pipeline_profile not in PIPELINE_PROFILES:
+            yield {"stage": "error", "error": f"Unknown pipeline_profile '{pipeline_profile}', expected one of {list(PIPELINE_PROFILES)}"}
+            return
+        profile = PIPELINE_PROFILES[pipeline_profile]
+        budgets = profile["budgets_ms"]
+        trace.set("pipeline_profile", pipeline_profile)
+        
+        try:
+            if prefetched is None:
+                image_bytes, decoded = self._ingest(image_url, micro_mode, trace, profile["stages"])
+            else:
+                # Downloaded and decoded by process_batch while the GPU was busy with earlier images
+                image_bytes, decoded, ingest_spans = prefetched.result()
+                for name, ms in ingest_spans.items():
+                    trace.add_span(name, ms)
+                trace.set("prefetched", True)
+            pil_image, scale = decoded.image, decoded.scale
+            trace.set("image_bytes", len(image_bytes))
+            trace.set("image_size", list(decoded.original_size))
+            trace.set("work_size", list(pil_image.size))
+        except Exception as e:
+            yield {"stage": "error", "error": f"Failed to download/process image: {e}"}
+            return
+
+        cache_key = None
+        if self.result_cache and record:
+            from result_cache import make_cache_key
+            with trace.span("cache_lookup"):
+                cache_key = make_cache_key(image_bytes, self.cache_config(florence_profile, micro_mode, pipeline_profile))
+                cached = self.result_cache.get(cache_key)
+            if cached is not None:
+                print("⚡ Result cache hit")
+                self.metrics.observe_trace(trace, prefix="cache_hit.")
+                cached["meta"]["cache"] = {"hit": True, **self.result_cache.stats()}
+                cached["meta"]["trace"] = trace.to_dict()
+                yield {"stage": "final", "result": cached}
+                return
+
+        # Stage -> reason for every stage the cascade (or the profile) did not run
+        skipped = {stage: "pipeline_profile" for stage in STAGE_MODEL_NAMES if stage not in profile["stages"]}
+        if profile["cascade"]:
+            from cascade import is_plain_image
+            with trace.span("cascade.plain_check"):
+                plain, texture = is_plain_image(pil_image)
+            trace.set("image_texture", texture)
+            if plain:
+                print("⏭️ Plain solid-colour image, skipping all stages")
+                skipped.update({stage: "plain_image" for stage in profile["stages"]})
+        stages = [stage for stage in profile["stages"] if stage not in skipped]
+
+        # Decode once, upload once: every stage builds its model input from these tensors
+        gpu_image = gpu_full = None
+        if stages and GPU_PREPROCESS and getattr(self, "device", "cpu") == "cuda":
+            try:
+                from gpu_preprocess import GpuImage
+                with trace.span("gpu_upload"):
+                    gpu_image = GpuImage.from_pil(pil_image, self.device)
+                    if decoded.full is not None:
+                        gpu_full = GpuImage.from_pil(decoded.full, self.device)
+            except Exception as e:
+                print(f"⚠️ GPU preprocessing unavailable, using CPU path: {e}")
+                gpu_image = gpu_full = None
+
+        # Every stage sees the working image; all returned coordinates are mapped back to
+        # the original image so clients never see the working resolution.
+        def nail_plates_stage():
+            plates, detections = self.stage_nail_plates(pil_image, trace, gpu_image)
+            return plates, scale_detections(detections, scale)
+
+        def micro_stage(nail_plates):
+            plates = nail_plates[0]
+            if profile["cascade"]:
+                if not plates:
+                    skipped["micro"] = "no_nail_plates"
+                    return []
+                from cascade import plate_texture_scores, PLATE_TEXTURE_MIN
+                with trace.span("cascade.plate_texture"):
+                    scores = plate_texture_scores(pil_image, plates)
+                trace.set("plate_texture", [round(float(v), 2) for v in scores])
+                plates = [box for box, score in zip(plates, scores) if score >= PLATE_TEXTURE_MIN]
+                if not plates:
+                    skipped["micro"] = "low_texture"
+                    return []
+            if decoded.full is not None:
+                # Sliced tiles come from the full-resolution copy: plates -> original coordinates
+                full_plates = [[v * scale for v in box] for box in plates]
+                return self.stage_micro(decoded.full, full_plates, micro_mode, trace, gpu_full)
+            return scale_detections(self.stage_micro(pil_image, plates, micro_mode, trace, gpu_image), scale)
+
+        def florence_stage(nail_plates=None):
+            with_od = True
+            if nail_plates is not None and not nail_plates[0]:
+                skipped["florence_od"] = "no_nail_plates"
+                with_od = False
+            return self.stage_florence(pil_image, florence_profile, trace, decoded.original_size, gpu_image, with_od)
+
+        # Stage graph: DINOv2 does not depend on YOLO, so it overlaps with the YOLO -> YOLO-World
+        # chain; YOLO-World starts as soon as the plates exist. Florence-2 overlaps too, unless
+        # the cascade makes it wait for the (fast) plate detector to decide whether OD is needed.
+        from stage_graph import StageGraph
+        graph = StageGraph(use_cuda_streams=getattr(self, "device", "cpu") == "cuda")
+        if "nail_plates" in stages:
+            # --- STAGE 1: THE MICROSCOPE (YOLO + SAHI) ---
+            graph.add("nail_plates", nail_plates_stage, default=([], []), budget_ms=budgets.get("nail_plates"), lock=self.model_locks["nail_plates"])
+            if "micro" in stages:
+                graph.add("micro", micro_stage, deps=["nail_plates"], default=[], budget_ms=budgets.get("micro"), lock=self.model_locks["micro"])
+        elif "micro" in stages:
+            skipped["micro"] = "no_nail_plates"
+        if "florence" in stages:
+            # --- STAGE 3.5: THE SCRIBE (Florence-2) ---
+            florence_deps = ["nail_plates"] if profile["cascade"] and "nail_plates" in stages else []
+            graph.add("florence", florence_stage, deps=florence_deps, default={"error": "Stage failed"}, budget_ms=budgets.get("florence"), lock=self.model_locks["florence"])
+        if "dinov2" in stages:
+            # --- STAGE 3: THE PHYSICIST (DINOv2) ---
+            graph.add("dinov2", lambda: self.stage_dinov2(pil_image, trace, gpu_image), default=([], None), budget_ms=budgets.get("dinov2"), lock=self.model_locks["dinov2"])
+
+        outputs = {
+            "nail_plates": ([], []),
+            "micro": [],
+            "florence": {"skipped": skipped.get("florence")},
+            "dinov2": ([], None)
+        }
+        for stage, output in graph.run(self.stage_executor, trace=trace):
+            outputs[stage] = output
+            if stage == "nail_plates":
+                yield {"stage": "nail_plates", "objects": output[1], "count": len(output[1])}
+            elif stage == "micro":
+                yield {"stage": "micro", "objects": output, "count": len(output)}
+            elif stage == "florence":
+                yield {"stage": "florence", "florence": output}
+            elif stage == "dinov2":
+                yield {"stage": "dinov2", "materials": output[0]}
+
+        plate_detections = outputs["nail_plates"][1]
+        micro_detections = outputs["micro"]
+        florence_captions = outputs["florence"]
+        material_tags, embedding = outputs["dinov2"]
+
+        result = {
+            "objects": plate_detections + micro_detections,
             "florence": florence_captions,
             "materials": material_tags,
             "loading_errors": self.loading_errors, # Return errors to frontend
+            "loading_warnings": self.loading_warnings,
             "meta": {
-                "gpu": "L4",
-                "stages": ["YOLOv11", "YOLO-World", "Florence-2", "DINOv2"]
+                "gpu": self.gpu_name,
+                "stages": [STAGE_MODEL_NAMES[stage] for stage in STAGE_MODEL_NAMES if stage not in skipped],
+                "pipeline": {
+                    "profile": pipeline_profile,
+                    "skipped": dict(skipped),
+                    "timed_out": list(graph.timed_out)
+                },
+                "precision": {
+                    "profile": getattr(self, "precision_profile", "fp32"),
+                    "models": {name: self._precision_mode(name) for name in ("yolo", "yolo_world", "florence", "dinov2")}
+                }
             }
         }
-    
+
+        try:
+            from pricing_features import extract_features
+            plates = [d for d in plate_detections if d["label"] != "finger"]
+            # Bling is unknown (not zero) when micro-detection was not run by profile or timed out
+            bling_known = skipped.get("micro") != "pipeline_profile" and "micro" not in graph.timed_out
+            with trace.span("pricing_features"):
+                result["features"] = extract_features(
+                    [d["box"] for d in plates],
+                    objects=micro_detections if bling_known else None,
+                    image_shape=(decoded.original_size[1], decoded.original_size[0]),
+                    classes=YOLO_WORLD_CLASSES
+                )
+        except Exception as e:
+            print(f"❌ Pricing features Failed: {e}")
+            result["features"] = {"error": str(e)}
+
+        if embedding is not None and record:
+            import hashlib
+            design_id = hashlib.sha256(image_bytes).hexdigest()[:32]
+            indexed = self.index_design(design_id, embedding, {
+                "image_url": image_url,
+                "materials": material_tags,
+                "objects": len(result["objects"]),
+                "indexed_at": time.time()
+            })
+            if indexed:
+                result["meta"]["design_id"] = design_id
+
+        trace.set("cuda_peak_mb", cuda_peak_mb())
+        self.metrics.observe_trace(trace)
+        result["meta"]["trace"] = trace.to_dict()
+
+        if cache_key:
+            # Never cache a degraded result produced while a model failed to load or a stage ran out of budget
+            if not self.loading_errors and not graph.timed_out:
+                self.result_cache.put(cache_key, result)
+            result["meta"]["cache"] = {"hit": False, **self.result_cache.stats()}
+
+        yield {"stage": "final", "result": result}
+
+    @staticmethod
+    def _final_result(events):
+        for event in events:
+            if event["stage"] == "error":
+                return {"error": event["error"]}
+            if event["stage"] == "final":
+                return event["result"]
+
+    @modal.method()
+    def process_pipeline(self, image_url: str, florence_profile: str = None, micro_mode: str = None, pipeline_profile: str = None, record: bool = True):
+        return self._final_result(self.run_pipeline(image_url, florence_profile, micro_mode, pipeline_profile=pipeline_profile, record=record))
+
+    @modal.method()
+    def process_batch(self, items: list, florence_profile: str = None, micro_mode: str = None, pipeline_profile: str = None):
+        """
+        Runs a chunk of a bulk job: items are (index, image_url) pairs, returns
+        [(index, result)] in the same order. Downloads and decodes run up to
+        BATCH_PREFETCH images ahead on their own threads, so the GPU never waits on
+        the network; a failing image only fails its own entry.
+        """
+        micro_mode = micro_mode or MICRO_MODE
+        stages = PIPELINE_PROFILES.get(pipeline_profile or PIPELINE_DEFAULT_PROFILE, {}).get("stages")
+        pending = list(items)
+        futures = []
+        results = []
+        for _ in range(min(BATCH_PREFETCH, len(pending))):
+            index, url = pending.pop(0)
+            futures.append((index, url, self.prefetch_executor.submit(self._prefetch, url, micro_mode, stages)))
+        while futures:
+            index, url, future = futures.pop(0)
+            if pending:
+                next_index, next_url = pending.pop(0)
+                futures.append((next_index, next_url, self.prefetch_executor.submit(self._prefetch, next_url, micro_mode, stages)))
+            try:
+                result = self._final_result(self.run_pipeline(
+                    url, florence_profile, micro_mode, prefetched=future, pipeline_profile=pipeline_profile
+                ))
+            except Exception as e:
+                result = {"error": f"Pipeline failed: {e}"}
+            results.append((index, result))
+        return results
+
+    @modal.method(is_generator=True)
+    def process_pipeline_stream(self, image_url: str, florence_profile: str = None, micro_mode: str = None, pipeline_profile: str = None):
+        """Streaming variant: yields per-stage events (see run_pipeline) as they finish."""
+        yield from self.run_pipeline(image_url, florence_profile, micro_mode, pipeline_profile=pipeline_profile)
+
+
+def features_response(result):
+    """Compact response for output="features": pricing features instead of every box and caption."""
+    if "error" in result:
+        return result
+    meta = result.get("meta", {})
+    return {
+        "features": result.get("features"),
+        "materials": result.get("materials"),
+        "meta": {key: meta[key] for key in ("design_id", "pipeline", "cache") if key in meta}
+    }
+
+def features_stream_event(event):
+    """output="features" while streaming: the final event carries features_response, stage events only progress."""
+    if event.get("stage") == "final":
+        return {**event, "result": features_response(event["result"])}
+    if event.get("stage") == "error":
+        return event
+    return {key: event[key] for key in ("stage", "count", "materials") if key in event}
+
+def format_stream_event(event, fmt):
+    """Serializes one pipeline event as an NDJSON line or a server-sent event."""
+    payload = json.dumps(event)
+    if fmt == "sse":
+        return f"event: {event['stage']}\ndata: {payload}\n\n"
+    return payload + "\n"
+
 @app.function(image=image)
 @modal.web_endpoint(method="POST")
 def analyze_image(item: dict):
@@ -308,5 +1275,206 @@ def analyze_image(item: dict):
         return Response(content=json.dumps({"error": "No image_url provided"}), status_code=400, media_type="application/json")
     
     brain = LacqrBrain()
-    result = brain.process_pipeline.remote(image_url)
+
+    # Optional streaming: "stream": "ndjson" | "sse" sends each stage as soon as it is ready.
+    # The final event carries the same response object as the non-streaming call.
+    stream = item.get("stream")
+    if stream:
+        fmt = "sse" if stream == "sse" else "ndjson"
+        events = brain.process_pipeline_stream.remote_gen(
+            image_url, florence_profile=item.get("florence_profile"), micro_mode=item.get("micro_mode"),
+            pipeline_profile=item.get("pipeline_profile")
+        )
+        if item.get("output") == "features":
+            events = (features_stream_event(event) for event in events)
+        return StreamingResponse(
+            (format_stream_event(event, fmt) for event in events),
+            media_type="text/event-stream" if fmt == "sse" else "application/x-ndjson"
+        )
+
+    result = brain.process_pipeline.remote(
+        image_url, florence_profile=item.get("florence_profile"), micro_mode=item.get("micro_mode"),
+        pipeline_profile=item.get("pipeline_profile")
+    )
+    # "output": "features" sends only the per-nail pricing features (no boxes, captions or traces)
+    if item.get("output") == "features":
+        result = features_response(result)
+    return Response(content=json.dumps(result), media_type="application/json")
+
+@app.function(image=image, timeout=BATCH_JOB_TIMEOUT)
+def run_batch_job(job_id: str, image_urls: list, options: dict):
+    """
+    Driver of one bulk job (the only writer of its state): fans chunks out with
+    process_batch.map and records each image's result as soon as its chunk returns.
+    """
+    from batch_jobs import JobStore
+    jobs = JobStore(batch_jobs_dict)
+
+    items = list(enumerate(image_urls))
+    chunks = [items[i:i + BATCH_CHUNK_SIZE] for i in range(0, len(items), BATCH_CHUNK_SIZE)]
+    recorded = set()
+    try:
+        jobs.set_status(job_id, "running")
+        brain = LacqrBrain()
+        for chunk_results in brain.process_batch.map(
+            chunks,
+            kwargs={
+                "florence_profile": options.get("florence_profile"),
+                "micro_mode": options.get("micro_mode"),
+                "pipeline_profile": options.get("pipeline_profile")
+            },
+            order_outputs=False,
+            return_exceptions=True
+        ):
+            if isinstance(chunk_results, Exception):
+                print(f"⚠️ Batch chunk failed: {chunk_results}")
+                continue
+            for index, result in chunk_results:
+                result = result or {"error": "Pipeline returned no result"}
+                if "error" in result:
+                    jobs.record(job_id, index, error=result["error"])
+                else:
+                    jobs.record(job_id, index, result=features_response(result) if options.get("output") == "features" else result)
+                recorded.add(index)
+
+        # Images from chunks whose container died still count, so the job always completes
+        for index in range(len(image_urls)):
+            if index not in recorded:
+                jobs.record(job_id, index, error="Worker failed before returning this image")
+    except Exception as e:
+        # Failed jobs stop counting against the client's limit; if this function dies
+        # without getting here (timeout, preemption) the stale check in JobStore does it
+        print(f"🔥 Batch job {job_id} failed: {e}")
+        jobs.set_status(job_id, "failed", error=str(e))
+        return
+    meta = jobs.get(job_id)
+    print(f"✅ Batch job {job_id}: {meta['done']} done, {meta['failed']} failed")
+
+@app.function(image=image)
+@modal.web_endpoint(method="POST")
+def analyze_batch(item: dict, request: Request):
+    """
+    {"image_urls": [...], "florence_profile"?, "micro_mode"?, "pipeline_profile"?, "output"?}
+    -> {"job_id", "total"}; poll batch_status for progress and partial results.
+    Active jobs are limited per caller address.
+    """
+    from batch_jobs import JobStore, TooManyJobs, MAX_JOB_IMAGES, check_public_url
+
+    image_urls = [url for url in item.get("image_urls") or [] if isinstance(url, str) and url]
+    if not image_urls:
+        return Response(content=json.dumps({"error": "No image_urls provided"}), status_code=400, media_type="application/json")
+    if len(image_urls) > MAX_JOB_IMAGES:
+        return Response(content=json.dumps({"error": f"At most {MAX_JOB_IMAGES} images per job"}), status_code=400, media_type="application/json")
+    try:
+        for url in image_urls:
+            check_public_url(url)
+    except ValueError as e:
+        return Response(content=json.dumps({"error": str(e)}), status_code=400, media_type="application/json")
+
+    options = {
+        "florence_profile": item.get("florence_profile"),
+        "micro_mode": item.get("micro_mode"),
+        "pipeline_profile": item.get("pipeline_profile"),
+        "output": item.get("output")
+    }
+    jobs = JobStore(batch_jobs_dict)
+    jobs.prune(BATCH_JOB_TTL)
+    try:
+        job_id = jobs.create(request.client.host if request.client else "anonymous", len(image_urls), options)
+    except TooManyJobs as e:
+        return Response(content=json.dumps({"error": str(e)}), status_code=429, media_type="application/json")
+
+    run_batch_job.spawn(job_id, image_urls, options)
+    return Response(content=json.dumps({"job_id": job_id, "total": len(image_urls)}), media_type="application/json")
+
+@app.function(image=image)
+@modal.web_endpoint(method="GET")
+def batch_status(job_id: str, since: int = 0):
+    """Progress of a bulk job plus the results finished after cursor `since` (pass back `next`)."""
+    from batch_jobs import JobStore
+    status = JobStore(batch_jobs_dict).status(job_id, since=since)
+    if status is None:
+        return Response(content=json.dumps({"error": "Unknown job_id"}), status_code=404, media_type="application/json")
+    return Response(content=json.dumps(status), media_type="application/json")
+
+@app.function(image=image)
+@modal.web_endpoint(method="POST")
+def find_similar(item: dict):
+    """{"image_url": ... | "design_id": ..., "k": 5} -> most similar past designs with their metadata."""
+    if not item.get("image_url") and not item.get("design_id"):
+        return Response(content=json.dumps({"error": "Provide image_url or design_id"}), status_code=400, media_type="application/json")
+    result = LacqrBrain().find_similar.remote(
+        image_url=item.get("image_url"), design_id=item.get("design_id"), k=int(item.get("k", 5))
+    )
     return Response(content=json.dumps(result), media_type="application/json")
+
+@app.function(image=image)
+@modal.web_endpoint(method="GET")
+def metrics(format: str = "json"):
+    """Latency histograms from a LacqrBrain container (JSON, or Prometheus text with ?format=prometheus)."""
+    snapshot = LacqrBrain().metrics_snapshot.remote(format)
+    if format == "prometheus":
+        return Response(content=snapshot, media_type="text/plain")
+    return Response(content=json.dumps(snapshot), media_type="application/json")
+
+@app.function(image=image, volumes={CACHE_DIR: cache_volume})
+def save_parity_report(profile: str, report: dict):
+    """Stores a precision_parity report where LacqrBrain looks for it at startup."""
+    os.makedirs(PARITY_REPORT_DIR, exist_ok=True)
+    tmp = f"{PARITY_REPORT_DIR}/{profile}.json.tmp"
+    with open(tmp, "w") as f:
+        json.dump(report, f)
+    os.replace(tmp, f"{PARITY_REPORT_DIR}/{profile}.json")
+    cache_volume.commit()
+
+@app.local_entrypoint()
+def precision_parity(profile: str = "fp16", urls: str = "parity_urls.txt", output: str = "precision_parity.json"):
+    """
+    Parity test to run before enabling a precision profile: every image (one URL per
+    line in `urls`) goes through an fp32 container and a `profile` container, and
+    detections / captions / materials are compared.
+        modal run lacqr_modal/main.py::precision_parity --profile fp16 --urls urls.txt
+    """
+    import sys
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from precision import compare_results, summarize_parity
+
+    with open(urls) as f:
+        image_urls = [line.strip() for line in f if line.strip()]
+
+    if profile not in PRECISION_PROFILES or profile == "fp32":
+        raise ValueError(f"--profile must be one of {[p for p in PRECISION_PROFILES if p != 'fp32']}")
+
+    reference_brain = LacqrBrain(precision="fp32")
+    candidate_brain = LacqrBrain(precision=profile, parity_run=True)
+    per_image = []
+    for url in image_urls:
+        # record=False: parity images must not land in the design index or the result cache
+        reference = reference_brain.process_pipeline.remote(url, record=False)
+        candidate = candidate_brain.process_pipeline.remote(url, record=False)
+        if "error" in reference or "error" in candidate:
+            print(f"⚠️ Skipping {url}: {reference.get('error') or candidate.get('error')}")
+            continue
+        comparison = compare_results(reference, candidate)
+        comparison["url"] = url
+        comparison["models"] = candidate["meta"].get("precision", {}).get("models")
+        per_image.append(comparison)
+        print(f"{'✅' if comparison['passed'] else '❌'} {url}: detection F1 {comparison['detections']['f1']}, "
+              f"class agreement {comparison['detections']['class_agreement']}, "
+              f"caption similarity {comparison['caption_similarity']}")
+
+    report = {
+        "profile": profile,
+        "definition": PRECISION_PROFILES[profile],
+        "pipeline": PIPELINE_VERSION,
+        "created": time.time(),
+        "summary": summarize_parity(per_image),
+        "images": per_image
+    }
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    # The serving containers read the report from the volume (parity_passed)
+    save_parity_report.remote(profile, report)
+    print(f"{'✅ PASS' if report['summary']['passed'] else '❌ FAIL'}: {json.dumps(report['summary'])} -> {output}")
+    if not report["summary"]["passed"]:
+        raise SystemExit(1)
@@ -0,0 +1,178 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+DOWNLOAD_CHUNK_BYTES = 8 * 1024 * 1024
+
+
+def download_to_cache(url, dest_path, chunk_size=DOWNLOAD_CHUNK_BYTES, timeout=60):
+    """
+    Streams a checkpoint to disk in chunks (never buffers the whole file in RAM).
+    Writes to a .part file and renames on success, so an interrupted download is
+    never mistaken for a valid cached checkpoint. Returns dest_path.
+    """
+    if os.path.exists(dest_path):
+        return dest_path
+
+    import requests
+
+    os.makedirs(os.path.dirname(dest_path) or ".", exist_ok=True)
+    part_path = f"{dest_path}.{os.getpid()}.part"
+    print(f"⬇️ Downloading {url} -> {dest_path}")
+    with requests.get(url, stream=True, timeout=timeout) as resp:
+        resp.raise_for_status()
+        with open(part_path, "wb") as f:
+            for chunk in resp.iter_content(chunk_size=chunk_size):
+                if chunk:
+                    f.write(chunk)
+    os.replace(part_path, dest_path)
+    return dest_path
+
+
+def _rss_bytes():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def _parameter_bytes(model):
+    """Best-effort size of a model's weights (handles Ultralytics wrappers and tuples)."""
+    if isinstance(model, (tuple, list)):
+        return sum(_parameter_bytes(m) or 0 for m in model) or None
+    module = getattr(model, "model", model)
+    if not hasattr(module, "parameters"):
+        return None
+    try:
+        return sum(p.numel() * p.element_size() for p in module.parameters())
+    except Exception:
+        return None
+
+
+class ModelRegistry:
+    """
+    Lazily loaded, thread-safe model registry.
+
+    Models are registered with a zero-argument loader and only built when first
+    requested (`get`) or explicitly preloaded (`load_many`, in parallel). A failed
+    load is recorded in `errors` (same keys as the old loading_errors) and `get`
+    returns None, so stages degrade exactly as they did with eager loading.
+    `report()` gives load time and memory per model.
+    """
+
+    def __init__(self, after_load=None):
+        self.after_load = after_load # e.g. commit the weight-cache volume; called with a list of names
+        self.errors = {}
+        self._specs = {}
+        self._models = {}
+        self._stats = {}
+        self._locks = {}
+        self._hook_lock = threading.Lock()
+        self._deferred = None # names loaded during load_many, hook runs once at the end
+
+    def register(self, name, loader, source=None):
+        """`source` describes the weights (path / model id) without loading them."""
+        self._specs[name] = {"loader": loader, "source": source}
+        self._locks[name] = threading.Lock()
+        return self
+
+    def source(self, name):
+        spec = self._specs.get(name)
+        return spec["source"] if spec else None
+
+    def is_loaded(self, name):
+        return name in self._models
+
+    def get(self, name):
+        if name in self._models:
+            return self._models[name]
+        if name not in self._specs:
+            return None
+
+        with self._locks[name]:
+            if name in self._models:
+                return self._models[name]
+            if name in self.errors:
+                return None
+
+            started = time.perf_counter()
+            rss_before = _rss_bytes()
+            cuda_before = self._cuda_allocated()
+            try:
+                model = self._specs[name]["loader"]()
+            except Exception as e:
+                print(f"❌ Failed to load {name}: {e}")
+                self.errors[name] = str(e)
+                return None
+
+            rss_after = _rss_bytes()
+            cuda_after = self._cuda_allocated()
+            self._stats[name] = {
+                "load_seconds": round(time.perf_counter() - started, 3),
+                "weights_mb": self._mb(_parameter_bytes(model)),
+                # RSS/CUDA deltas are approximate when several models load in parallel
+                "rss_delta_mb": self._mb(rss_after - rss_before) if rss_before and rss_after else None,
+                "cuda_delta_mb": self._mb(cuda_after - cuda_before) if cuda_before is not None else None
+            }
+            self._models[name] = model
+            print(f"✅ Loaded {name} in {self._stats[name]['load_seconds']}s")
+
+        if self._deferred is not None:
+            self._deferred.append(name)
+        else:
+            self._run_after_load([name])
+        return model
+
+    def _run_after_load(self, names):
+        if not self.after_load or not names:
+            return
+        # One hook at a time: lazy loads on concurrent request threads must not overlap commits
+        with self._hook_lock:
+            try:
+                self.after_load(names)
+            except Exception as e:
+                print(f"⚠️ after_load hook failed for {names}: {e}")
+
+    def load_many(self, names, parallel=True):
+        """Preloads several models (concurrently by default). Failures are recorded, not raised."""
+        names = [n for n in names if n in self._specs]
+        self._deferred = []
+        try:
+            if not parallel or len(names) < 2:
+                for name in names:
+                    self.get(name)
+            else:
+                with ThreadPoolExecutor(max_workers=len(names), thread_name_prefix="lacqr-load") as pool:
+                    list(pool.map(self.get, names))
+        finally:
+            loaded, self._deferred = self._deferred, None
+        # A single after_load (one volume commit) for the whole batch
+        self._run_after_load(loaded)
+
+    def report(self):
+        return {
+            name: {
+                "loaded": name in self._models,
+                "source": spec["source"],
+                "error": self.errors.get(name),
+                **self._stats.get(name, {})
+            }
+            for name, spec in self._specs.items()
+        }
+
+    # --- internals ---
+    @staticmethod
+    def _cuda_allocated():
+        try:
+            import torch
+            if torch.cuda.is_available():
+                return torch.cuda.memory_allocated()
+        except Exception:
+            pass
+        return None
+
+    @staticmethod
+    def _mb(num_bytes):
+        return round(num_bytes / (1024 * 1024), 1) if num_bytes is not None else None
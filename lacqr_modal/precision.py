@@ -0,0 +1,193 @@
+import difflib
+
+import numpy as np
+
+# Load-time numerical check: reduced-precision outputs must stay this close to fp32
+MIN_OUTPUT_COSINE = 0.995
+# YOLO heads are checked per output group (box pixels would dominate a single cosine)
+YOLO_CHECK_ANCHORS = 100
+MIN_BOX_IOU = 0.95
+MIN_MASK_IOU = 0.90
+MIN_CLASS_AGREEMENT = 0.99
+MAX_SCORE_DELTA = 0.02
+# Offline parity test (precision_parity entrypoint) thresholds vs the fp32 pipeline
+MIN_DETECTION_F1 = 0.95
+MIN_CAPTION_SIMILARITY = 0.90
+MATCH_IOU = 0.5
+
+
+def _flatten(output):
+    """Flattens a model output (tensor / tuple / list / dict of tensors) to one float64 vector."""
+    import torch
+    if isinstance(output, torch.Tensor):
+        return output.detach().float().flatten().cpu().numpy().astype(np.float64)
+    if isinstance(output, dict):
+        output = list(output.values())
+    if isinstance(output, (list, tuple)):
+        parts = [_flatten(o) for o in output if o is not None]
+        parts = [p for p in parts if p.size]
+        return np.concatenate(parts) if parts else np.zeros(0)
+    return np.zeros(0)
+
+
+def output_agreement(reference, candidate):
+    """
+    (ok, details) for two outputs of the same forward pass: finite, same shape and
+    cosine similarity >= MIN_OUTPUT_COSINE.
+    """
+    ref, cand = _flatten(reference), _flatten(candidate)
+    if ref.shape != cand.shape or ref.size == 0:
+        return False, {"reason": f"shape mismatch {ref.shape} vs {cand.shape}"}
+    if not np.isfinite(cand).all():
+        return False, {"reason": "non-finite values"}
+    cosine = float(ref @ cand / max(np.linalg.norm(ref) * np.linalg.norm(cand), 1e-12))
+    max_abs = float(np.abs(ref - cand).max())
+    return cosine >= MIN_OUTPUT_COSINE, {"cosine": round(cosine, 6), "max_abs_diff": round(max_abs, 6)}
+
+
+def _to_numpy(tensor):
+    return tensor.detach().float().cpu().numpy().astype(np.float64)
+
+
+def _split_yolo(output, num_classes):
+    """(predictions (4 + nc + nm, anchors), mask prototypes (nm, H, W) or None) of the first image."""
+    preds = output[0] if isinstance(output, (list, tuple)) else output
+    preds = _to_numpy(preds[0])
+    protos = None
+    # Segment heads return (preds, (feats, mask_coeffs, protos)); Detect heads (preds, feats)
+    if preds.shape[0] > 4 + num_classes and isinstance(output, (list, tuple)) and len(output) > 1:
+        extra = output[1]
+        protos = extra[-1] if isinstance(extra, (list, tuple)) else extra
+        protos = _to_numpy(protos[0])
+    return preds, protos
+
+
+def _xywh_to_xyxy(boxes):
+    xy, half = boxes[:, :2], boxes[:, 2:] / 2.0
+    return np.concatenate([xy - half, xy + half], axis=1)
+
+
+def _paired_iou(a, b):
+    """IoU of a[i] with b[i] for (N, 4) xyxy arrays."""
+    wh = np.clip(np.minimum(a[:, 2:], b[:, 2:]) - np.maximum(a[:, :2], b[:, :2]), 0, None)
+    inter = wh[:, 0] * wh[:, 1]
+    union = np.prod(a[:, 2:] - a[:, :2], axis=1) + np.prod(b[:, 2:] - b[:, :2], axis=1) - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-12), 1.0)
+
+
+def yolo_output_agreement(reference, candidate, num_classes, top_k=YOLO_CHECK_ANCHORS):
+    """
+    output_agreement for raw YOLO head outputs. Boxes, class scores and masks are
+    compared separately on the reference's top_k anchors:
+      - boxes: mean IoU >= MIN_BOX_IOU
+      - classes: max score delta <= MAX_SCORE_DELTA, and the argmax agrees wherever
+        the reference's top class clearly beats the runner-up
+      - masks (-seg models): mean IoU of the binarized masks >= MIN_MASK_IOU
+    """
+    ref, ref_protos = _split_yolo(reference, num_classes)
+    cand, cand_protos = _split_yolo(candidate, num_classes)
+    if ref.shape != cand.shape:
+        return False, {"reason": f"shape mismatch {ref.shape} vs {cand.shape}"}
+    if not np.isfinite(cand).all() or (cand_protos is not None and not np.isfinite(cand_protos).all()):
+        return False, {"reason": "non-finite values"}
+
+    ref_scores, cand_scores = ref[4:4 + num_classes], cand[4:4 + num_classes]
+    top = np.argsort(-ref_scores.max(axis=0))[:top_k]
+    box_iou = float(_paired_iou(_xywh_to_xyxy(ref[:4, top].T), _xywh_to_xyxy(cand[:4, top].T)).mean())
+    score_delta = float(np.abs(ref_scores[:, top] - cand_scores[:, top]).max())
+    ranked = np.sort(ref_scores[:, top], axis=0)
+    decided = ranked[-1] - ranked[-2] > MAX_SCORE_DELTA if num_classes > 1 else np.ones(len(top), dtype=bool)
+    agree = ref_scores[:, top].argmax(axis=0) == cand_scores[:, top].argmax(axis=0)
+    class_agreement = float(agree[decided].mean()) if decided.any() else 1.0
+    details = {"box_iou": round(box_iou, 4), "max_score_delta": round(score_delta, 4), "class_agreement": round(class_agreement, 4)}
+    ok = box_iou >= MIN_BOX_IOU and score_delta <= MAX_SCORE_DELTA and class_agreement >= MIN_CLASS_AGREEMENT
+
+    if ref_protos is not None and cand_protos is not None:
+        nm = ref.shape[0] - 4 - num_classes
+        # sigmoid(coeffs @ protos) > 0.5 <=> the logit is positive
+        ref_masks = ref[4 + num_classes:, top].T @ ref_protos.reshape(nm, -1) > 0
+        cand_masks = cand[4 + num_classes:, top].T @ cand_protos.reshape(nm, -1) > 0
+        inter = (ref_masks & cand_masks).sum(axis=1)
+        union = (ref_masks | cand_masks).sum(axis=1)
+        mask_iou = float(np.where(union > 0, inter / np.maximum(union, 1), 1.0).mean())
+        details["mask_iou"] = round(mask_iou, 4)
+        ok = ok and mask_iou >= MIN_MASK_IOU
+    return ok, details
+
+
+def _iou(a, b):
+    x1, y1 = max(a[0], b[0]), max(a[1], b[1])
+    x2, y2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0.0, x2 - x1) * max(0.0, y2 - y1)
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+
+def compare_detections(reference, candidate):
+    """
+    Greedy class-agnostic IoU matching of two `objects` lists: `f1` measures
+    localization, `class_agreement` the share of matched pairs with the same label,
+    so a relabelled box is reported as such instead of as a missed detection.
+    """
+    unmatched = list(range(len(candidate)))
+    matched, same_label, ious, conf_deltas = 0, 0, [], []
+    for ref in sorted(reference, key=lambda d: -d["conf"]):
+        best, best_iou = None, MATCH_IOU
+        for j in unmatched:
+            iou = _iou(ref["box"], candidate[j]["box"])
+            if iou >= best_iou:
+                best, best_iou = j, iou
+        if best is not None:
+            unmatched.remove(best)
+            matched += 1
+            same_label += candidate[best]["label"] == ref["label"]
+            ious.append(best_iou)
+            conf_deltas.append(abs(candidate[best]["conf"] - ref["conf"]))
+    precision = matched / len(candidate) if candidate else 1.0
+    recall = matched / len(reference) if reference else 1.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {
+        "reference": len(reference),
+        "candidate": len(candidate),
+        "matched": matched,
+        "f1": round(f1, 4),
+        "class_agreement": round(same_label / matched, 4) if matched else 1.0,
+        "mean_iou": round(float(np.mean(ious)), 4) if ious else None,
+        "mean_conf_delta": round(float(np.mean(conf_deltas)), 4) if conf_deltas else None
+    }
+
+
+def compare_results(reference, candidate):
+    """Parity of one pipeline result (reduced precision) against the fp32 result for the same image."""
+    detections = compare_detections(reference.get("objects", []), candidate.get("objects", []))
+    ref_caption = str(reference.get("florence", {}).get("dense", ""))
+    cand_caption = str(candidate.get("florence", {}).get("dense", ""))
+    caption_similarity = difflib.SequenceMatcher(None, ref_caption, cand_caption).ratio()
+    return {
+        "detections": detections,
+        "caption_similarity": round(caption_similarity, 4),
+        "materials_equal": reference.get("materials") == candidate.get("materials"),
+        "passed": detections["f1"] >= MIN_DETECTION_F1
+        and detections["class_agreement"] >= MIN_CLASS_AGREEMENT
+        and caption_similarity >= MIN_CAPTION_SIMILARITY
+    }
+
+
+def summarize_parity(per_image):
+    f1 = [r["detections"]["f1"] for r in per_image]
+    classes = [r["detections"]["class_agreement"] for r in per_image]
+    captions = [r["caption_similarity"] for r in per_image]
+    return {
+        "images": len(per_image),
+        "passed_images": sum(r["passed"] for r in per_image),
+        "mean_detection_f1": round(float(np.mean(f1)), 4) if f1 else None,
+        "min_detection_f1": round(float(np.min(f1)), 4) if f1 else None,
+        "mean_class_agreement": round(float(np.mean(classes)), 4) if classes else None,
+        "mean_caption_similarity": round(float(np.mean(captions)), 4) if captions else None,
+        "materials_agreement": round(float(np.mean([r["materials_equal"] for r in per_image])), 4) if per_image else None,
+        # Beam search can diverge on single images in fp16; the profile is judged on the means
+        "passed": bool(per_image)
+        and float(np.mean(f1)) >= MIN_DETECTION_F1
+        and float(np.mean(classes)) >= MIN_CLASS_AGREEMENT
+        and float(np.mean(captions)) >= MIN_CAPTION_SIMILARITY
+    }
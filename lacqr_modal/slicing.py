@@ -0,0 +1,125 @@
+import numpy as np
+
+# Tile side as a fraction of the plate's short side: gems ~2-5% of a plate end up
+# 3-8% of a tile, comfortably above YOLO-World's floor once the tile is letterboxed
+SLICE_PLATE_FRACTION = 0.6
+SLICE_MIN_TILE = 128
+# Largest object we want whole in at least one tile, as a fraction of the plate's short side.
+# Overlap is sized to cover it, so nothing is only ever seen cut in half.
+SLICE_OBJECT_FRACTION = 0.15
+SLICE_MIN_OVERLAP = 0.1
+SLICE_MAX_OVERLAP = 0.4
+# Context kept around each plate (nail art often spills over the plate edge)
+SLICE_PLATE_MARGIN = 0.1
+
+
+def adaptive_tile_params(plate_width, plate_height, max_tile):
+    """Tile side (px) and overlap ratio for one plate, from its size."""
+    short_side = max(1.0, float(min(plate_width, plate_height)))
+    tile = int(np.clip(round(short_side * SLICE_PLATE_FRACTION), SLICE_MIN_TILE, max_tile))
+    overlap = float(np.clip(short_side * SLICE_OBJECT_FRACTION / tile, SLICE_MIN_OVERLAP, SLICE_MAX_OVERLAP))
+    return tile, overlap
+
+
+def _axis_starts(start, length, tile, overlap):
+    """Tile origins covering [start, start + length); the last tile is snapped to the far edge."""
+    if length <= tile:
+        return np.array([start], dtype=int)
+    step = max(1, int(tile * (1.0 - overlap)))
+    count = int(np.ceil((length - tile) / step)) + 1
+    return start + np.minimum(np.arange(count) * step, length - tile)
+
+
+def plate_tiles(plates, image_size, max_tile, include_full=True):
+    """
+    Slices the region around each plate (not the whole frame) into overlapping tiles.
+    Equivalent to sahi.slicing.get_slice_bboxes per plate region, with the tile size and
+    overlap chosen per plate. `include_full` adds the whole region as one extra "tile" so
+    large objects are still detected at plate scale (SAHI's standard prediction).
+
+    Returns (tiles (N, 4) int xyxy in image coordinates, plate index per tile).
+    """
+    width, height = image_size
+    plates = np.asarray(plates, dtype=np.float64).reshape(-1, 4)
+    tiles, owners = [], []
+    for index, (x1, y1, x2, y2) in enumerate(plates):
+        plate_w, plate_h = x2 - x1, y2 - y1
+        if plate_w <= 0 or plate_h <= 0:
+            continue
+        # Plate + margin, clipped to the image
+        mx, my = plate_w * SLICE_PLATE_MARGIN, plate_h * SLICE_PLATE_MARGIN
+        rx1, ry1 = int(max(0, x1 - mx)), int(max(0, y1 - my))
+        rx2, ry2 = int(min(width, x2 + mx)), int(min(height, y2 + my))
+        if rx2 <= rx1 or ry2 <= ry1:
+            continue
+
+        tile, overlap = adaptive_tile_params(plate_w, plate_h, max_tile)
+        tile_w, tile_h = min(tile, rx2 - rx1), min(tile, ry2 - ry1)
+        xs = _axis_starts(rx1, rx2 - rx1, tile_w, overlap)
+        ys = _axis_starts(ry1, ry2 - ry1, tile_h, overlap)
+        gx, gy = np.meshgrid(xs, ys)
+        region_tiles = np.stack([gx.ravel(), gy.ravel(), gx.ravel() + tile_w, gy.ravel() + tile_h], axis=1)
+        if include_full and len(region_tiles) > 1:
+            region_tiles = np.vstack([region_tiles, [[rx1, ry1, rx2, ry2]]])
+        tiles.append(region_tiles)
+        owners.append(np.full(len(region_tiles), index, dtype=int))
+
+    if not tiles:
+        return np.zeros((0, 4), dtype=int), np.zeros(0, dtype=int)
+    return np.concatenate(tiles).astype(int), np.concatenate(owners)
+
+
+def pairwise_overlap(boxes, metric="ios"):
+    """(N, N) IoU or IoS (intersection over the smaller box) for xyxy boxes."""
+    boxes = np.asarray(boxes, dtype=np.float64)
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    lt = np.maximum(boxes[:, None, :2], boxes[None, :, :2])
+    rb = np.minimum(boxes[:, None, 2:], boxes[None, :, 2:])
+    wh = np.clip(rb - lt, 0, None)
+    inter = wh[..., 0] * wh[..., 1]
+    if metric == "iou":
+        denom = areas[:, None] + areas[None, :] - inter
+    else:
+        denom = np.minimum(areas[:, None], areas[None, :])
+    return inter / np.maximum(denom, 1e-9)
+
+
+def merge_detections(boxes, scores, classes, threshold=0.5, metric="ios", mode="nmm"):
+    """
+    Class-aware merge of detections coming from overlapping tiles.
+
+    The overlap matrix is computed once for all boxes; the greedy pass then only
+    reads rows of it. IoS is the default metric because a gem cut by a tile edge is
+    a small box *inside* the full detection from the neighbouring tile.
+    - "nms": keep the highest-scoring box of each overlapping group
+    - "nmm": greedy non-maximum merging, the kept box grows to the union of its group
+
+    Returns (boxes, scores, classes) of the survivors, highest score first.
+    """
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    scores = np.asarray(scores, dtype=np.float64)
+    classes = np.asarray(classes, dtype=int)
+    if len(boxes) == 0:
+        return boxes, scores, classes
+
+    order = np.argsort(-scores, kind="stable")
+    boxes, scores, classes = boxes[order], scores[order], classes[order]
+    matches = (pairwise_overlap(boxes, metric) > threshold) & (classes[:, None] == classes[None, :])
+
+    suppressed = np.zeros(len(boxes), dtype=bool)
+    keep, merged = [], []
+    for i in range(len(boxes)):
+        if suppressed[i]:
+            continue
+        group = matches[i] & ~suppressed
+        group[i] = True
+        suppressed |= group
+        keep.append(i)
+        if mode == "nmm":
+            members = boxes[group]
+            merged.append(np.concatenate([members[:, :2].min(axis=0), members[:, 2:].max(axis=0)]))
+        else:
+            merged.append(boxes[i])
+
+    keep = np.asarray(keep, dtype=int)
+    return np.asarray(merged), scores[keep], classes[keep]
@@ -0,0 +1,150 @@
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+from contextlib import nullcontext
+
+
+class StageGraph:
+    """
+    Tiny dependency-graph executor for the pipeline stages.
+
+    Each stage is a callable plus the names of the stages it depends on. Stages
+    whose inputs are ready run concurrently on a shared thread pool (PyTorch
+    releases the GIL inside kernels, so GPU work and CPU pre/post-processing of
+    different stages overlap). A dependent stage is submitted the moment its last
+    input finishes. On CUDA every stage runs on its own stream.
+
+    A stage that raises does not take the graph down: its error is logged and
+    its `default` is used as the result, matching the per-stage try/except the
+    pipeline has always had. A stage with a `budget_ms` that is still running
+    when the budget runs out is treated the same way (listed in `timed_out`).
+    The budget starts when a worker picks the stage up, not when it is queued.
+    A stage that times out before it gets its model never runs; one that is
+    already running finishes in the background and its late result is discarded.
+
+    The executor is shared between requests, so a stage can pass a `lock` (one
+    per model): an abandoned stage still holds its model until it finishes,
+    and the next request's stage waits for it instead of running concurrently.
+    """
+
+    # How often run() looks for newly started budgeted stages
+    POLL_S = 0.01
+
+    def __init__(self, use_cuda_streams=False):
+        self.use_cuda_streams = use_cuda_streams
+        self._stages = {}
+        self.timed_out = []
+
+    def add(self, name, fn, deps=(), default=None, budget_ms=None, lock=None):
+        """fn receives the results of `deps` as keyword arguments."""
+        self._stages[name] = (fn, tuple(deps), default, budget_ms, lock)
+        return self
+
+    def run(self, executor, trace=None):
+        """
+        Generator: yields (stage_name, result) in completion order.
+        With a `trace`, each stage's wall time is recorded as a "stage.<name>" span.
+        Closing the generator early cancels every stage that has not started yet.
+        """
+        results = {}
+        pending = {}
+        started = {} # name -> perf_counter() when a worker picked it up (set by _execute)
+        cancelled = set()
+        remaining = dict(self._stages)
+        self.timed_out = []
+
+        def submit_ready():
+            for name, (fn, deps, default, budget_ms, lock) in list(remaining.items()):
+                if all(dep in results for dep in deps):
+                    del remaining[name]
+                    inputs = {dep: results[dep] for dep in deps}
+                    future = executor.submit(self._execute, name, fn, inputs, default, trace, lock, started, cancelled)
+                    pending[future] = name
+
+        def deadline(name):
+            budget_ms = self._stages[name][3]
+            if budget_ms is None or name not in started:
+                return None
+            return started[name] + budget_ms / 1000.0
+
+        try:
+            submit_ready()
+            while pending:
+                timeout = None
+                budgeted = [name for name in pending.values() if self._stages[name][3] is not None]
+                if budgeted:
+                    deadlines = [d for d in map(deadline, budgeted) if d is not None]
+                    timeout = max(0.0, min(deadlines) - time.perf_counter()) if deadlines else None
+                    if len(deadlines) < len(budgeted):
+                        # A budgeted stage is still queued: wake up to start its clock
+                        timeout = self.POLL_S if timeout is None else min(timeout, self.POLL_S)
+                done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = pending.pop(future)
+                    results[name] = future.result()
+                    yield name, results[name]
+
+                now = time.perf_counter()
+                for future, name in list(pending.items()):
+                    limit = deadline(name)
+                    if limit is not None and now >= limit:
+                        del pending[future]
+                        cancelled.add(name)
+                        print(f"⏱️ Stage {name} exceeded its budget, using its fallback")
+                        self.timed_out.append(name)
+                        if trace is not None:
+                            trace.set("stages_timed_out", list(self.timed_out))
+                        results[name] = self._stages[name][2]
+                        yield name, results[name]
+                submit_ready()
+        finally:
+            # Early exit (client went away, an error): queued stages never start
+            for future, name in pending.items():
+                cancelled.add(name)
+                future.cancel()
+
+        if remaining:
+            raise ValueError(f"Unresolvable stage dependencies: {sorted(remaining)}")
+
+    def _execute(self, name, fn, inputs, default, trace=None, lock=None, started=None, cancelled=()):
+        if started is not None:
+            started[name] = time.perf_counter()
+        with lock if lock is not None else nullcontext():
+            if name in cancelled:
+                # Timed out (or abandoned) while waiting for the model: skip the work
+                return default
+            begun = time.perf_counter()
+            if trace is not None and lock is not None and started is not None:
+                trace.add_span(f"stage.{name}.model_wait", (begun - started[name]) * 1000.0)
+            try:
+                with self._stream_context() as stream:
+                    result = fn(**inputs)
+                    if stream is not None:
+                        # Results (e.g. .cpu() copies) must be complete before dependents read them
+                        stream.synchronize()
+                    return result
+            except Exception as e:
+                print(f"❌ Stage {name} Failed: {e}")
+                return default
+            finally:
+                if trace is not None:
+                    trace.add_span(f"stage.{name}", (time.perf_counter() - begun) * 1000.0)
+
+    def _stream_context(self):
+        if not self.use_cuda_streams:
+            return nullcontext()
+        import torch
+        return _CudaStream(torch)
+
+
+class _CudaStream:
+    def __init__(self, torch):
+        self.torch = torch
+        self.stream = torch.cuda.Stream()
+        self._ctx = torch.cuda.stream(self.stream)
+
+    def __enter__(self):
+        self._ctx.__enter__()
+        return self.stream
+
+    def __exit__(self, *exc):
+        return self._ctx.__exit__(*exc)
@@ -0,0 +1,373 @@
+import json
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+
+# Design ids are hex digests; anything else never reaches a Milvus filter expression
+MILVUS_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors[None, :]
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+class LocalIVFIndex:
+    """
+    Embedded cosine-similarity ANN index over NumPy (no network, no extra deps).
+
+    - Below `train_size` vectors it is an exact flat index (one matrix product).
+    - Past that it trains an IVF coarse quantizer (spherical k-means, `nlist` lists)
+      and a query only scores the vectors of its `nprobe` closest lists. The
+      quantizer is retrained whenever the index has doubled since the last training.
+    - add() buffers; vectors are appended to the index in batches of `batch_size`
+      (and on every search, so nothing is ever invisible to queries).
+    - save()/load() persist to `path` atomically (one index.npz). Several containers
+      share the path: save() first merges in whatever is on disk (designs other
+      containers indexed), so writers add to the index instead of overwriting it.
+      Every `save_every` new items the index saves itself; `before_save` / `after_save`
+      hooks are where the caller syncs the underlying volume (reload / commit).
+    """
+
+    def __init__(self, dim, nlist=64, nprobe=8, batch_size=64, train_size=None, path=None, seed=0,
+                 save_every=256, before_save=None, after_save=None):
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.batch_size = batch_size
+        self.train_size = train_size or nlist * 39 # k-means wants ~39 points per centroid
+        self.path = path
+        self.seed = seed
+        self.save_every = save_every
+        self.before_save = before_save
+        self.after_save = after_save
+        self._unsaved = 0
+        self.vectors = np.zeros((0, dim), dtype=np.float32)
+        self.ids = []
+        self.metadata = []
+        self._id_index = {}
+        self._pending = []
+        self._lock = threading.RLock()
+        self.centroids = None
+        self._trained_at = 0
+        self._list_order = None
+        self._list_offsets = None
+
+    # --- writes ---
+    def add(self, ids, vectors, metadata=None):
+        vectors = _normalize(vectors)
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"Expected {self.dim}-d vectors, got {vectors.shape[1]}")
+        metadata = metadata or [{} for _ in ids]
+        with self._lock:
+            self._pending.extend(zip(ids, vectors, metadata))
+            self._unsaved += len(ids)
+            if len(self._pending) >= self.batch_size:
+                self._flush_locked()
+            autosave = self.path and self.save_every and self._unsaved >= self.save_every
+        if autosave:
+            try:
+                self.save()
+            except Exception as e:
+                print(f"⚠️ Could not persist the vector index: {e}")
+
+    def update_metadata(self, item_id, values):
+        with self._lock:
+            self._flush_locked()
+            index = self._id_index.get(item_id)
+            if index is None:
+                return False
+            self.metadata[index].update(values)
+            return True
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._pending:
+            return
+        new_ids, new_vectors, new_meta = [], [], []
+        for item_id, vector, meta in self._pending:
+            existing = self._id_index.get(item_id)
+            if existing is not None:
+                # Re-analysis of a known design: refresh in place
+                self.vectors[existing] = vector
+                self.metadata[existing].update(meta)
+                continue
+            self._id_index[item_id] = len(self.ids) + len(new_ids)
+            new_ids.append(item_id)
+            new_vectors.append(vector)
+            new_meta.append(dict(meta))
+        self._pending = []
+        self._append_locked(new_ids, new_vectors, new_meta)
+
+    def _append_locked(self, new_ids, new_vectors, new_meta):
+        if new_ids:
+            self.vectors = np.concatenate([self.vectors, np.stack(new_vectors)])
+            self.ids.extend(new_ids)
+            self.metadata.extend(new_meta)
+
+        if len(self.ids) >= self.train_size and len(self.ids) >= 2 * max(self._trained_at, self.train_size // 2):
+            self._train()
+        elif self.centroids is not None:
+            self._assign()
+
+    # --- IVF ---
+    def _train(self, iterations=10):
+        rng = np.random.default_rng(self.seed)
+        nlist = min(self.nlist, len(self.vectors))
+        centroids = self.vectors[rng.choice(len(self.vectors), nlist, replace=False)]
+        for _ in range(iterations):
+            assign = np.argmax(self.vectors @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, self.vectors)
+            counts = np.bincount(assign, minlength=nlist)
+            empty = counts == 0
+            # Re-seed empty lists instead of letting them collapse
+            sums[empty] = self.vectors[rng.choice(len(self.vectors), int(empty.sum()))]
+            centroids = _normalize(sums)
+        self.centroids = centroids
+        self._trained_at = len(self.vectors)
+        self._assign()
+
+    def _assign(self):
+        assign = np.argmax(self.vectors @ self.centroids.T, axis=1)
+        self._list_order = np.argsort(assign, kind="stable")
+        self._list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=len(self.centroids)))])
+
+    # --- reads ---
+    def search(self, vectors, k=5):
+        """Top-k most similar items per query: [[{"id", "score", "metadata"}, ...], ...]."""
+        queries = _normalize(vectors)
+        with self._lock:
+            self._flush_locked()
+            if not self.ids:
+                return [[] for _ in queries]
+            results = []
+            for query in queries:
+                candidates = self._candidates(query)
+                scores = self.vectors[candidates] @ query
+                top = min(k, len(candidates))
+                best = np.argpartition(-scores, top - 1)[:top]
+                best = best[np.argsort(-scores[best])]
+                results.append([
+                    {"id": self.ids[candidates[i]], "score": round(float(scores[i]), 4), "metadata": self.metadata[candidates[i]]}
+                    for i in best
+                ])
+            return results
+
+    def _candidates(self, query):
+        if self.centroids is None:
+            return np.arange(len(self.ids))
+        probes = np.argsort(-(self.centroids @ query))[:self.nprobe]
+        parts = [self._list_order[self._list_offsets[p]:self._list_offsets[p + 1]] for p in probes]
+        candidates = np.concatenate(parts)
+        return candidates if len(candidates) else np.arange(len(self.ids))
+
+    def get_vector(self, item_id):
+        with self._lock:
+            self._flush_locked()
+            index = self._id_index.get(item_id)
+            return None if index is None else self.vectors[index].copy()
+
+    def __len__(self):
+        return len(self.ids) + len(self._pending)
+
+    def stats(self):
+        return {
+            "backend": "local",
+            "count": len(self),
+            "dim": self.dim,
+            "ivf": self.centroids is not None,
+            "nlist": None if self.centroids is None else len(self.centroids),
+            "nprobe": self.nprobe,
+            "pending": len(self._pending)
+        }
+
+    # --- persistence ---
+    def save(self):
+        if not self.path:
+            return
+        if self.before_save:
+            self.before_save()
+        with self._lock:
+            self._flush_locked()
+            self._merge_locked(self._read())
+            os.makedirs(self.path, exist_ok=True)
+            tmp = os.path.join(self.path, "index.tmp.npz")
+            meta = json.dumps({"dim": self.dim, "ids": self.ids, "metadata": self.metadata})
+            with open(tmp, "wb") as f:
+                np.savez(f, vectors=self.vectors, meta=np.array(meta))
+            # Vectors and ids live in one file, so a reader never pairs one writer's
+            # vectors with another writer's ids
+            os.replace(tmp, os.path.join(self.path, "index.npz"))
+            self._unsaved = 0
+        if self.after_save:
+            self.after_save()
+
+    def load(self):
+        with self._lock:
+            self._merge_locked(self._read())
+        return self
+
+    def _read(self):
+        """(ids, vectors, metadata) persisted at `path`, or None."""
+        if not self.path:
+            return None
+        index_path = os.path.join(self.path, "index.npz")
+        try:
+            if os.path.exists(index_path):
+                with np.load(index_path) as data:
+                    meta = json.loads(str(data["meta"]))
+                    vectors = data["vectors"]
+            elif os.path.exists(os.path.join(self.path, "meta.json")):
+                # Layout before index.npz
+                with open(os.path.join(self.path, "meta.json")) as f:
+                    meta = json.load(f)
+                vectors = np.load(os.path.join(self.path, "vectors.npy"))
+            else:
+                return None
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠️ Ignoring unreadable vector index at {self.path}: {e}")
+            return None
+        if meta["dim"] != self.dim:
+            print(f"⚠️ Ignoring vector index at {self.path}: dim {meta['dim']} != {self.dim}")
+            return None
+        return meta["ids"], vectors, meta["metadata"]
+
+    def _merge_locked(self, persisted):
+        """Adds persisted items this index does not know yet (its own copies win)."""
+        if persisted is None:
+            return
+        ids, vectors, metadata = persisted
+        new = [i for i, item_id in enumerate(ids) if item_id not in self._id_index]
+        for offset, i in enumerate(new):
+            self._id_index[ids[i]] = len(self.ids) + offset
+        self._append_locked([ids[i] for i in new], [vectors[i] for i in new], [metadata[i] for i in new])
+
+
+class MilvusVectorStore:
+    """
+    Remote backend with the same interface, on an existing pymilvus connection.
+    Inserts are buffered and sent `batch_size` at a time; metadata rides along as JSON.
+    """
+
+    def __init__(self, collection_name, dim, batch_size=64, nprobe=16):
+        from pymilvus import Collection, CollectionSchema, DataType, FieldSchema, utility
+
+        self.dim = dim
+        self.batch_size = batch_size
+        self.nprobe = nprobe
+        self._pending = []
+        self._lock = threading.Lock()
+        if not utility.has_collection(collection_name):
+            schema = CollectionSchema([
+                FieldSchema("id", DataType.VARCHAR, is_primary=True, max_length=64),
+                FieldSchema("embedding", DataType.FLOAT_VECTOR, dim=dim),
+                FieldSchema("metadata", DataType.VARCHAR, max_length=4096)
+            ])
+            collection = Collection(collection_name, schema)
+            collection.create_index("embedding", {"index_type": "IVF_FLAT", "metric_type": "COSINE", "params": {"nlist": 128}})
+        self.collection = Collection(collection_name)
+        self.collection.load()
+
+    def add(self, ids, vectors, metadata=None):
+        invalid = [item_id for item_id in ids if self._id_filter(item_id) is None]
+        if invalid:
+            raise ValueError(f"Invalid design ids: {invalid[:3]}")
+        metadata = metadata or [{} for _ in ids]
+        with self._lock:
+            self._pending.extend(zip(ids, _normalize(vectors).tolist(), (json.dumps(m) for m in metadata)))
+            if len(self._pending) >= self.batch_size:
+                self._flush_locked()
+
+    @staticmethod
+    def _id_filter(item_id):
+        """Filter expression selecting one id, or None for ids that cannot exist (never interpolated raw)."""
+        if not isinstance(item_id, str) or not MILVUS_ID_PATTERN.fullmatch(item_id):
+            return None
+        return f'id in {json.dumps([item_id])}'
+
+    def update_metadata(self, item_id, values):
+        expr = self._id_filter(item_id)
+        if expr is None:
+            return False
+        self.flush()
+        rows = self.collection.query(expr, output_fields=["embedding", "metadata"])
+        if not rows:
+            return False
+        meta = {**json.loads(rows[0]["metadata"]), **values}
+        self.collection.upsert([[item_id], [rows[0]["embedding"]], [json.dumps(meta)]])
+        return True
+
+    def get_vector(self, item_id):
+        expr = self._id_filter(item_id)
+        if expr is None:
+            return None
+        self.flush()
+        rows = self.collection.query(expr, output_fields=["embedding"])
+        return np.asarray(rows[0]["embedding"], dtype=np.float32) if rows else None
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        if not self._pending:
+            return
+        ids, vectors, metadata = map(list, zip(*self._pending))
+        self._pending = []
+        self.collection.upsert([ids, vectors, metadata])
+
+    def search(self, vectors, k=5):
+        self.flush()
+        hits = self.collection.search(
+            _normalize(vectors).tolist(), "embedding",
+            {"metric_type": "COSINE", "params": {"nprobe": self.nprobe}}, limit=k, output_fields=["metadata"]
+        )
+        return [
+            [{"id": h.id, "score": round(float(h.distance), 4), "metadata": json.loads(h.entity.get("metadata"))} for h in query_hits]
+            for query_hits in hits
+        ]
+
+    def save(self):
+        self.flush()
+
+    def stats(self):
+        return {"backend": "milvus", "count": self.collection.num_entities, "dim": self.dim, "pending": len(self._pending)}
+
+
+class TimedVectorStore:
+    """Wraps a backend and records search latency against a p99 target."""
+
+    def __init__(self, store, metrics=None, p99_target_ms=10.0):
+        self.store = store
+        self.metrics = metrics
+        self.p99_target_ms = p99_target_ms
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+    def search(self, vectors, k=5):
+        started = time.perf_counter()
+        results = self.store.search(vectors, k)
+        if self.metrics is not None:
+            self.metrics.observe("vector.search", (time.perf_counter() - started) * 1000.0)
+        return results
+
+    def stats(self):
+        stats = {**self.store.stats(), "p99_target_ms": self.p99_target_ms}
+        if self.metrics is not None:
+            search = self.metrics.snapshot().get("vector.search")
+            stats["search_ms"] = search
+            # p99 is None when it lands in the +Inf bucket: that is a missed target, not unknown
+            stats["within_target"] = None if not search else search["p99_ms"] is not None and search["p99_ms"] <= self.p99_target_ms
+        return stats
@@ -0,0 +1,280 @@
+"""
+Offline augmentation: runs get_lacqr_pipeline() over a dataset split on every core
+and writes N augmented variants per image, with transformed polygon labels, into
+compact shards.
+
+    python augment_shards.py --data ../lacqrtraining_dataset_v3 --split train --variants 4 --out aug_v3
+    python augment_shards.py ... --out aug_v3                    # re-run: finished shards are skipped
+    python augment_shards.py --export-yolo aug_v3 --yolo-out aug_v3_yolo
+
+- Deterministic: every (image, variant) gets its own seed derived from --seed, the
+  file name and the variant index, so a dataset is reproduced exactly regardless of
+  worker count or scheduling.
+- Polygons are carried through the geometric transforms as keypoints; vertices that
+  leave the frame are clipped back to the image by rasterizing the polygon.
+- Shards (shard_00000.npz, ...) hold JPEG bytes + the flat label layout used by
+  dataset_cache.py (classes, segment_offsets, coords, image_offsets). Each shard is
+  written atomically, so an interrupted run resumes at the first missing shard.
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from dataset_cache import IMAGE_EXTENSIONS, MIN_POLYGON_AREA, parse_label_file, polygon_area
+
+SHARD_VERSION = 1
+JPEG_QUALITY = 95
+
+# Per-process state, set up once by _init_worker
+_pipeline = None
+
+
+def sample_seed(base_seed, image_name, variant):
+    """Stable 32-bit seed for one augmented sample."""
+    return int(np.random.SeedSequence([base_seed, zlib.crc32(image_name.encode()), variant]).generate_state(1)[0])
+
+
+def clip_polygon(points, width, height):
+    """
+    Clips a pixel polygon to the image. In-frame polygons are returned untouched;
+    otherwise the polygon is rasterized (which clips it) and the largest contour kept.
+    """
+    if points.min() >= 0 and points[:, 0].max() <= width - 1 and points[:, 1].max() <= height - 1:
+        return points
+    mask = np.zeros((height, width), dtype=np.uint8)
+    cv2.fillPoly(mask, [np.rint(points).astype(np.int32)], 1)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
+    contour = max(contours, key=cv2.contourArea).reshape(-1, 2).astype(np.float32)
+    return contour if len(contour) >= 3 else None
+
+
+def augment_sample(image, classes, polygons, seed):
+    """
+    Applies the pipeline once with a fixed seed.
+    polygons are normalized (k, 2) arrays; returns (image, classes, polygons) in the same convention.
+    """
+    random.seed(seed)
+    np.random.seed(seed)
+    if hasattr(_pipeline, "set_random_seed"):
+        _pipeline.set_random_seed(seed)  # Albumentations >= 1.4.19 keeps its own generator
+
+    height, width = image.shape[:2]
+    keypoints, keypoint_ids, bboxes = [], [], []
+    for index, poly in enumerate(polygons):
+        pixels = poly * (width, height)
+        keypoints.extend(map(tuple, pixels))
+        keypoint_ids.extend([index] * len(pixels))
+        x1, y1 = poly.min(axis=0)
+        x2, y2 = poly.max(axis=0)
+        bboxes.append(np.clip([(x1 + x2) / 2, (y1 + y2) / 2, max(x2 - x1, 1e-6), max(y2 - y1, 1e-6)], 1e-6, 1.0))
+
+    out = _pipeline(image=image, bboxes=bboxes, category_ids=list(classes), keypoints=keypoints, keypoint_ids=keypoint_ids)
+
+    aug = out["image"]
+    out_h, out_w = aug.shape[:2]
+    points = np.asarray(out["keypoints"], dtype=np.float32).reshape(-1, 2)
+    ids = np.asarray(out["keypoint_ids"], dtype=int)
+
+    new_classes, new_polygons = [], []
+    for index, cls in enumerate(classes):
+        clipped = clip_polygon(points[ids == index], out_w, out_h)
+        if clipped is None:
+            continue
+        normalized = clipped / (out_w, out_h)
+        if polygon_area(normalized) < MIN_POLYGON_AREA:
+            continue
+        new_classes.append(int(cls))
+        new_polygons.append(normalized.astype(np.float32))
+    return aug, new_classes, new_polygons
+
+
+def _init_worker():
+    global _pipeline
+    from augmentation_pipeline import get_lacqr_pipeline
+    cv2.setNumThreads(1)  # one process per core already; avoid oversubscription
+    _pipeline = get_lacqr_pipeline(with_keypoints=True)
+
+
+def _write_shard(path, samples):
+    jpegs = [s["jpeg"] for s in samples]
+    instance_counts = [len(s["classes"]) for s in samples]
+    polygons = [p for s in samples for p in s["polygons"]]
+    arrays = {
+        "jpeg_data": np.frombuffer(b"".join(jpegs), dtype=np.uint8),
+        "jpeg_offsets": np.concatenate([[0], np.cumsum([len(j) for j in jpegs])]).astype(np.int64),
+        "hw": np.array([s["hw"] for s in samples], dtype=np.int32).reshape(-1, 2),
+        "source_index": np.array([s["source_index"] for s in samples], dtype=np.int32),
+        "variant": np.array([s["variant"] for s in samples], dtype=np.int16),
+        "seed": np.array([s["seed"] for s in samples], dtype=np.uint32),
+        "classes": np.array([c for s in samples for c in s["classes"]], dtype=np.int16),
+        "segment_offsets": np.concatenate([[0], np.cumsum([len(p) for p in polygons])]).astype(np.int64),
+        "coords": np.concatenate(polygons).astype(np.float32) if polygons else np.zeros((0, 2), np.float32),
+        "image_offsets": np.concatenate([[0], np.cumsum(instance_counts)]).astype(np.int64)
+    }
+    tmp = path.with_name(path.stem + ".tmp.npz")
+    np.savez(tmp, **arrays)
+    os.replace(tmp, path)
+
+
+def build_shard(shard_path, jobs, base_seed, variants, nc):
+    """Worker: augments every (image, label) in `jobs` `variants` times into one shard."""
+    samples = []
+    dropped = 0
+    for source_index, image_path, label_path in jobs:
+        image = cv2.imread(image_path)
+        if image is None:
+            dropped += 1
+            continue
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)  # Albumentations color ops assume RGB
+        classes, polygons, _ = parse_label_file(Path(label_path), nc)
+        name = Path(image_path).name
+        for variant in range(variants):
+            seed = sample_seed(base_seed, name, variant)
+            aug, aug_classes, aug_polygons = augment_sample(image, classes, polygons, seed)
+            ok, jpeg = cv2.imencode(".jpg", cv2.cvtColor(aug, cv2.COLOR_RGB2BGR), [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+            if not ok:
+                dropped += 1
+                continue
+            samples.append({
+                "jpeg": jpeg.tobytes(),
+                "hw": aug.shape[:2],
+                "source_index": source_index,
+                "variant": variant,
+                "seed": seed,
+                "classes": aug_classes,
+                "polygons": aug_polygons
+            })
+    _write_shard(Path(shard_path), samples)
+    return len(samples), dropped
+
+
+def _pipeline_fingerprint():
+    # Changing the augmentation recipe must not silently mix with shards made by the old one
+    source = (Path(__file__).resolve().parent / "augmentation_pipeline.py").read_bytes()
+    return hashlib.sha256(source).hexdigest()[:16]
+
+
+def generate(data_dir, split, out_dir, variants=4, seed=0, shard_size=64, workers=None, nc=1, overwrite=False):
+    img_dir = Path(data_dir) / split / "images"
+    image_paths = sorted(p for p in img_dir.iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS)
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    config = {
+        "version": SHARD_VERSION,
+        "source": str(img_dir.resolve()),
+        "variants": variants,
+        "seed": seed,
+        "shard_size": shard_size,
+        "nc": nc,
+        "pipeline": _pipeline_fingerprint(),
+        "images": [p.name for p in image_paths]
+    }
+    manifest_path = out_dir / "manifest.json"
+    if manifest_path.exists() and not overwrite:
+        with open(manifest_path) as f:
+            previous = json.load(f)
+        if previous.get("config") != config:
+            raise ValueError(f"{out_dir} holds shards from a different configuration; use --overwrite or a new --out")
+    if overwrite:
+        for old in out_dir.glob("shard_*.npz"):
+            old.unlink()
+    with open(manifest_path, "w") as f:
+        json.dump({"config": config, "complete": False}, f)
+
+    shards = []
+    for shard_index, start in enumerate(range(0, len(image_paths), shard_size)):
+        jobs = [
+            (i, str(path), str(path.parent.parent / "labels" / f"{path.stem}.txt"))
+            for i, path in enumerate(image_paths[start:start + shard_size], start)
+        ]
+        shards.append((out_dir / f"shard_{shard_index:05d}.npz", jobs))
+
+    pending = [(path, jobs) for path, jobs in shards if not path.exists()]
+    print(f"🎨 {len(image_paths)} images x {variants} variants -> {len(shards)} shards "
+          f"({len(shards) - len(pending)} already done)")
+
+    started = time.perf_counter()
+    written = dropped = 0
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count(), initializer=_init_worker) as pool:
+        futures = {pool.submit(build_shard, str(path), jobs, seed, variants, nc): path for path, jobs in pending}
+        for done, future in enumerate(as_completed(futures), 1):
+            samples, failed = future.result()
+            written += samples
+            dropped += failed
+            print(f"   [{done}/{len(pending)}] {futures[future].name}: {samples} samples")
+
+    with open(manifest_path, "w") as f:
+        json.dump({"config": config, "complete": True, "shards": [path.name for path, _ in shards]}, f)
+    print(f"✅ Wrote {written} samples in {time.perf_counter() - started:.1f}s ({dropped} dropped) -> {out_dir}")
+    return out_dir
+
+
+def iter_shard(path):
+    """Yields (jpeg_bytes, classes, [normalized polygon], meta) for every sample in a shard."""
+    with np.load(path) as shard:
+        data, offsets = shard["jpeg_data"], shard["jpeg_offsets"]
+        classes, seg_offsets, coords, img_offsets = shard["classes"], shard["segment_offsets"], shard["coords"], shard["image_offsets"]
+        for i in range(len(offsets) - 1):
+            start, end = img_offsets[i], img_offsets[i + 1]
+            polygons = [coords[seg_offsets[j]:seg_offsets[j + 1]] for j in range(start, end)]
+            meta = {"source_index": int(shard["source_index"][i]), "variant": int(shard["variant"][i]), "seed": int(shard["seed"][i])}
+            yield data[offsets[i]:offsets[i + 1]].tobytes(), classes[start:end], polygons, meta
+
+
+def export_yolo(shard_dir, yolo_dir):
+    """Materializes shards as a YOLO images/ + labels/ folder (e.g. to train with augment off)."""
+    shard_dir, yolo_dir = Path(shard_dir), Path(yolo_dir)
+    with open(shard_dir / "manifest.json") as f:
+        names = json.load(f)["config"]["images"]
+    (yolo_dir / "images").mkdir(parents=True, exist_ok=True)
+    (yolo_dir / "labels").mkdir(parents=True, exist_ok=True)
+
+    count = 0
+    for shard in sorted(shard_dir.glob("shard_*.npz")):
+        for jpeg, classes, polygons, meta in iter_shard(shard):
+            stem = f"{Path(names[meta['source_index']]).stem}_aug{meta['variant']}"
+            (yolo_dir / "images" / f"{stem}.jpg").write_bytes(jpeg)
+            with open(yolo_dir / "labels" / f"{stem}.txt", "w") as f:
+                for cls, poly in zip(classes, polygons):
+                    f.write(f"{int(cls)} " + " ".join(f"{v:.6f}" for v in poly.reshape(-1)) + "\n")
+            count += 1
+    print(f"✅ Exported {count} samples to {yolo_dir}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Parallel offline augmentation into shards")
+    parser.add_argument("--data", default="lacqrtraining_dataset_v3")
+    parser.add_argument("--split", default="train")
+    parser.add_argument("--out", help="Shard output directory")
+    parser.add_argument("--variants", type=int, default=4, help="Augmented variants per image")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--shard-size", type=int, default=64, help="Source images per shard")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--nc", type=int, default=1)
+    parser.add_argument("--overwrite", action="store_true")
+    parser.add_argument("--export-yolo", metavar="SHARD_DIR", help="Convert finished shards to YOLO folders")
+    parser.add_argument("--yolo-out", help="Target directory for --export-yolo")
+    args = parser.parse_args()
+
+    if args.export_yolo:
+        export_yolo(args.export_yolo, args.yolo_out or f"{args.export_yolo}_yolo")
+        return
+    if not args.out:
+        parser.error("--out is required")
+    generate(args.data, args.split, args.out, args.variants, args.seed, args.shard_size, args.workers, args.nc, args.overwrite)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,16 @@
 import albumentations as A
 import cv2
 
-def get_lacqr_pipeline():
+def get_lacqr_pipeline(with_keypoints=False):
     """
     Returns an Albumentations pipeline optimized for YOLOv8 Instance Segmentation.
     Handles:
     1. Geometric changes (Rotation/Scale) - Critical for user camera angles.
     2. Lighting changes - Critical for dark room detection.
     3. Noise/Blur - Critical for low-end phone cameras.
+
+    with_keypoints=True also transforms pixel 'xy' keypoints (label field
+    'keypoint_ids'), which is how augment_shards.py carries polygon vertices.
     """
     return A.Compose([
         # --- GEOMETRY (Handling Angles) ---
@@ -37,5 +40,7 @@ def get_lacqr_pipeline():
     # 1. format='yolo' ensures bounding box coordinates are normalized (0-1)
     # 2. 'masks' target ensures the polygon shape rotates WITH the image
     bbox_params=A.BboxParams(format='yolo', label_fields=['category_ids']),
-    additional_targets={'masks': 'mask'} 
+    additional_targets={'masks': 'mask'},
+    # Vertices may leave the frame after rotation; the caller clips the polygon
+    keypoint_params=A.KeypointParams(format='xy', label_fields=['keypoint_ids'], remove_invisible=False) if with_keypoints else None
     )
@@ -0,0 +1,438 @@
+"""
+Preprocessed, memory-mapped dataset cache for training.
+
+Every epoch used to decode all JPEGs in lacqrtraining_dataset_v3/train/images and
+re-parse every polygon label file on the main thread (workers=0). This builds a
+cache once per split:
+
+    images.npy     (N, imgsz, imgsz, 3) uint8 memmap. Each image is resized so its
+                   long side is imgsz (exactly what Ultralytics' load_image does) and
+                   stored top-left in a fixed-size, zero-padded slot
+    hw.npy         (N, 4) int32: original (h, w) and resized (h, w) per image
+    labels.npz     flat label arrays:
+                     classes          (M,) int16, one per polygon
+                     segment_offsets  (M + 1,) int64 into coords
+                     coords           (K, 2) float32, normalized xy
+                     image_offsets    (N + 1,) int64 into classes
+    manifest.json  source file signatures (size + mtime), per-image validation issues
+
+Rebuilds are incremental: images and labels whose signature did not change are
+copied from the previous cache instead of being decoded/parsed again.
+
+    python dataset_cache.py --data ../lacqrtraining_dataset_v3 --splits train valid
+
+Training uses the cache through CachedSegmentationTrainer:
+
+    model.train(data=..., trainer=CachedSegmentationTrainer)
+
+A split that lists several image directories (e.g. combined_data.yaml) gets one
+cache per directory; the dataset reads from all of them.
+"""
+import argparse
+import json
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+CACHE_VERSION = 2
+CACHE_DIRNAME = ".lacqr_cache"
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+# Normalized coordinates this far outside [0, 1] are clipped; further out the polygon is dropped
+COORD_TOLERANCE = 0.01
+MIN_POLYGON_AREA = 1e-6
+
+
+def _signature(path):
+    if not path.exists():
+        return None
+    stat = path.stat()
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _label_path(image_path):
+    # Roboflow/YOLO layout: <split>/images/x.jpg -> <split>/labels/x.txt
+    return image_path.parent.parent / "labels" / f"{image_path.stem}.txt"
+
+
+def split_cache_dir(img_dir, augment=True):
+    """
+    <dataset>/<split>/images -> <dataset>/.lacqr_cache/<split>, or <split>-eval for the
+    validation resize (a directory used for both train and val gets both caches).
+    """
+    img_dir = Path(img_dir).resolve()
+    split_dir = img_dir.parent if img_dir.name == "images" else img_dir
+    return split_dir.parent / CACHE_DIRNAME / (split_dir.name if augment else f"{split_dir.name}-eval")
+
+
+def polygon_area(coords):
+    x, y = coords[:, 0], coords[:, 1]
+    return 0.5 * abs(float(np.dot(x, np.roll(y, 1)) - np.dot(y, np.roll(x, 1))))
+
+
+def parse_label_file(path, nc):
+    """
+    Parses + validates one YOLO segmentation label file.
+    Returns (classes, polygons, issues); invalid lines are dropped and reported.
+    """
+    classes, polygons, issues = [], [], []
+    if not path.exists():
+        return classes, polygons, ["missing label file"]
+
+    seen = set()
+    with open(path) as f:
+        for line_no, line in enumerate(f, 1):
+            parts = line.split()
+            if not parts:
+                continue
+            try:
+                values = np.asarray(parts, dtype=np.float64)
+            except ValueError:
+                issues.append(f"line {line_no}: not numeric")
+                continue
+            cls, coords = values[0], values[1:]
+            if cls != int(cls) or not 0 <= cls < nc:
+                issues.append(f"line {line_no}: class {parts[0]} outside [0, {nc})")
+                continue
+            if len(coords) == 4:
+                # Box-only line: expand to its rectangle so every instance has a polygon
+                cx, cy, w, h = coords
+                coords = np.array([cx - w / 2, cy - h / 2, cx + w / 2, cy - h / 2,
+                                   cx + w / 2, cy + h / 2, cx - w / 2, cy + h / 2])
+            if len(coords) % 2 or len(coords) < 6:
+                issues.append(f"line {line_no}: {len(coords)} coordinates, need an even count >= 6")
+                continue
+            coords = coords.reshape(-1, 2)
+            if coords.min() < -COORD_TOLERANCE or coords.max() > 1 + COORD_TOLERANCE:
+                issues.append(f"line {line_no}: coordinates outside the image")
+                continue
+            coords = np.clip(coords, 0.0, 1.0)
+            if polygon_area(coords) < MIN_POLYGON_AREA:
+                issues.append(f"line {line_no}: degenerate polygon")
+                continue
+            key = (int(cls), coords.round(6).tobytes())
+            if key in seen:
+                issues.append(f"line {line_no}: duplicate instance")
+                continue
+            seen.add(key)
+            classes.append(int(cls))
+            polygons.append(coords.astype(np.float32))
+    return classes, polygons, issues
+
+
+def load_resized(path, imgsz, augment=True):
+    """
+    Decodes and resizes so the long side is imgsz, exactly like Ultralytics'
+    BaseDataset.load_image: ceil'd sizes, INTER_LINEAR for training (augment)
+    or upscaling, INTER_AREA for downscaling validation images.
+    """
+    im = cv2.imread(str(path))  # BGR
+    if im is None:
+        raise ValueError(f"cannot decode {path}")
+    h0, w0 = im.shape[:2]
+    r = imgsz / max(h0, w0)
+    if r != 1:
+        interp = cv2.INTER_LINEAR if (augment or r > 1) else cv2.INTER_AREA
+        w, h = min(math.ceil(w0 * r), imgsz), min(math.ceil(h0 * r), imgsz)
+        im = cv2.resize(im, (w, h), interpolation=interp)
+    return im, (h0, w0)
+
+
+class DatasetCache:
+    """Read-only view of a built split cache."""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir)
+        with open(self.cache_dir / "manifest.json") as f:
+            self.manifest = json.load(f)
+        self.imgsz = self.manifest["imgsz"]
+        self.images = np.load(self.cache_dir / "images.npy", mmap_mode="r")
+        self.hw = np.load(self.cache_dir / "hw.npy")
+        labels = np.load(self.cache_dir / "labels.npz")
+        self.classes = labels["classes"]
+        self.segment_offsets = labels["segment_offsets"]
+        self.coords = labels["coords"]
+        self.image_offsets = labels["image_offsets"]
+        self.files = [entry["image"] for entry in self.manifest["entries"]]
+        self.index = {name: i for i, name in enumerate(self.files)}
+
+    def __len__(self):
+        return len(self.files)
+
+    def image(self, i):
+        """Resized BGR image i (long side = imgsz), copied out of the memmap."""
+        h, w = self.hw[i, 2:]
+        return np.array(self.images[i, :h, :w]), tuple(int(v) for v in self.hw[i, :2])
+
+    def labels(self, i):
+        """(classes (n,), [polygon (k, 2) normalized]) for image i."""
+        start, end = self.image_offsets[i], self.image_offsets[i + 1]
+        segments = [self.coords[self.segment_offsets[j]:self.segment_offsets[j + 1]] for j in range(start, end)]
+        return self.classes[start:end], segments
+
+
+def _write_atomic_npy(path, array):
+    tmp = path.with_name(path.name + ".tmp.npy")
+    np.save(tmp, array)
+    os.replace(tmp, path)
+
+
+def build_cache(img_dir, imgsz=640, nc=1, cache_dir=None, workers=None, force=False, augment=True):
+    """
+    Builds (or incrementally refreshes) the cache for one split's image directory.
+    `augment` selects the resize interpolation Ultralytics would use for the split
+    (True for training). Returns the cache directory.
+    """
+    img_dir = Path(img_dir).resolve()
+    cache_dir = Path(cache_dir) if cache_dir else split_cache_dir(img_dir, augment)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = cache_dir / "manifest.json"
+
+    image_paths = sorted(p for p in img_dir.iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS)
+    sources = [
+        {"image": p.name, "image_sig": _signature(p), "label_sig": _signature(_label_path(p))}
+        for p in image_paths
+    ]
+
+    # Previous cache, reusable only if it was built with the same layout
+    previous = None
+    if not force and manifest_path.exists():
+        try:
+            previous = DatasetCache(cache_dir)
+            if (previous.manifest.get("version") != CACHE_VERSION or previous.imgsz != imgsz
+                    or previous.manifest.get("nc") != nc or previous.manifest.get("augment") != augment):
+                previous = None
+        except (OSError, ValueError, KeyError):
+            previous = None
+
+    old_entries = {}
+    if previous is not None:
+        old_entries = {e["image"]: (i, e) for i, e in enumerate(previous.manifest["entries"])}
+        unchanged = [
+            s["image"] in old_entries
+            and old_entries[s["image"]][1]["image_sig"] == s["image_sig"]
+            and old_entries[s["image"]][1]["label_sig"] == s["label_sig"]
+            for s in sources
+        ]
+        if len(sources) == len(previous) and all(unchanged):
+            print(f"✅ Cache up to date: {cache_dir} ({len(sources)} images)")
+            return cache_dir
+
+    started = time.perf_counter()
+    n = len(sources)
+    tmp_images = cache_dir / "images.tmp.npy"
+    images = np.lib.format.open_memmap(tmp_images, mode="w+", dtype=np.uint8, shape=(n, imgsz, imgsz, 3))
+    hw = np.zeros((n, 4), dtype=np.int32)
+    per_image_labels = [None] * n
+    entries = [None] * n
+    stats = {"decoded": 0, "reused_images": 0, "parsed": 0, "reused_labels": 0}
+
+    def process(i):
+        source = sources[i]
+        old = old_entries.get(source["image"])
+        image_path = img_dir / source["image"]
+
+        if old is not None and old[1]["image_sig"] == source["image_sig"]:
+            images[i] = previous.images[old[0]]
+            hw[i] = previous.hw[old[0]]
+            reused_image = True
+        else:
+            im, (h0, w0) = load_resized(image_path, imgsz, augment)
+            h, w = im.shape[:2]
+            images[i, :h, :w] = im
+            images[i, h:, :] = 0
+            images[i, :h, w:] = 0
+            hw[i] = (h0, w0, h, w)
+            reused_image = False
+
+        if old is not None and old[1]["label_sig"] == source["label_sig"]:
+            classes, segments = previous.labels(old[0])
+            classes, segments = list(classes), [np.array(s) for s in segments]
+            issues = old[1]["issues"]
+            reused_label = True
+        else:
+            classes, segments, issues = parse_label_file(_label_path(image_path), nc)
+            reused_label = False
+
+        per_image_labels[i] = (classes, segments)
+        entries[i] = {**source, "instances": len(classes), "issues": issues}
+        return reused_image, reused_label
+
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        # cv2 decode/resize release the GIL, so threads scale without pickling pixels
+        for reused_image, reused_label in pool.map(process, range(n)):
+            stats["reused_images" if reused_image else "decoded"] += 1
+            stats["reused_labels" if reused_label else "parsed"] += 1
+
+    images.flush()
+    images = previous = None  # release both memmaps before replacing the files
+
+    # Flatten labels: image -> instances -> polygon points
+    instance_counts = np.array([len(c) for c, _ in per_image_labels], dtype=np.int64)
+    all_segments = [s for _, segments in per_image_labels for s in segments]
+    point_counts = np.array([len(s) for s in all_segments], dtype=np.int64)
+    labels = {
+        "classes": np.array([c for classes, _ in per_image_labels for c in classes], dtype=np.int16),
+        "segment_offsets": np.concatenate([[0], np.cumsum(point_counts)]).astype(np.int64),
+        "coords": np.concatenate(all_segments).astype(np.float32) if all_segments else np.zeros((0, 2), np.float32),
+        "image_offsets": np.concatenate([[0], np.cumsum(instance_counts)]).astype(np.int64)
+    }
+
+    os.replace(tmp_images, cache_dir / "images.npy")
+    _write_atomic_npy(cache_dir / "hw.npy", hw)
+    tmp_labels = cache_dir / "labels.tmp.npz"
+    np.savez(tmp_labels, **labels)
+    os.replace(tmp_labels, cache_dir / "labels.npz")
+
+    issues = sum(1 for e in entries if e["issues"])
+    manifest = {
+        "version": CACHE_VERSION,
+        "source": str(img_dir),
+        "imgsz": imgsz,
+        "nc": nc,
+        "augment": augment,
+        "built_at": time.time(),
+        "stats": {**stats, "images": n, "instances": int(instance_counts.sum()), "images_with_issues": issues},
+        "entries": entries
+    }
+    # Manifest last: a crash mid-build leaves the old manifest, which forces a rebuild
+    tmp_manifest = manifest_path.with_name("manifest.json.tmp")
+    with open(tmp_manifest, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_manifest, manifest_path)
+
+    print(f"✅ Cached {n} images in {time.perf_counter() - started:.1f}s -> {cache_dir} "
+          f"(decoded {stats['decoded']}, reused {stats['reused_images']}, "
+          f"parsed {stats['parsed']} labels, {issues} images with label issues)")
+    return cache_dir
+
+
+# --- TRAINING INTEGRATION ---
+try:
+    from ultralytics.data.dataset import YOLODataset
+    from ultralytics.models.yolo.segment import SegmentationTrainer
+    from ultralytics.utils.torch_utils import de_parallel
+except ImportError:  # building the cache does not need Ultralytics
+    YOLODataset = SegmentationTrainer = None
+
+
+if YOLODataset is not None:
+
+    class CachedYOLODataset(YOLODataset):
+        """YOLODataset whose images and labels come from DatasetCaches instead of disk."""
+
+        def __init__(self, *args, caches=(), **kwargs):
+            """caches: [(image directory, its cache directory), ...], one per directory of the split."""
+            self.dataset_caches = [DatasetCache(cache_dir) for _, cache_dir in caches]
+            # Resolved image path -> (cache, row): file names may repeat across directories
+            self.cache_lookup = {
+                str(Path(img_dir).resolve() / name): (k, i)
+                for k, ((img_dir, _), cache) in enumerate(zip(caches, self.dataset_caches))
+                for i, name in enumerate(cache.files)
+            }
+            super().__init__(*args, **kwargs)
+
+        def get_labels(self):
+            labels = []
+            for im_file in self.im_files:
+                location = self.cache_lookup.get(str(Path(im_file).resolve()))
+                if location is None:
+                    continue
+                cache, i = self.dataset_caches[location[0]], location[1]
+                classes, segments = cache.labels(i)
+                h0, w0 = (int(v) for v in cache.hw[i, :2])
+                segments = [np.array(s) for s in segments]
+                bboxes = np.array(
+                    [[(s[:, 0].min() + s[:, 0].max()) / 2, (s[:, 1].min() + s[:, 1].max()) / 2,
+                      s[:, 0].max() - s[:, 0].min(), s[:, 1].max() - s[:, 1].min()] for s in segments],
+                    dtype=np.float32
+                ).reshape(-1, 4)
+                labels.append({
+                    "im_file": im_file,
+                    "shape": (h0, w0),
+                    "cls": np.asarray(classes, dtype=np.float32).reshape(-1, 1),
+                    "bboxes": bboxes,
+                    "segments": segments,
+                    "keypoints": None,
+                    "normalized": True,
+                    "bbox_format": "xywh",
+                    "cache_index": location
+                })
+            self.im_files = [lb["im_file"] for lb in labels]
+            return labels
+
+        def load_image(self, i, rect_mode=True):
+            # Already resized to the long side at build time; no decode, no resize
+            k, row = self.labels[i]["cache_index"]
+            im, hw0 = self.dataset_caches[k].image(row)
+            if self.augment:
+                # Mosaic samples neighbours from the buffer, same bookkeeping as BaseDataset
+                self.ims[i], self.im_hw0[i], self.im_hw[i] = im, hw0, im.shape[:2]
+                self.buffer.append(i)
+                if 1 < len(self.buffer) >= self.max_buffer_length:
+                    j = self.buffer.pop(0)
+                    self.ims[j], self.im_hw0[j], self.im_hw[j] = None, None, None
+            return im, hw0, im.shape[:2]
+
+    class CachedSegmentationTrainer(SegmentationTrainer):
+        """SegmentationTrainer that (re)builds and trains from the memory-mapped cache."""
+
+        def build_dataset(self, img_path, mode="train", batch=None):
+            paths = list(img_path) if isinstance(img_path, (list, tuple)) else [img_path]
+            not_dirs = [str(p) for p in paths if not Path(p).is_dir()]
+            if not_dirs:
+                raise ValueError(f"Dataset cache needs image directories, got {not_dirs}; train without "
+                                 "trainer=CachedSegmentationTrainer (--no-cache) to load these from disk")
+
+            # One cache per listed directory (combined datasets list several per split)
+            caches = []
+            for path in paths:
+                cache_dir = build_cache(path, imgsz=self.args.imgsz, nc=len(self.data["names"]), augment=mode == "train")
+                if any(cache_dir == other for _, other in caches):
+                    raise ValueError(f"Image directories of the {mode} split share the cache {cache_dir}")
+                caches.append((path, cache_dir))
+            stride = max(int(de_parallel(self.model).stride.max() if self.model else 0), 32)
+            return CachedYOLODataset(
+                caches=caches,
+                img_path=paths if len(paths) > 1 else paths[0],
+                imgsz=self.args.imgsz,
+                batch_size=batch,
+                augment=mode == "train",
+                hyp=self.args,
+                rect=self.args.rect or mode == "val",
+                cache=None,
+                single_cls=self.args.single_cls or False,
+                stride=stride,
+                pad=0.0 if mode == "train" else 0.5,
+                prefix=f"{mode}: ",
+                task=self.args.task,
+                classes=self.args.classes,
+                data=self.data,
+                fraction=self.args.fraction if mode == "train" else 1.0
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the memory-mapped training cache")
+    parser.add_argument("--data", default="lacqrtraining_dataset_v3", help="Dataset root (Roboflow layout)")
+    parser.add_argument("--splits", nargs="+", default=["train", "valid"])
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--nc", type=int, default=1)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--force", action="store_true", help="Ignore the existing cache and rebuild everything")
+    args = parser.parse_args()
+
+    for split in args.splits:
+        img_dir = Path(args.data) / split / "images"
+        if not img_dir.exists():
+            print(f"⚠️ Skipping {split}: {img_dir} not found")
+            continue
+        build_cache(img_dir, imgsz=args.imgsz, nc=args.nc, workers=args.workers, force=args.force, augment=split == "train")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 from ultralytics import YOLO
+from dataset_cache import CachedSegmentationTrainer
 from pathlib import Path
 
 def main():
@@ -24,7 +25,8 @@ def main():
         project='runs/segment',
         name='lacqr_v1_final',
         batch=4,      # Keep Safe Mode
-        workers=0     # Keep Safe Mode
+        workers=0,    # Keep Safe Mode
+        trainer=CachedSegmentationTrainer # Pre-decoded memmap cache (see dataset_cache.py)
     )
     
     print(f"🎉 SUCCESS! Final Model saved at: {results.save_dir}/weights/best.pt")
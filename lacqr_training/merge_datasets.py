@@ -0,0 +1,356 @@
+"""
+Merges several Roboflow YOLO exports into one deduplicated dataset.
+
+    python merge_datasets.py lacqrtraining_dataset_v1 lacqrtraining_dataset_v3 --out lacqr_merged \\
+        --class-map fingernail=nail --threshold 6
+
+1. Perceptual hash (64-bit DCT pHash) of every image, computed in parallel and
+   stored in a persistent index (.lacqr_phash_index.json next to the output), so
+   re-runs only hash new or modified files.
+2. Near-duplicates (Hamming distance <= --threshold) are found with multi-index
+   hashing: the hash is cut into threshold + 1 segments and, by pigeonhole, every
+   near pair shares at least one segment exactly. Only pairs that share a bucket
+   are compared, with a vectorized popcount.
+3. Duplicate clusters are resolved split-aware: a cluster that touches an eval split
+   lives only there (test > valid > train), which removes train -> eval leakage;
+   inside a split the highest-resolution copy is kept.
+4. Class names are remapped onto one schema (case-insensitive, plus --class-map
+   aliases; map to "-" to drop a class) and labels are rewritten accordingly.
+5. Writes <out>/{train,valid,test}/{images,labels}, data.yaml and merge_report.json.
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import cv2
+import numpy as np
+import yaml
+
+from dataset_cache import IMAGE_EXTENSIONS
+
+SPLITS = ("train", "valid", "test")
+# When a duplicate cluster spans splits it is kept in the first split of this list
+SPLIT_PRIORITY = ("test", "valid", "train")
+INDEX_NAME = ".lacqr_phash_index.json"
+HASH_BITS = 64
+
+
+# --- HASHING ---
+def phash(path):
+    """64-bit DCT perceptual hash (as a Python int) plus the image (h, w)."""
+    im = cv2.imread(str(path), cv2.IMREAD_GRAYSCALE)
+    if im is None:
+        raise ValueError(f"cannot decode {path}")
+    small = cv2.resize(im, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].flatten()
+    bits = low > np.median(low[1:])  # DC term excluded from the median
+    return int(np.packbits(bits).view(">u8")[0]), im.shape[:2]
+
+
+class HashIndex:
+    """Persistent path -> (size, mtime_ns, hash, h, w) index."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.entries = {}
+        if self.path.exists():
+            with open(self.path) as f:
+                self.entries = json.load(f)
+
+    def lookup(self, image_path):
+        stat = image_path.stat()
+        entry = self.entries.get(str(image_path.resolve()))
+        if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            return entry
+        return None
+
+    def store(self, image_path, value, shape):
+        stat = image_path.stat()
+        self.entries[str(image_path.resolve())] = {
+            "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": f"{value:016x}", "h": shape[0], "w": shape[1]
+        }
+
+    def save(self):
+        tmp = self.path.with_name(self.path.name + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(self.entries, f)
+        tmp.replace(self.path)
+
+
+def hash_all(records, index, workers=None):
+    """Fills record["hash"] / ["hw"] for every record, hashing only what the index lacks."""
+    todo = []
+    for record in records:
+        entry = index.lookup(record["image"])
+        if entry:
+            record["hash"], record["hw"] = int(entry["hash"], 16), (entry["h"], entry["w"])
+        else:
+            todo.append(record)
+
+    def work(record):
+        try:
+            return record, phash(record["image"])
+        except ValueError as e:
+            return record, e
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # cv2 decode/resize release the GIL
+        for record, result in pool.map(work, todo):
+            if isinstance(result, Exception):
+                failed.append(str(record["image"]))
+                continue
+            record["hash"], record["hw"] = result
+            index.store(record["image"], *result)
+    index.save()
+    return len(todo), failed
+
+
+# --- NEAR-DUPLICATE SEARCH ---
+def _segments(bits, count):
+    """Splits HASH_BITS into `count` contiguous (shift, width) segments."""
+    widths = [HASH_BITS // count + (1 if i < HASH_BITS % count else 0) for i in range(count)]
+    shifts = np.cumsum([0] + widths[:-1])
+    return list(zip(shifts, widths))
+
+
+def hamming(a, b):
+    """Vectorized popcount of a ^ b for uint64 arrays."""
+    x = np.bitwise_xor(a, b).view(np.uint8).reshape(-1, 8)
+    return np.unpackbits(x, axis=1).sum(axis=1)
+
+
+def near_duplicate_pairs(hashes, threshold):
+    """
+    All index pairs (i < j) with Hamming distance <= threshold, via multi-index hashing.
+    Returns (pairs (P, 2) int, distances (P,) int).
+    """
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    candidates = set()
+    for shift, width in _segments(HASH_BITS, threshold + 1):
+        keys = (hashes >> np.uint64(shift)) & np.uint64((1 << width) - 1)
+        buckets = defaultdict(list)
+        for i, key in enumerate(keys.tolist()):
+            buckets[key].append(i)
+        for members in buckets.values():
+            if len(members) > 1:
+                members = np.asarray(members)
+                ii, jj = np.triu_indices(len(members), k=1)
+                candidates.update(zip(members[ii].tolist(), members[jj].tolist()))
+
+    if not candidates:
+        return np.zeros((0, 2), dtype=int), np.zeros(0, dtype=int)
+    pairs = np.array(sorted(candidates), dtype=int)
+    distances = hamming(hashes[pairs[:, 0]], hashes[pairs[:, 1]])
+    keep = distances <= threshold
+    return pairs[keep], distances[keep]
+
+
+def clusters_from_pairs(n, pairs):
+    parent = list(range(n))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    for a, b in pairs:
+        ra, rb = find(a), find(b)
+        if ra != rb:
+            parent[rb] = ra
+    groups = defaultdict(list)
+    for i in range(n):
+        groups[find(i)].append(i)
+    return [members for members in groups.values() if len(members) > 1]
+
+
+# --- CLASS SCHEMA ---
+def build_class_map(datasets, aliases):
+    """
+    Maps every dataset's class ids onto one merged schema.
+    Returns (merged_names, {dataset_name: {old_id: new_id | None}}).
+    """
+    merged, per_dataset = [], {}
+    for dataset in datasets:
+        mapping = {}
+        for old_id, name in enumerate(dataset["names"]):
+            key = name.strip().lower()
+            target = aliases.get(key, key)
+            if target == "-":
+                mapping[old_id] = None
+                continue
+            if target not in merged:
+                merged.append(target)
+            mapping[old_id] = merged.index(target)
+        per_dataset[dataset["name"]] = mapping
+    return merged, per_dataset
+
+
+def load_dataset(root):
+    root = Path(root)
+    with open(root / "data.yaml") as f:
+        config = yaml.safe_load(f)
+    names = config.get("names", [])
+    if isinstance(names, dict):
+        names = [names[k] for k in sorted(names)]
+    records = []
+    for split in SPLITS:
+        img_dir = root / split / "images"
+        if not img_dir.exists():
+            continue
+        for image in sorted(p for p in img_dir.iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS):
+            records.append({
+                "dataset": root.name,
+                "split": split,
+                "image": image,
+                "label": root / split / "labels" / f"{image.stem}.txt"
+            })
+    return {"name": root.name, "root": root, "names": list(names), "records": records}
+
+
+def remap_label(path, mapping):
+    """Rewrites label lines with merged class ids; lines of dropped classes are removed."""
+    if not path.exists():
+        return "", 0
+    lines, dropped = [], 0
+    with open(path) as f:
+        for line in f:
+            parts = line.split()
+            if not parts:
+                continue
+            new_id = mapping.get(int(float(parts[0])))
+            if new_id is None:
+                dropped += 1
+                continue
+            lines.append(" ".join([str(new_id)] + parts[1:]))
+    return "\n".join(lines) + ("\n" if lines else ""), dropped
+
+
+# --- MERGE ---
+def merge(dataset_dirs, out_dir, threshold=6, aliases=None, workers=None):
+    started = time.perf_counter()
+    out_dir = Path(out_dir)
+    if out_dir.exists() and any(out_dir.iterdir()) and not (out_dir / "merge_report.json").exists():
+        raise ValueError(f"{out_dir} exists and is not a previous merge output, refusing to replace it")
+    # Everything is written to a staging directory and swapped in at the end, so files from a
+    # previous run (other threshold / split resolution) never survive into the new dataset
+    staging = out_dir.with_name(out_dir.name + ".tmp")
+    if staging.exists():
+        shutil.rmtree(staging)
+    staging.mkdir(parents=True)
+    datasets = [load_dataset(d) for d in dataset_dirs]
+    records = [r for d in datasets for r in d["records"]]
+    print(f"📚 {len(records)} images from {len(datasets)} datasets")
+
+    index = HashIndex(out_dir.parent / INDEX_NAME)
+    hashed, failed = hash_all(records, index, workers)
+    print(f"🔑 Hashed {hashed} new/changed images ({len(records) - hashed} from index, {len(failed)} unreadable)")
+    records = [r for r in records if "hash" in r]
+
+    pairs, distances = near_duplicate_pairs([r["hash"] for r in records], threshold)
+    clusters = clusters_from_pairs(len(records), pairs)
+
+    removed = set()
+    leaks = defaultdict(int)
+    within = defaultdict(int)
+    cluster_report = []
+    for members in clusters:
+        splits = {records[i]["split"] for i in members}
+        home = next(s for s in SPLIT_PRIORITY if s in splits)
+        in_home = [i for i in members if records[i]["split"] == home]
+        keeper = max(in_home, key=lambda i: records[i]["hw"][0] * records[i]["hw"][1])
+        for i in members:
+            if i == keeper:
+                continue
+            removed.add(i)
+            if records[i]["split"] == home:
+                within[home] += 1
+            else:
+                leaks[f"{records[i]['split']}->{home}"] += 1
+        if len(cluster_report) < 200:
+            cluster_report.append({
+                "kept": str(records[keeper]["image"]),
+                "removed": [str(records[i]["image"]) for i in members if i != keeper]
+            })
+
+    merged_names, class_maps = build_class_map(datasets, {k.lower(): v.lower() for k, v in (aliases or {}).items()})
+
+    counts = defaultdict(int)
+    dropped_instances = 0
+    for i, record in enumerate(records):
+        if i in removed:
+            continue
+        split = record["split"]
+        img_out = staging / split / "images"
+        lbl_out = staging / split / "labels"
+        img_out.mkdir(parents=True, exist_ok=True)
+        lbl_out.mkdir(parents=True, exist_ok=True)
+        # Dataset prefix keeps identically named Roboflow files apart
+        stem = f"{record['dataset']}__{record['image'].stem}"
+        shutil.copy2(record["image"], img_out / f"{stem}{record['image'].suffix}")
+        text, dropped = remap_label(record["label"], class_maps[record["dataset"]])
+        (lbl_out / f"{stem}.txt").write_text(text)
+        dropped_instances += dropped
+        counts[split] += 1
+
+    data_yaml = {split: f"{split}/images" for split in SPLITS if counts[split]}
+    data_yaml = {"path": str(out_dir.resolve()), **{("val" if k == "valid" else k): v for k, v in data_yaml.items()},
+                 "nc": len(merged_names), "names": merged_names}
+    with open(staging / "data.yaml", "w") as f:
+        yaml.dump(data_yaml, f, sort_keys=False)
+
+    report = {
+        "datasets": {d["name"]: {"images": len(d["records"]), "names": d["names"], "class_map": class_maps[d["name"]]} for d in datasets},
+        "threshold": threshold,
+        "input_images": len(records) + len(failed),
+        "unreadable": failed,
+        "near_duplicate_pairs": int(len(pairs)),
+        "duplicate_clusters": len(clusters),
+        "removed": len(removed),
+        "removed_within_split": dict(within),
+        "removed_cross_split_leaks": dict(leaks),
+        "dropped_instances": dropped_instances,
+        "output_images": dict(counts),
+        "names": merged_names,
+        "clusters": cluster_report,
+        "seconds": round(time.perf_counter() - started, 1)
+    }
+    with open(staging / "merge_report.json", "w") as f:
+        json.dump(report, f, indent=2)
+
+    previous = out_dir.with_name(out_dir.name + ".old")
+    if previous.exists():
+        shutil.rmtree(previous)
+    if out_dir.exists():
+        os.replace(out_dir, previous)
+    os.replace(staging, out_dir)
+    if previous.exists():
+        shutil.rmtree(previous)
+
+    print(f"🧹 Removed {len(removed)} near-duplicates ({sum(leaks.values())} cross-split leaks) "
+          f"from {len(clusters)} clusters")
+    print(f"✅ Merged dataset: {dict(counts)} -> {out_dir} (report: merge_report.json)")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge + deduplicate Roboflow YOLO datasets")
+    parser.add_argument("datasets", nargs="+", help="Dataset roots containing data.yaml")
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--threshold", type=int, default=6, help="Max pHash Hamming distance for a near-duplicate")
+    parser.add_argument("--class-map", nargs="*", default=[], metavar="OLD=NEW", help='Class aliases; NEW "-" drops the class')
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args()
+
+    aliases = dict(item.split("=", 1) for item in args.class_map)
+    merge(args.datasets, args.out, args.threshold, aliases, args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@ import shutil
 import yaml
 from pathlib import Path
 from ultralytics import YOLO
+from dataset_cache import CachedSegmentationTrainer
 
 def find_downloads_folder():
     """Robustly finds the Downloads folder."""
@@ -125,7 +126,8 @@ def main():
         project='runs/segment',
         batch=4,      # CRITICAL: Reduced from default (16)
         workers=0,    # CRITICAL: Fixes Windows process/RAM issues
-        exist_ok=True # Allow overwriting if needed
+        exist_ok=True, # Allow overwriting if needed
+        trainer=CachedSegmentationTrainer # Pre-decoded memmap cache: no JPEG decode/label parsing per epoch
     )
     
     print(f"🎉 SUCCESS! Combined Model saved at: {results.save_dir}/weights/best.pt")
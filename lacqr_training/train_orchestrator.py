@@ -0,0 +1,301 @@
+"""
+Checkpoint-aware training orchestrator (replaces the hardcoded paths and epoch
+counts of resume_training.py / finish_training.py).
+
+    python train_orchestrator.py --data combined_data.yaml --epochs 50 --hours 3
+    python train_orchestrator.py --mode extend --epochs 11 --patience 5
+
+- Finds the newest loadable runs/segment/*/weights/last.pt.
+    auto: an unfinished run is resumed (optimizer state, epoch counter), a finished
+          run is extended by fine-tuning its best.pt for --epochs more epochs, and
+          without checkpoints training starts from --base.
+- Budgets: --hours stops before the next epoch would overrun the wall clock
+  (the mean epoch time so far is the estimate); --max-epochs caps the epochs run
+  in this session, resumed or not.
+- Early stop: when validation mask mAP50-95 has not improved by --min-delta for
+  --patience epochs.
+- Ultralytics strips the optimizer from last.pt after any stop, so a budget stop
+  would look like a finished run. <run>/orchestrator_state.json records why the
+  session stopped, and a budget stop keeps a resumable copy in weights/resume.pt:
+  only a plateau stop or completing all epochs counts as finished.
+- Writes one JSON line per epoch to <run>/throughput.jsonl: images/s, train vs
+  validation time, and data-loader wait vs compute time within the train loop.
+"""
+import argparse
+import json
+import shutil
+import time
+from pathlib import Path
+
+from ultralytics import YOLO
+
+from dataset_cache import CachedSegmentationTrainer
+
+MASK_MAP_KEY = "metrics/mAP50-95(M)"
+MASK_MAP50_KEY = "metrics/mAP50(M)"
+BOX_MAP_KEY = "metrics/mAP50-95(B)"
+STATE_NAME = "orchestrator_state.json"
+RESUME_NAME = "resume.pt"
+
+
+def read_state(run_dir):
+    """The orchestrator state of a run ({} when it was never trained through the orchestrator)."""
+    try:
+        return json.loads((Path(run_dir) / STATE_NAME).read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def inspect_checkpoint(path):
+    """Loads checkpoint metadata; returns None for files that are not a usable checkpoint."""
+    import torch
+    try:
+        ckpt = torch.load(path, map_location="cpu", weights_only=False)
+    except Exception as e:
+        print(f"⚠️ Skipping unreadable checkpoint {path}: {e}")
+        return None
+    if not isinstance(ckpt, dict) or (ckpt.get("model") is None and ckpt.get("ema") is None):
+        return None
+    train_args = ckpt.get("train_args") or {}
+    epoch = ckpt.get("epoch", -1)
+    return {
+        "path": Path(path),
+        "run_dir": Path(path).parent.parent,
+        "epoch": epoch,
+        "epochs": train_args.get("epochs"),
+        # Ultralytics sets epoch = -1 (and drops the optimizer) once training stops for any reason
+        "finished": epoch == -1 or ckpt.get("optimizer") is None or bool(train_args.get("epochs") and epoch + 1 >= train_args["epochs"]),
+        "data": train_args.get("data"),
+        "mtime": Path(path).stat().st_mtime
+    }
+
+
+def inspect_run(last_path):
+    """
+    Checkpoint info for a run, corrected by its orchestrator state: a run stopped by
+    a budget is resumed from the unstripped weights/resume.pt instead of counting as finished.
+    """
+    info = inspect_checkpoint(last_path)
+    if info is None:
+        return None
+    state = read_state(info["run_dir"])
+    if state.get("resumable"):
+        resume = inspect_checkpoint(info["run_dir"] / "weights" / RESUME_NAME)
+        if resume and not resume["finished"]:
+            resume["mtime"] = info["mtime"]
+            return resume
+        print(f"⚠️ {info['run_dir'].name} stopped on a budget but has no usable {RESUME_NAME}")
+    return info
+
+
+def find_latest_checkpoint(project="runs/segment"):
+    """Newest valid last.pt under `project` (None if there is none)."""
+    candidates = sorted(Path(project).glob("*/weights/last.pt"), key=lambda p: p.stat().st_mtime, reverse=True)
+    for path in candidates:
+        info = inspect_run(path)
+        if info:
+            return info
+    return None
+
+
+class EpochMonitor:
+    """
+    Ultralytics callbacks: per-epoch throughput log, mask-mAP plateau early stopping,
+    wall-clock and epoch budgets. Stopping sets trainer.stop, which the trainer checks
+    right after on_fit_epoch_end (last.pt/best.pt are already saved at that point).
+    """
+
+    def __init__(self, log_name="throughput.jsonl", patience=10, min_delta=0.002, hours=None, max_epochs=None):
+        self.log_name = log_name
+        self.patience = patience
+        self.min_delta = min_delta
+        self.budget_seconds = hours * 3600 if hours else None
+        self.max_epochs = max_epochs
+        self.session_start = time.time()
+        self.epochs_run = 0
+        self.best = None
+        self.best_epoch = None
+        self.stop_reason = None
+        self.stop_kind = None
+        self._reset_epoch()
+
+    def _reset_epoch(self):
+        self.epoch_start = time.perf_counter()
+        self.last_batch_end = self.epoch_start
+        self.batch_start = None
+        self.data_wait = 0.0
+        self.compute = 0.0
+        self.batches = 0
+        self.train_end = None
+
+    def attach(self, model):
+        model.add_callback("on_train_epoch_start", self.on_train_epoch_start)
+        model.add_callback("on_train_batch_start", self.on_train_batch_start)
+        model.add_callback("on_train_batch_end", self.on_train_batch_end)
+        model.add_callback("on_train_epoch_end", self.on_train_epoch_end)
+        model.add_callback("on_fit_epoch_end", self.on_fit_epoch_end)
+
+    # --- callbacks ---
+    def on_train_epoch_start(self, trainer):
+        self._reset_epoch()
+
+    def on_train_batch_start(self, trainer):
+        # Called once the batch has come out of the loader: the gap since the last
+        # batch finished is time spent waiting on data
+        self.batch_start = time.perf_counter()
+        self.data_wait += self.batch_start - self.last_batch_end
+
+    def on_train_batch_end(self, trainer):
+        self.last_batch_end = time.perf_counter()
+        if self.batch_start is not None:
+            self.compute += self.last_batch_end - self.batch_start
+        self.batches += 1
+
+    def on_train_epoch_end(self, trainer):
+        self.train_end = time.perf_counter()
+
+    def on_fit_epoch_end(self, trainer):
+        now = time.perf_counter()
+        train_seconds = (self.train_end or now) - self.epoch_start
+        images = len(trainer.train_loader.dataset) if getattr(trainer, "train_loader", None) else None
+        metrics = trainer.metrics or {}
+        mask_map = metrics.get(MASK_MAP_KEY)
+        self.epochs_run += 1
+
+        improved = mask_map is not None and (self.best is None or mask_map > self.best + self.min_delta)
+        if improved:
+            self.best, self.best_epoch = mask_map, trainer.epoch
+
+        row = {
+            "epoch": trainer.epoch + 1,
+            "images": images,
+            "batches": self.batches,
+            "epoch_seconds": round(now - self.epoch_start, 3),
+            "train_seconds": round(train_seconds, 3),
+            "val_seconds": round(now - (self.train_end or now), 3),
+            "data_wait_seconds": round(self.data_wait, 3),
+            "compute_seconds": round(self.compute, 3),
+            "data_wait_fraction": round(self.data_wait / train_seconds, 4) if train_seconds else None,
+            "images_per_second": round(images / train_seconds, 2) if images and train_seconds else None,
+            "mask_map50_95": mask_map,
+            "mask_map50": metrics.get(MASK_MAP50_KEY),
+            "box_map50_95": metrics.get(BOX_MAP_KEY),
+            "best_mask_map50_95": self.best,
+            "elapsed_seconds": round(time.time() - self.session_start, 1)
+        }
+
+        self.stop_kind, self.stop_reason = self._should_stop(trainer, now - self.epoch_start)
+        row["stop"] = self.stop_reason
+        with open(Path(trainer.save_dir) / self.log_name, "a") as f:
+            f.write(json.dumps(row) + "\n")
+        self._save_state(trainer)
+
+        print(f"⏱️ Epoch {row['epoch']}: {row['images_per_second']} img/s, "
+              f"data wait {row['data_wait_seconds']}s / compute {row['compute_seconds']}s, mask mAP {mask_map}")
+        if self.stop_reason:
+            print(f"🛑 Stopping: {self.stop_reason}")
+            trainer.stop = True
+
+    def _save_state(self, trainer):
+        """
+        Records why this session is stopping. On a budget stop with epochs left, last.pt
+        (already saved for this epoch, optimizer included) is copied to resume.pt before
+        the trainer's final evaluation strips it.
+        """
+        weights = Path(trainer.save_dir) / "weights"
+        resumable = self.stop_kind == "budget" and trainer.epoch + 1 < trainer.epochs
+        if resumable and (weights / "last.pt").exists():
+            shutil.copy2(weights / "last.pt", weights / RESUME_NAME)
+        state = {
+            "epoch": trainer.epoch,
+            "epochs": trainer.epochs,
+            "stop_kind": self.stop_kind,
+            "stop": self.stop_reason,
+            "resumable": resumable,
+            "best_mask_map50_95": self.best,
+            "updated": time.time()
+        }
+        (Path(trainer.save_dir) / STATE_NAME).write_text(json.dumps(state, indent=2))
+
+    def _should_stop(self, trainer, epoch_seconds):
+        """(kind, reason): kind is "plateau" (the run is finished) or "budget" (resumable)."""
+        if self.best_epoch is not None and trainer.epoch - self.best_epoch >= self.patience:
+            return "plateau", f"mask mAP50-95 plateaued at {self.best:.4f} (epoch {self.best_epoch + 1}) for {self.patience} epochs"
+        if self.max_epochs and self.epochs_run >= self.max_epochs:
+            return "budget", f"epoch budget of {self.max_epochs} reached"
+        if self.budget_seconds:
+            elapsed = time.time() - self.session_start
+            mean_epoch = elapsed / self.epochs_run
+            if elapsed + max(mean_epoch, epoch_seconds) > self.budget_seconds:
+                return "budget", f"next epoch would exceed the {self.budget_seconds / 3600:.2f}h budget"
+        return None, None
+
+
+def plan(args):
+    """Decides resume / extend / fresh. Returns (mode, weights, checkpoint info)."""
+    latest = None if args.mode == "fresh" else find_latest_checkpoint(args.project)
+    if latest is None:
+        if args.mode in ("resume", "extend"):
+            raise FileNotFoundError(f"No valid checkpoint under {args.project}")
+        return "fresh", args.base, None
+
+    mode = args.mode
+    if mode == "auto":
+        mode = "extend" if latest["finished"] else "resume"
+    if mode == "resume" and latest["finished"]:
+        raise ValueError(f"{latest['path']} belongs to a finished run; use --mode extend")
+    if mode == "extend":
+        best = latest["run_dir"] / "weights" / "best.pt"
+        return mode, best if best.exists() else latest["path"], latest
+    return mode, latest["path"], latest
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lacqr training orchestrator")
+    parser.add_argument("--mode", choices=["auto", "resume", "extend", "fresh"], default="auto")
+    parser.add_argument("--data", default="combined_data.yaml")
+    parser.add_argument("--base", default="yolo11m-seg.pt", help="Starting weights when there is no checkpoint")
+    parser.add_argument("--project", default="runs/segment")
+    parser.add_argument("--name", default=None, help="Run name for extend/fresh runs")
+    parser.add_argument("--epochs", type=int, default=50, help="Epochs for extend/fresh runs")
+    parser.add_argument("--max-epochs", type=int, default=None, help="Cap on epochs run in this session")
+    parser.add_argument("--hours", type=float, default=None, help="Wall-clock budget for this session")
+    parser.add_argument("--patience", type=int, default=10, help="Epochs without mask mAP gain before stopping")
+    parser.add_argument("--min-delta", type=float, default=0.002)
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--batch", type=int, default=4)     # Safe Mode defaults
+    parser.add_argument("--workers", type=int, default=0)
+    parser.add_argument("--no-cache", action="store_true", help="Load from disk instead of the dataset cache")
+    args = parser.parse_args()
+
+    mode, weights, latest = plan(args)
+    monitor = EpochMonitor(patience=args.patience, min_delta=args.min_delta, hours=args.hours, max_epochs=args.max_epochs)
+    trainer = None if args.no_cache else CachedSegmentationTrainer
+
+    model = YOLO(str(weights))
+    monitor.attach(model)
+
+    if mode == "resume":
+        print(f"🔄 Resuming {latest['run_dir'].name} from epoch {latest['epoch'] + 1}/{latest['epochs']} ({weights})")
+        results = model.train(resume=True, trainer=trainer)
+    else:
+        name = args.name or (f"{latest['run_dir'].name}_ext" if latest else "lacqr_run")
+        print(f"🚀 {mode.capitalize()} run '{name}' from {weights}: up to {args.epochs} epochs")
+        results = model.train(
+            data=args.data,
+            epochs=args.epochs,
+            imgsz=args.imgsz,
+            project=args.project,
+            name=name,
+            batch=args.batch,
+            workers=args.workers,
+            trainer=trainer
+        )
+
+    save_dir = getattr(results, "save_dir", None) or (latest["run_dir"] if latest else args.project)
+    print(f"🎉 Done ({monitor.stop_reason or 'completed all epochs'}). "
+          f"Best mask mAP50-95: {monitor.best}. Weights: {save_dir}/weights/best.pt")
+
+
+if __name__ == "__main__":
+    main()